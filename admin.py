@@ -4,6 +4,7 @@ from aiogram.types import Message
 from aiogram.filters import Command
 from config import ADMIN_ID  # Импортируем ADMIN_ID из config
 from database import set_user_role  # Обновим импорт с учетом получения роли
+from utils.referral_helpers import rebuild_referral_stats, rebuild_referral_tree
 
 router = Router()
 
@@ -24,3 +25,17 @@ async def add_partner(message: Message):
     await set_user_role(user_id, 'partner')
 
     await message.answer(f"Пользователь с user_id {user_id} теперь партнёр!")
+
+
+@router.message(Command(commands=["rebuild_referral_stats"]))
+async def rebuild_referral_stats_command(message: Message):
+    if message.from_user.id != int(ADMIN_ID):
+        await message.answer("Только администратор может пересчитывать статистику.")
+        return
+
+    # Перестраиваем дерево рефералов, затем счётчики и заработок по таблице рефералов и журналу
+    edges = await rebuild_referral_tree()
+    count = await rebuild_referral_stats()
+    await message.answer(
+        f"Статистика рефералов пересчитана для {count} пользователей (связей в дереве: {edges})."
+    )
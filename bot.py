@@ -11,9 +11,20 @@ from handlers import (
 from handlers.handlers_for_study import router as study_router  # Подключаем весь маршрутизатор для учебных хэндлеров
 from handlers.referrals import referral_router  # Хэндлер для реферальной системы
 from database import initialize_db
+from utils.db_helpers import open_db, close_db
+from utils.middlewares import UserProfileMiddleware, CourseLoadersMiddleware
+from utils.fsm_storage import SQLiteStorage, create_fsm_storage, fsm_sweep_loop
+from utils.webhook import BOT_MODE, run_webhook
+from utils.sharding import BOT_WORKERS, ShardSupervisor, create_ingress_app, poll_updates
+from utils.rate_limiter import OUTBOUND_GLOBAL_RATE, OutboundRateLimiter, outbound_metrics_loop
+from payment import reconciliation_loop
 from admin import router as admin_router  # Подключаем админский маршрутизатор
 from handlers.info_handler import router as info_router
 from handlers.personal_info import router as myinfo
+from handlers.search_handler import router as search_router
+from handlers.broadcast_handler import router as broadcast_router
+from utils.menu import menu
+from utils.broadcast import broadcast_engine
 
 # Настроим логирование
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
@@ -21,7 +32,14 @@ logger = logging.getLogger(__name__)
 
 # Инициализация бота и диспетчера
 bot = Bot(token=TOKEN)
-dp = Dispatcher()
+# Все исходящие сообщения проходят через лимиты Telegram; общий лимит делится между процессами-обработчиками
+outbound_limiter = OutboundRateLimiter(global_rate=OUTBOUND_GLOBAL_RATE / BOT_WORKERS)
+bot.session.middleware(outbound_limiter)
+# Состояния диалогов хранятся вне процесса (config.FSM_STORAGE) и переживают перезапуск
+dp = Dispatcher(storage=create_fsm_storage())
+
+# Фоновые задачи, которые работают, пока запущен бот
+background_tasks = []
 
 async def set_commands(bot: Bot):
     commands = [
@@ -35,15 +53,54 @@ async def set_commands(bot: Bot):
         BotCommand(command="/view_courses", description="Посмотреть доступные курсы"),
         BotCommand(command="/add_lesson", description="Добавить новый урок"),
         BotCommand(command="/add_question", description="Добавить вопрос к уроку"),
-        BotCommand(command="/view_questions", description="Посмотреть вопросы")
+        BotCommand(command="/view_questions", description="Посмотреть вопросы"),
+        BotCommand(command="/search", description="Поиск продуктов и курсов"),
+        BotCommand(command="/broadcast", description="Рассылка пользователям")
     ]
     await bot.set_my_commands(commands)
 
-async def main():
-    logger.info("Запуск бота...")
-    await set_commands(bot)
+async def on_startup(shard: int = 0):
+    # Открываем пул соединений с базой данных до приёма первых обновлений
+    await open_db()
+    logger.info("Пул соединений с базой данных готов")
+    background_tasks.append(asyncio.create_task(outbound_metrics_loop(outbound_limiter)))
+    if shard != 0:
+        # При нескольких обработчиках фоновые задачи работают только в первом
+        return
+    background_tasks.append(asyncio.create_task(reconciliation_loop()))
+    # Рассылки и личные уведомления из очереди в базе (продолжаются с места остановки)
+    broadcast_engine.start(bot)
+    if isinstance(dp.storage, SQLiteStorage):
+        # Redis удаляет брошенные диалоги сам по TTL, SQLite — фоновой задачей
+        background_tasks.append(asyncio.create_task(fsm_sweep_loop(dp.storage)))
+
+async def on_shutdown():
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    await broadcast_engine.stop()
+
+    await dp.storage.close()
+
+    # Дожидаемся текущих запросов и закрываем соединения
+    await close_db()
+    logger.info("Соединения с базой данных закрыты")
+
+def setup_dispatcher() -> tuple[Dispatcher, Bot]:
+    """Подключает хуки, middleware и маршрутизаторы; вызывается один раз в каждом процессе."""
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
 
-    # Подключаем все маршрутизаторы
+    # Профиль пользователя (роль, язык, баланс) загружается один раз на обновление
+    dp.update.outer_middleware(UserProfileMiddleware())
+    # Курсы, уроки и вопросы в обработчиках загружаются пачками и запоминаются до конца обновления
+    dp.update.outer_middleware(CourseLoadersMiddleware())
+
+    # Подключаем все маршрутизаторы. Кнопки меню — первыми: один поиск по таблице вместо фильтра на каждую кнопку.
+    # Посреди сценария (состояние FSM не из menu.idle_states) кнопки не срабатывают, и текст получает сценарий;
+    # выйти из сценария можно кнопкой «Назад в главное меню» или командой /start
+    dp.include_router(menu.router)
     dp.include_router(start_handler.router)
     dp.include_router(balance_handler.router)
     dp.include_router(add_product_handler.router)
@@ -52,8 +109,38 @@ async def main():
     dp.include_router(info_router)
     dp.include_router(admin_router)  # Подключаем админский роутер
     dp.include_router(myinfo)
-    logger.info("Начинаем polling...")
-    await dp.start_polling(bot)
+    dp.include_router(search_router)  # Поиск: /search и инлайн-режим
+    dp.include_router(broadcast_router)  # Рассылки для администратора и партнёров
+    return dp, bot
+
+async def run_sharded():
+    """Супервизор: принимает обновления и раздаёт их BOT_WORKERS процессам по ID чата."""
+    supervisor = ShardSupervisor(setup_dispatcher)
+    if BOT_MODE == "webhook":
+        logger.info("Запускаем вебхук, обработчиков: %s", BOT_WORKERS)
+        await run_webhook(dp, bot, create_ingress_app(dp, bot, supervisor))
+        return
+    logger.info("Начинаем polling, обработчиков: %s", BOT_WORKERS)
+    await supervisor.start()
+    try:
+        await poll_updates(dp, bot, supervisor)
+    finally:
+        await supervisor.stop()
+        await bot.session.close()
+
+async def main():
+    logger.info("Запуск бота...")
+    await set_commands(bot)
+    setup_dispatcher()
+
+    if BOT_WORKERS > 1:
+        await run_sharded()
+    elif BOT_MODE == "webhook":
+        logger.info("Запускаем вебхук...")
+        await run_webhook(dp, bot)
+    else:
+        logger.info("Начинаем polling...")
+        await dp.start_polling(bot)
 
 if __name__ == "__main__":
     initialize_db()
@@ -1,192 +1,156 @@
 import sqlite3
-from config import DB_PATH
+from typing import Optional
+from utils.db_helpers import connect_db, run_db, run_write, db_execute, db_fetchone, db_fetchall
+from utils.storage_config import apply_journal_mode
+from migrations import apply_migrations
+from utils.catalog import product_catalog
+from utils.pagination import Page, FORWARD, fetch_keyset_page
+from utils.tags import normalize_tag, set_course_tags
+from utils.profiles import invalidate_user_profile, get_user_profile
+from utils.user_courses import invalidate_user_courses
+from utils.course_progress import (
+    get_course_progress, get_user_course_progress, invalidate_course_totals,
+    mark_lesson_completed_sync, set_question_completed_sync
+)
+from utils.broadcast import notify_user
+from messages import course_completed_message_ru, course_completed_message_en
+from payment import PaymentStatus, charge_for_product, charge_for_product_sync, debit, to_minor
+from utils.referral_helpers import (
+    get_referral_stats, invalidate_referral_stats, add_to_referral_tree_sync, pay_referral_bonuses_sync
+)
+
+# Размер страницы в списках курсов и уроков
+COURSES_PER_PAGE = 5
+LESSONS_PER_PAGE = 8
 
 
-
-# Функция для подключения к базе данных
-def connect_db():
-    return sqlite3.connect(DB_PATH)
+def initialize_db():
+    conn = connect_db()
+    try:
+        # Переводим базу в режим WAL: читатели больше не блокируются записью
+        apply_journal_mode(conn)
+        # Создаём и обновляем схему; если версия схемы актуальна, DDL не выполняется
+        apply_migrations(conn)
+    finally:
+        conn.close()
 
 
-def initialize_db():
-    with connect_db() as conn:
-        cursor = conn.cursor()
-
-        # Создание таблицы пользователей
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER UNIQUE,
-            username TEXT,
-            first_name TEXT,
-            language TEXT DEFAULT 'en',
-            balance REAL DEFAULT 0,
-            referral_link TEXT,
-            role TEXT DEFAULT 'user'  -- Добавляем новый столбец для роли
-        )
-        """)
-        # Создание таблицы продуктов (с добавлением столбца partner_id)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS products (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                description TEXT NOT NULL,
-                price REAL NOT NULL,
-                is_subscription INTEGER NOT NULL,
-                subscription_period TEXT,
-                partner_id INTEGER NOT NULL,
-                image TEXT,
-                type TEXT,  -- Тип продукта (например, "Корпоративный ретрит", "Онлайн-сессия")
-                code TEXT UNIQUE,  -- Уникальный код продукта
-                is_hidden INTEGER DEFAULT 0  -- Признак, скрыт ли продукт (0 - не скрыт, 1 - скрыт)
-            )
-        """)
-
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS purchases (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                product_id INTEGER NOT NULL,
-                purchase_date TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-            """)
-
-        # Таблица для хранения информации о рефералах
-        cursor.execute("""
-               CREATE TABLE IF NOT EXISTS referrals (
-                   id INTEGER PRIMARY KEY AUTOINCREMENT,
-                   referrer_id INTEGER,  -- ID пользователя, который пригласил
-                   referred_id INTEGER,  -- ID приглашённого пользователя
-                   timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-               )
-               """)
-        # Таблица для курсов
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS courses (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                description TEXT,
-                partner_id INTEGER
-            )
-        """)
-
-        # Таблица для уроков
-        cursor.execute("""
-                CREATE TABLE IF NOT EXISTS lessons (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    course_id INTEGER,
-                    title TEXT,
-                    description TEXT,
-                    material_link TEXT,
-                    FOREIGN KEY(course_id) REFERENCES courses(id)
-                )
-                """)
-
-        # Таблица для вопросов
-        cursor.execute("""
-                CREATE TABLE IF NOT EXISTS questions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    lesson_id INTEGER,
-                    text TEXT,
-                    options TEXT,
-                    correct_answer INTEGER,
-                    FOREIGN KEY(lesson_id) REFERENCES lessons(id)
-                )
-                """)
-        # Таблица для отслеживания прогресса пользователя
-        cursor.execute("""
-                CREATE TABLE IF NOT EXISTS user_progress (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,  -- ID пользователя
-                    lesson_id INTEGER,  -- ID урока
-                    completed BOOLEAN DEFAULT FALSE,  -- Флаг завершения урока
-                    completion_date DATETIME,  -- Дата завершения
-                    FOREIGN KEY(user_id) REFERENCES users(user_id),
-                    FOREIGN KEY(lesson_id) REFERENCES lessons(id)
-                )
-                """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS partners (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                credo TEXT NOT NULL,
-                logo_url TEXT,
-                show_in_list BOOLEAN DEFAULT TRUE
-            )
-        """)
-        conn.commit()
 
+def _insert_user(conn, user_id: int, username: str, first_name: str) -> bool:
+    # INSERT OR IGNORE опирается на UNIQUE(user_id): повторная регистрация ничего не меняет.
+    # Язык не задаём (NULL), пока пользователь его не выбрал — тогда действует DEFAULT_LANGUAGE
+    return conn.execute("""
+    INSERT OR IGNORE INTO users (user_id, username, first_name, role, language)
+    VALUES (?, ?, ?, ?, NULL)
+    """, (user_id, username, first_name, "user")).rowcount == 1  # Устанавливаем роль по умолчанию
 
 
 # Функция для добавления пользователя в базу данных, если его ещё нет
 async def add_user(user_id: int, username: str, first_name: str):
-    conn = connect_db()
-    cursor = conn.cursor()
+    await run_write(_insert_user, user_id, username, first_name)
+    invalidate_user_profile(user_id)
+
+
+async def user_exists(user_id: int) -> bool:
+    row = await db_fetchone("SELECT id FROM users WHERE user_id = ?", (user_id,))
+    return row is not None
+
+
+def _add_referral(conn, referrer_id: int, referred_id: int, bonus: float) -> list[int]:
+    # Сохраняем информацию о реферале в таблице "referrals".
+    # UNIQUE(referred_id): у пользователя один пригласивший, повторная запись ничего не начисляет
+    inserted = conn.execute("""
+        INSERT OR IGNORE INTO referrals (referrer_id, referred_id)
+        VALUES (?, ?)
+    """, (referrer_id, referred_id)).rowcount
+    if not inserted:
+        return []
+
+    # Добавляем приглашённого в дерево рефералов
+    add_to_referral_tree_sync(conn, referrer_id, referred_id)
 
-    # Проверка, существует ли уже пользователь в базе данных
-    cursor.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
-    if cursor.fetchone() is None:
-        cursor.execute("""
-        INSERT INTO users (user_id, username, first_name, role)
+    # Начисляем бонусы пригласившему и его предкам (записи в журнале баланса) и обновляем их статистику
+    return pay_referral_bonuses_sync(conn, referred_id, to_minor(bonus))
+
+
+def _register_user(conn, user_id: int, username: str, first_name: str, referrer_id: Optional[int],
+                   bonus: float) -> Optional[list[int]]:
+    if not _insert_user(conn, user_id, username, first_name):
+        return None
+    if referrer_id is None:
+        return []
+    return _add_referral(conn, referrer_id, user_id, bonus)
+
+
+def _invalidate_referrers(updated: list[int]):
+    for user_id in updated:
+        invalidate_referral_stats(user_id)
+        invalidate_user_profile(user_id)  # Изменился баланс
+
+
+async def register_user(user_id: int, username: str, first_name: str, referrer_id: int = None,
+                        bonus: float = 10) -> bool:
+    """
+    Регистрирует пользователя и, если он пришёл по реферальной ссылке, записывает реферала
+    и начисляет бонусы — одной операцией записи. Реферал засчитывается, только если пользователь
+    создан этим вызовом, поэтому одновременные /start не начислят бонус дважды.
+    :param referrer_id: ID пригласившего или None
+    :return: True, если пользователь создан, False — если он уже был зарегистрирован
+    """
+    updated = await run_write(_register_user, user_id, username, first_name, referrer_id, bonus)
+    invalidate_user_profile(user_id)
+    _invalidate_referrers(updated or [])
+    return updated is not None
+
+
+async def add_referral(referrer_id: int, referred_id: int, bonus: float = 10):
+    """Записывает реферала и начисляет бонусы по уровням в одной транзакции."""
+    _invalidate_referrers(await run_write(_add_referral, referrer_id, referred_id, bonus))
+
+
+async def add_partner(name: str, credo: str, logo_url: str = None, show_in_list: bool = True):
+    await db_execute("""
+        INSERT INTO partners (name, credo, logo_url, show_in_list)
         VALUES (?, ?, ?, ?)
-        """, (user_id, username, first_name, "user"))  # Устанавливаем роль по умолчанию
-        conn.commit()
-    conn.close()
-def add_partner(name: str, credo: str, logo_url: str = None, show_in_list: bool = True):
-        conn = connect_db()
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO partners (name, credo, logo_url, show_in_list)
-            VALUES (?, ?, ?, ?)
-        """, (name, credo, logo_url, show_in_list))
-        conn.commit()
-def get_visible_partners():
-        conn = connect_db()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT name, credo, logo_url
-            FROM partners
-            WHERE show_in_list = 1
-        """)
-        return cursor.fetchall()
+    """, (name, credo, logo_url, show_in_list))
+
+
+async def get_visible_partners():
+    rows = await db_fetchall("""
+        SELECT name, credo, logo_url
+        FROM partners
+        WHERE show_in_list = 1
+    """)
+    return [tuple(row) for row in rows]
 
 # Функция для установки роли пользователя
 async def set_user_role(user_id: int, role: str):
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE users SET role = ? WHERE user_id = ?", (role, user_id))
-    conn.commit()
-    conn.close()
+    await db_execute("UPDATE users SET role = ? WHERE user_id = ?", (role, user_id))
+    invalidate_user_profile(user_id)
+
+
+# Функция для сохранения выбранного языка пользователя
+async def set_user_language(user_id: int, language: str):
+    await db_execute("UPDATE users SET language = ? WHERE user_id = ?", (language, user_id))
+    invalidate_user_profile(user_id)
 
 
 # Функция для получения роли пользователя
 async def get_user_role(user_id: int):
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT role FROM users WHERE user_id = ?", (user_id,))
-    row = cursor.fetchone()
-    conn.close()
+    row = await db_fetchone("SELECT role FROM users WHERE user_id = ?", (user_id,))
     return row[0] if row else None
 
 async def is_partner(user_id: int):
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT role FROM users WHERE user_id = ?", (user_id,))
-    row = cursor.fetchone()
-    conn.close()
-    return row is not None and row[0] == "partner"
+    return await get_user_role(user_id) == "partner"
 # Получение баланса пользователя
 async def get_user_balance(user_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,))
-    result = cursor.fetchone()
-    conn.close()
+    result = await db_fetchone("SELECT balance FROM users WHERE user_id = ?", (user_id,))
     if result:
         return result[0]  # Возвращаем баланс
     else:
         return 0  # Если пользователь не найден, возвращаем 0
 
+
 async def process_payment(user_id: int, product_id: int) -> bool:
     """
     Проверяет баланс пользователя, списывает стоимость продукта и возвращает статус оплаты.
@@ -194,122 +158,62 @@ async def process_payment(user_id: int, product_id: int) -> bool:
     :param product_id: ID продукта
     :return: True, если оплата прошла успешно, иначе False
     """
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    try:
-        # Получаем баланс пользователя
-        user_balance = await get_user_balance(user_id)
-
-        # Получаем стоимость продукта
-        cursor.execute("SELECT price FROM products WHERE id = ?", (product_id,))
-        product = cursor.fetchone()
-        if not product:
-            return False  # Продукт не найден
-        product_price = product[0]
-
-        # Проверяем, достаточно ли средств на балансе
-        if user_balance < product_price:
-            return False  # Недостаточно средств
-
-        # Списываем стоимость продукта с баланса пользователя
-        new_balance = user_balance - product_price
-        cursor.execute("UPDATE users SET balance = ? WHERE user_id = ?", (new_balance, user_id))
-
-        # Фиксируем покупку в таблице `purchases`
-        cursor.execute("""
-        INSERT INTO purchases (user_id, product_id)
-        VALUES (?, ?)
-        """, (user_id, product_id))
+    result = await charge_for_product(user_id, product_id)
+    return result.status is PaymentStatus.SUCCESS
 
-        conn.commit()
-        return True  # Оплата прошла успешно
 
-    except Exception as e:
-        print(f"Ошибка при обработке оплаты: {e}")
-        conn.rollback()
-        return False
-
-    finally:
-        cursor.close()
-        conn.close()
-
-async def get_user_referral_link(user_id: int):
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
+def _get_user_referral_link(conn, user_id: int):
+    # Проверяем, есть ли пользователь в базе данных
+    result = conn.execute("SELECT referral_link FROM users WHERE user_id = ?", (user_id,)).fetchone()
 
-        # Проверяем, есть ли пользователь в базе данных
-        cursor.execute("SELECT referral_link FROM users WHERE user_id = ?", (user_id,))
-        result = cursor.fetchone()
+    if result and result[0]:
+        # Если ссылка уже существует, возвращаем её
+        return result[0]
 
-        if result and result[0]:
-            # Если ссылка уже существует, возвращаем её
-            return result[0]
+    # Если ссылки нет, проверяем, существует ли пользователь
+    if not result:
+        # Если пользователь отсутствует, выбрасываем исключение или обрабатываем это явно
+        raise ValueError("Пользователь не найден в базе данных. Сначала зарегистрируйтесь через /start.")
 
-        # Если ссылки нет, проверяем, существует ли пользователь
-        cursor.execute("SELECT id FROM users WHERE user_id = ?", (user_id,))
-        user_exists = cursor.fetchone()
-
-        if not user_exists:
-            # Если пользователь отсутствует, выбрасываем исключение или обрабатываем это явно
-            raise ValueError("Пользователь не найден в базе данных. Сначала зарегистрируйтесь через /start.")
+    # Создаём новую реферальную ссылку
+    referral_link = f"https://t.me/botkworktest_bot?start=ref{user_id}"
+    conn.execute(
+        "UPDATE users SET referral_link = ? WHERE user_id = ?",
+        (referral_link, user_id),
+    )
+    return referral_link
 
-        # Создаём новую реферальную ссылку
-        referral_link = f"https://t.me/botkworktest_bot?start=ref{user_id}"
-        cursor.execute(
-            "UPDATE users SET referral_link = ? WHERE user_id = ?",
-            (referral_link, user_id),
-        )
-        conn.commit()
 
-        return referral_link
+async def get_user_referral_link(user_id: int):
+    referral_link = await run_write(_get_user_referral_link, user_id)
+    invalidate_user_profile(user_id)
+    return referral_link
 
 async def get_courses_by_partner(partner_id: int) -> list[dict]:
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("""
+    courses = await db_fetchall("""
         SELECT id, title FROM courses WHERE partner_id = ?
     """, (partner_id,))
-    courses = cursor.fetchall()
-    conn.close()
 
     # Возвращаем курсы в виде списка словарей
     return [{"id": course[0], "title": course[1]} for course in courses]
 
 async def is_user_partner(user_id: int) -> bool:
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT role FROM users WHERE user_id = ?", (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result and result[0] == 'partner'
+    return await is_partner(user_id)
 # Получение списка продуктов
 async def get_product_list():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT name, price FROM products")
-    products = cursor.fetchall()
-    conn.close()
-    return [{"name": product[0], "price": product[1]} for product in products]
-
-async def is_user_partner(user_id: int) -> bool:
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT is_partner FROM users WHERE user_id = ?", (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] == 1 if result else False
+    # Из кэша каталога, как и остальные чтения продуктов
+    return [{"name": product["name"], "price": product["price"]} for product in await product_catalog.all_products()]
 
 # Добавление нового продукта
 async def add_product(name: str, description: str, price: float, partner_id: int):
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("""
+    cursor = await db_execute("""
         INSERT INTO products (name, description, price, partner_id)
         VALUES (?, ?, ?, ?)
     """, (name, description, price, partner_id))
-    conn.commit()
-    conn.close()
+    product_catalog.upsert({
+        "id": cursor.lastrowid, "name": name, "description": description, "price": float(price),
+        "image": None, "type": None, "code": None, "is_hidden": False,
+    })
 # Функция для добавления нового продукта
 async def add_product_to_db(
     name: str,
@@ -323,36 +227,25 @@ async def add_product_to_db(
     code: str = None,  # Уникальный код продукта
     is_hidden: bool = False  # Признак, скрыт ли продукт
 ):
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("""
+    cursor = await db_execute("""
     INSERT INTO products (name, description, price, is_subscription, partner_id, image, subscription_period, type, code, is_hidden)
     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     """, (name, description, price, is_subscription, partner_id, image, subscription_period, type, code, is_hidden))
-    conn.commit()
-    conn.close()
+
+    # Добавляем продукт в кэш каталога, не перечитывая весь каталог
+    product_catalog.upsert({
+        "id": cursor.lastrowid, "name": name, "description": description, "price": float(price),
+        "image": image, "type": type, "code": code, "is_hidden": bool(is_hidden),
+    })
 
 
 
 
 
 async def purchase_product(user_id: int, price: float) -> bool:
-    conn = connect_db()
-    cursor = conn.cursor()
-
-    # Проверяем, хватает ли баланса у пользователя
-    cursor.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,))
-    result = cursor.fetchone()
-    if result and result[0] >= price:
-        # Обновляем баланс
-        new_balance = result[0] - price
-        cursor.execute("UPDATE users SET balance = ? WHERE user_id = ?", (new_balance, user_id))
-        conn.commit()
-        conn.close()
-        return True  # Покупка успешна
-    else:
-        conn.close()
-        return False  # Недостаточно средств
+    # Проверка баланса и списание выполняются одним условным UPDATE
+    result = await debit(user_id, price)
+    return result.ok
 
 async def add_course(title: str, description: str, partner_id: int) -> int:
     """
@@ -364,111 +257,88 @@ async def add_course(title: str, description: str, partner_id: int) -> int:
     :return: ID добавленного курса.
     """
     try:
-        conn = connect_db()
-        cursor = conn.cursor()
-        cursor.execute("""
+        cursor = await db_execute("""
             INSERT INTO courses (title, description, partner_id)
             VALUES (?, ?, ?)
         """, (title, description, partner_id))
-        conn.commit()
-        course_id = cursor.lastrowid
-        return course_id
+        return cursor.lastrowid
     except sqlite3.Error as e:
         # Логирование ошибки
         print(f"Ошибка при добавлении курса: {e}")
         raise
-    finally:
-        # Закрытие соединения в любом случае
-        if conn:
-            conn.close()
 
 
 async def get_courses_for_partner(partner_id: int):
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, title, description FROM courses WHERE partner_id = ?", (partner_id,))
-    courses = cursor.fetchall()
-    conn.close()
+    courses = await db_fetchall("SELECT id, title, description FROM courses WHERE partner_id = ?", (partner_id,))
     return [{"id": course[0], "title": course[1], "description": course[2]} for course in courses]
 
 
 async def get_course_by_id(course_id: int):
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, title, description FROM courses WHERE id = ?", (course_id,))
-    course = cursor.fetchone()
-    conn.close()
+    course = await db_fetchone("SELECT id, title, description FROM courses WHERE id = ?", (course_id,))
     if not course:
         raise ValueError(f"Курс с ID {course_id} не найден.")
     return {"id": course[0], "title": course[1], "description": course[2]}
 
 
-async def get_all_courses():
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, title, description FROM courses")
-    courses = cursor.fetchall()
-    conn.close()
-    return [{"id": course[0], "title": course[1], "description": course[2]} for course in courses]
+def _course_page(page: Page) -> Page:
+    return page._replace(items=[{"id": row[0], "title": row[1], "description": row[2]} for row in page.items])
+
+async def get_courses_page(direction: str = FORWARD, key: int = 0, limit: int = COURSES_PER_PAGE) -> Page:
+    """Страница всех курсов по курсору (диапазон по первичному ключу)."""
+    page = await run_db(
+        fetch_keyset_page, "SELECT id, title, description FROM courses WHERE 1", (), "id", direction, key, limit
+    )
+    return _course_page(page)
+
+async def get_partner_courses_page(partner_id: int, direction: str = FORWARD, key: int = 0, limit: int = COURSES_PER_PAGE) -> Page:
+    """Страница курсов партнёра по курсору (диапазон по индексу (partner_id, id))."""
+    page = await run_db(
+        fetch_keyset_page, "SELECT id, title, description FROM courses WHERE partner_id = ?", (partner_id,),
+        "id", direction, key, limit
+    )
+    return _course_page(page)
 
 async def add_lesson(course_id: int, title: str, description: str, material_link: str = None):
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("""
+    await db_execute("""
     INSERT INTO lessons (course_id, title, description, material_link)
     VALUES (?, ?, ?, ?)
     """, (course_id, title, description, material_link))
-    conn.commit()
-    conn.close()
+    invalidate_course_totals(course_id)
 
 async def get_lesson_by_id(lesson_id: int):
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, title, description, material_link FROM lessons WHERE id = ?", (lesson_id,))
-    lesson = cursor.fetchone()
-    conn.close()
+    lesson = await db_fetchone("SELECT id, title, description, material_link FROM lessons WHERE id = ?", (lesson_id,))
     return {"id": lesson[0], "title": lesson[1], "description": lesson[2], "material_link": lesson[3]} if lesson else None
 
 async def get_lessons_for_course(course_id: int):
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, title, description FROM lessons WHERE course_id = ?", (course_id,))
-    lessons = cursor.fetchall()
-    conn.close()
+    lessons = await db_fetchall("SELECT id, title, description FROM lessons WHERE course_id = ?", (course_id,))
     return [{"id": lesson[0], "title": lesson[1], "description": lesson[2]} for lesson in lessons]
 
+async def get_lessons_page(course_id: int, direction: str = FORWARD, key: int = 0, limit: int = LESSONS_PER_PAGE) -> Page:
+    """Страница уроков курса по курсору (диапазон по индексу (course_id, id))."""
+    page = await run_db(
+        fetch_keyset_page, "SELECT id, title, description FROM lessons WHERE course_id = ?", (course_id,),
+        "id", direction, key, limit
+    )
+    return page._replace(items=[{"id": row[0], "title": row[1], "description": row[2]} for row in page.items])
+
 async def add_question(question_text: str, options: str, correct_answer: int, lesson_id: int):
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("""
+    await db_execute("""
         INSERT INTO questions (text, options, correct_answer, lesson_id) 
         VALUES (?, ?, ?, ?)
     """, (question_text, options, correct_answer, lesson_id))
-    conn.commit()
-    conn.close()
+    invalidate_course_totals()  # Курс вопроса известен только по уроку, вопросы добавляются редко
 
 
 async def get_questions_for_lesson(lesson_id: int):
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, text, options, correct_answer FROM questions WHERE lesson_id = ?", (lesson_id,))
-    questions = cursor.fetchall()
-    conn.close()
+    questions = await db_fetchall("SELECT id, text, options, correct_answer FROM questions WHERE lesson_id = ?", (lesson_id,))
     return [{"id": question[0], "text": question[1], "options": question[2], "correct_answer": question[3]} for question in questions]
 
 async def get_partner_for_course(course_id: int):
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT user_id FROM partners WHERE course_id = ?", (course_id,))
-    partner = cursor.fetchone()
-    conn.close()
+    partner = await db_fetchone("SELECT user_id FROM partners WHERE course_id = ?", (course_id,))
     return partner[0] if partner else None
 
 
 async def get_questions_for_partner(partner_id: int):
-    conn = connect_db()
-    cursor = conn.cursor()
-
     query = """
     SELECT q.text, q.options
     FROM questions q
@@ -477,10 +347,7 @@ async def get_questions_for_partner(partner_id: int):
     WHERE c.partner_id = ?
     """
 
-    cursor.execute(query, (partner_id,))
-    questions = cursor.fetchall()
-
-    conn.close()
+    questions = await db_fetchall(query, (partner_id,))
 
     question_list = []
     for question in questions:
@@ -491,47 +358,55 @@ async def get_questions_for_partner(partner_id: int):
 
     return question_list
 
-async def update_course_tags(course_id: int, tags: list[str]):
-    conn = connect_db()
-    cursor = conn.cursor()
-    tags_str = ",".join(tags)
-    cursor.execute("UPDATE courses SET tags = ? WHERE id = ?", (tags_str, course_id))
-    conn.commit()
-    conn.close()
+async def update_course_tags(course_id: int, tags: list[str]) -> list[str]:
+    return await set_course_tags(course_id, tags)
 
 async def get_courses_by_tag(tag: str):
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, title FROM courses WHERE tags LIKE ?", (f"%{tag}%",))
-    courses = cursor.fetchall()
-    conn.close()
-    return [{"id": course[0], "title": course[1]} for course in courses]
+    # Точное совпадение нормализованного тега: поиск по первичному ключу course_tags, а не LIKE по всем курсам
+    courses = await db_fetchall("""
+        SELECT c.id, c.title, c.description
+        FROM course_tags t
+        JOIN courses c ON c.id = t.course_id
+        WHERE t.tag = ?
+        ORDER BY t.course_id
+    """, (normalize_tag(tag),))
+    return [{"id": course[0], "title": course[1], "description": course[2]} for course in courses]
+
+async def get_courses_by_tag_page(tag: str, direction: str = FORWARD, key: int = 0, limit: int = COURSES_PER_PAGE) -> Page:
+    """Страница курсов с тегом по курсору (диапазон по первичному ключу (tag, course_id))."""
+    page = await run_db(fetch_keyset_page, """
+        SELECT c.id, c.title, c.description
+        FROM course_tags t
+        JOIN courses c ON c.id = t.course_id
+        WHERE t.tag = ?
+    """, (normalize_tag(tag),), "t.course_id", direction, key, limit)
+    return _course_page(page)
 
 async def get_user_progress(user_id: int):
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT COUNT(DISTINCT lesson_id) as completed, 
-               (SELECT COUNT(*) FROM lessons) as total
-        FROM user_progress WHERE user_id = ?
-    """, (user_id,))
-    progress = cursor.fetchone()
-    conn.close()
-    return {"completed_lessons": progress[0], "total_lessons": progress[1]} if progress else None
+    """Пройдено уроков из всех уроков купленных и начатых курсов (по сводке course_progress)."""
+    courses = await get_user_course_progress(user_id)
+    return {
+        "completed_lessons": sum(course.completed_lessons for course in courses),
+        "total_lessons": sum(course.total_lessons for course in courses),
+    }
 
 async def update_user_progress(user_id: int, lesson_id: int):
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("""
+    await db_execute("""
         INSERT OR IGNORE INTO user_progress (user_id, lesson_id)
         VALUES (?, ?)
     """, (user_id, lesson_id))
-    conn.commit()
-    conn.close()
+
+
+def _delete_course(conn, course_id):
+    conn.execute("DELETE FROM courses WHERE id = ?", (course_id,))
+    conn.execute("DELETE FROM lessons WHERE course_id = ?", (course_id,))
+    conn.execute("DELETE FROM course_progress WHERE course_id = ?", (course_id,))
+
 
 async def delete_course(course_id):
-    await db_execute("DELETE FROM courses WHERE id = ?", (course_id,))
-    await db_execute("DELETE FROM lessons WHERE course_id = ?", (course_id,))
+    await run_write(_delete_course, course_id)
+    invalidate_course_totals(course_id)
+    invalidate_user_courses()
 
 async def update_lesson_title(lesson_id, new_title):
     query = "UPDATE lessons SET title = ? WHERE id = ?"
@@ -543,289 +418,165 @@ async def get_user_for_question(question_id):
     return result['user_id'] if result else None
 
 
-def mark_lesson_as_completed(user_id, lesson_id):
-    with connect_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-        INSERT INTO user_progress (user_id, lesson_id, completed, completion_date)
-        VALUES (?, ?, TRUE, CURRENT_TIMESTAMP)
-        ON CONFLICT(user_id, lesson_id) 
-        DO UPDATE SET completed = TRUE, completion_date = CURRENT_TIMESTAMP
-        """, (user_id, lesson_id))
-        conn.commit()
+async def mark_lesson_as_completed(user_id, lesson_id):
+    # Отметка урока и сводка прогресса по курсу меняются в одной транзакции
+    await run_write(mark_lesson_completed_sync, user_id, lesson_id)
 
 async def get_completed_lessons(user_id, course_id):
     # Получить количество завершённых уроков для данного пользователя и курса
-    completed_lessons = await db.fetch_all(
+    completed_lessons = await db_fetchone(
         "SELECT COUNT(*) FROM lesson_progress WHERE user_id = ? AND course_id = ? AND is_completed = TRUE",
-        user_id, course_id
+        (user_id, course_id)
     )
-    return completed_lessons[0][0] if completed_lessons else 0
+    return completed_lessons[0] if completed_lessons else 0
 
 async def get_completed_questions(user_id, course_id):
     # Получить количество завершённых вопросов для данного пользователя и курса
-    completed_questions = await db.fetch_all(
-        "SELECT COUNT(*) FROM user_progress WHERE user_id = ? AND course_id = ? AND is_completed = TRUE",
-        user_id, course_id
+    completed_questions = await db_fetchone(
+        "SELECT COUNT(*) FROM user_progress "
+        "WHERE user_id = ? AND course_id = ? AND question_id IS NOT NULL AND is_completed = TRUE",
+        (user_id, course_id)
     )
-    return completed_questions[0][0] if completed_questions else 0
+    return completed_questions[0] if completed_questions else 0
 
 async def update_question_progress(user_id, course_id, lesson_id, question_id, is_completed):
-    await db.execute(
-        "INSERT INTO user_progress (user_id, course_id, lesson_id, question_id, is_completed) "
-        "VALUES (?, ?, ?, ?, ?) "
-        "ON CONFLICT(user_id, course_id, lesson_id, question_id) "
-        "DO UPDATE SET is_completed = ?",
-        user_id, course_id, lesson_id, question_id, is_completed, is_completed
-    )
+    await run_write(set_question_completed_sync, user_id, course_id, lesson_id, question_id, is_completed)
 async def update_lesson_progress(user_id, course_id, lesson_id, is_completed):
-    await db.execute(
+    await db_execute(
         "INSERT INTO lesson_progress (user_id, course_id, lesson_id, is_completed) "
         "VALUES (?, ?, ?, ?) "
         "ON CONFLICT(user_id, course_id, lesson_id) "
         "DO UPDATE SET is_completed = ?",
-        user_id, course_id, lesson_id, is_completed, is_completed
+        (user_id, course_id, lesson_id, is_completed, is_completed)
     )
 async def check_course_completion(user_id, course_id):
-    completed_lessons = await get_completed_lessons(user_id, course_id)
-    total_lessons = len(await get_lessons_for_course(course_id))  # Получаем все уроки курса
-
-    if completed_lessons == total_lessons:
+    progress = await get_course_progress(user_id, course_id)
+    if progress and progress["completed_lessons"] == progress["total_lessons"]:
         await notify_user_course_completed(user_id, course_id)
 
+async def notify_user_course_completed(user_id: int, course_id: int):
+    """Поздравление с окончанием курса; уходит через очередь рассылок вместе с обычными ответами."""
+    course = await db_fetchone("SELECT title FROM courses WHERE id = ?", (course_id,))
+    title = course[0] if course else str(course_id)
+    profile = await get_user_profile(user_id)
+    message = course_completed_message_en if profile.language == "en" else course_completed_message_ru
+    await notify_user(user_id, message.format(title=title))
+
 async def get_referral_count(user_id: int) -> int:
     """Получает количество приглашённых пользователей."""
-    query = """
-    SELECT COUNT(*) FROM referrals
-    WHERE referrer_id = ?
-    """
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute(query, (user_id,))
-    count = cursor.fetchone()[0]
-    return count
+    stats = await get_referral_stats(user_id)
+    return stats["count"]
 
-def get_user_earnings(user_id: int) -> int:
+async def get_user_earnings(user_id: int) -> float:
     """
     Получить заработок пользователя на основе приглашённых рефералов.
     :param user_id: ID пользователя
     :return: Заработанные бонусы
     """
-    query = """
-    SELECT COUNT(*) 
-    FROM referrals 
-    WHERE referrer_id = ?
-    """
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute(query, (user_id,))
-    result = cursor.fetchone()
-    referral_count = result[0] if result else 0  # Если результата нет, то 0
-    cursor.close()
-    conn.close()
-
-    # Каждый приглашённый приносит 10 Ved
-    earnings = referral_count * 10
-    return earnings
-def get_all_products():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM products")
-    products = cursor.fetchall()
-    conn.close()
-    return [
-        {"id": row[0], "name": row[1], "description": row[2], "price": row[3], "is_personal": bool(row[6])}
-        for row in products
-    ]
-def get_product_by_id(product_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, name, description, price, image, type, is_hidden
-        FROM products 
-        WHERE id = ?
-    """, (product_id,))
-    row = cursor.fetchone()
-    conn.close()
-
-    if row:
-        return {
-            "id": row[0],
-            "name": row[1],
-            "description": row[2],
-            "price": row[3],
-            "image": row[4],
-            "type": row[5],
-            "is_hidden": bool(row[6])
-        }
-    return None
+    stats = await get_referral_stats(user_id)
+    return stats["earnings"]
+# Продукты читаются из кэша каталога (utils/catalog.py), а не из базы на каждый запрос
+async def get_product_by_id(product_id):
+    return await product_catalog.get_by_id(product_id)
 # Функция для получения продукта по коду (с учетом скрытия)
-def get_product_by_code(code):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, name, description, price, image, type, is_hidden 
-        FROM products 
-        WHERE code = ?
-    """, (code,))
-    row = cursor.fetchone()
-    conn.close()
-
-    if row:
-        return {
-            "id": row[0],
-            "name": row[1],
-            "description": row[2],
-            "price": row[3],
-            "image": row[4],
-            "type": row[5],
-            "is_hidden": bool(row[6])  # Не проверяем скрытость, все показываем
-        }
-    return None
+async def get_product_by_code(code):
+    # Не проверяем скрытость, все показываем
+    return await product_catalog.get_by_code(code)
 
 
 # Функция для получения всех видимых продуктов (где is_hidden = 0)
-def get_visible_products():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name, description, price, image, type FROM products WHERE is_hidden = 0")
-    rows = cursor.fetchall()
-    conn.close()
-
-    products = []
-    for row in rows:
-        products.append({
-            "id": row[0],
-            "name": row[1],
-            "description": row[2],
-            "price": row[3],
-            "image": row[4],
-            "type": row[5]
-        })
-    return products
+async def get_visible_products():
+    return await product_catalog.visible_products()
 
 # Функция для получения всех продуктов, включая скрытые (по коду)
-def get_all_products():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name, description, price, image, type, is_hidden FROM products")
-    rows = cursor.fetchall()
-    conn.close()
-
-    products = []
-    for row in rows:
-        products.append({
-            "id": row[0],
-            "name": row[1],
-            "description": row[2],
-            "price": row[3],
-            "image": row[4],
-            "type": row[5],
-            "is_hidden": bool(row[6])
-        })
-    return products
+async def get_all_products():
+    return await product_catalog.all_products()
 
-def mark_product_as_purchased(user_id, product_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
+async def mark_product_as_purchased(user_id, product_id):
+    await db_execute("""
     INSERT INTO purchases (user_id, product_id)
     VALUES (?, ?)
     """, (user_id, product_id))
-    conn.commit()
-    conn.close()
+    invalidate_user_courses(user_id)
+
 
-async def purchase_course(user_id: int, product_id: int):
-    with connect_db() as conn:
-        cursor = conn.cursor()
+# Тексты ответов purchase_course для неуспешных платежей
+PURCHASE_COURSE_ERRORS = {
+    PaymentStatus.PRODUCT_NOT_FOUND: "Продукт не найден.",
+    PaymentStatus.USER_NOT_FOUND: "Пользователь не найден.",
+    PaymentStatus.INSUFFICIENT_FUNDS: "Недостаточно средств для покупки.",
+}
 
-        # Проверяем наличие продукта
-        cursor.execute("SELECT price FROM products WHERE id = ?", (product_id,))
-        product = cursor.fetchone()
-        if not product:
-            return "Продукт не найден."
 
-        price = product[0]
+def _purchase_course(conn, user_id: int, product_id: int, idempotency_key: str = None):
+    # Списываем сумму с баланса и добавляем покупку
+    result = charge_for_product_sync(conn, user_id, product_id, idempotency_key)
+    if not result.ok:
+        return PURCHASE_COURSE_ERRORS[result.status]
+
+    # Получаем курс, связанный с продуктом
+    course = conn.execute("SELECT id FROM courses WHERE id = ?", (product_id,)).fetchone()
+    if not course:
+        return "Курс не найден, но покупка зарегистрирована."
+
+    return f"Покупка успешно завершена. Вы получили доступ к курсу с ID {course[0]}."
 
-        # Проверяем баланс пользователя
-        cursor.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,))
-        user = cursor.fetchone()
-        if not user:
-            return "Пользователь не найден."
 
-        balance = user[0]
-        if balance < price:
-            return "Недостаточно средств для покупки."
+async def purchase_course(user_id: int, product_id: int, idempotency_key: str = None):
+    result = await run_write(_purchase_course, user_id, product_id, idempotency_key)
+    invalidate_user_profile(user_id)
+    invalidate_user_courses(user_id)
+    return result
 
-        # Списываем сумму с баланса
-        new_balance = balance - price
-        cursor.execute("UPDATE users SET balance = ? WHERE user_id = ?", (new_balance, user_id))
 
-        # Добавляем покупку
-        cursor.execute("INSERT INTO purchases (user_id, product_id) VALUES (?, ?)", (user_id, product_id))
+def _get_next_lesson(conn, user_id: int, course_id: int):
+    # Проверяем, куплен ли курс
+    purchase = conn.execute("""
+        SELECT 1 FROM purchases
+        WHERE user_id = ? AND product_id = ?
+    """, (user_id, course_id)).fetchone()
+    if not purchase:
+        return "У вас нет доступа к этому курсу."
 
-        # Получаем курс, связанный с продуктом
-        cursor.execute("SELECT id FROM courses WHERE id = ?", (product_id,))
-        course = cursor.fetchone()
-        if not course:
-            return "Курс не найден, но покупка зарегистрирована."
+    # Ищем первый незавершённый урок
+    lesson = conn.execute("""
+        SELECT l.id, l.title, l.description, l.material_link
+        FROM lessons l
+        LEFT JOIN user_progress up ON l.id = up.lesson_id AND up.user_id = ? AND up.question_id IS NULL
+        WHERE l.course_id = ? AND (up.completed IS NULL OR up.completed = 0)
+        ORDER BY l.id LIMIT 1
+    """, (user_id, course_id)).fetchone()
+    if not lesson:
+        return "Все уроки курса завершены."
 
-        conn.commit()
-        return f"Покупка успешно завершена. Вы получили доступ к курсу с ID {course[0]}."
+    lesson_id, title, description, material_link = lesson
+    return f"Следующий урок:\n{title}\n{description}\nМатериалы: {material_link}"
 
 
 async def get_next_lesson(user_id: int, course_id: int):
-    with connect_db() as conn:
-        cursor = conn.cursor()
-
-        # Проверяем, куплен ли курс
-        cursor.execute("""
-            SELECT 1 FROM purchases
-            WHERE user_id = ? AND product_id = ?
-        """, (user_id, course_id))
-        if not cursor.fetchone():
-            return "У вас нет доступа к этому курсу."
-
-        # Ищем первый незавершённый урок
-        cursor.execute("""
-            SELECT l.id, l.title, l.description, l.material_link
-            FROM lessons l
-            LEFT JOIN user_progress up ON l.id = up.lesson_id AND up.user_id = ?
-            WHERE l.course_id = ? AND (up.completed IS NULL OR up.completed = 0)
-            ORDER BY l.id LIMIT 1
-        """, (user_id, course_id))
-        lesson = cursor.fetchone()
-        if not lesson:
-            return "Все уроки курса завершены."
-
-        lesson_id, title, description, material_link = lesson
-        return f"Следующий урок:\n{title}\n{description}\nМатериалы: {material_link}"
+    return await run_db(_get_next_lesson, user_id, course_id)
+
+
+def _complete_lesson(conn, user_id: int, lesson_id: int):
+    # Проверяем, существует ли урок
+    if not conn.execute("SELECT id FROM lessons WHERE id = ?", (lesson_id,)).fetchone():
+        return "Урок не найден."
+
+    # Проверяем, завершал ли пользователь этот урок
+    progress = conn.execute("""
+        SELECT completed FROM user_progress
+        WHERE user_id = ? AND lesson_id = ? AND question_id IS NULL
+    """, (user_id, lesson_id)).fetchone()
+    if progress and progress[0]:
+        return "Вы уже завершили этот урок."
+
+    # Отмечаем урок завершённым и учитываем его в сводке прогресса по курсу
+    mark_lesson_completed_sync(conn, user_id, lesson_id)
+    return "Урок завершён."
+
+
 async def complete_lesson(user_id: int, lesson_id: int):
-    with connect_db() as conn:
-        cursor = conn.cursor()
-
-        # Проверяем, существует ли урок
-        cursor.execute("SELECT id FROM lessons WHERE id = ?", (lesson_id,))
-        if not cursor.fetchone():
-            return "Урок не найден."
-
-        # Проверяем, завершал ли пользователь этот урок
-        cursor.execute("""
-            SELECT completed FROM user_progress
-            WHERE user_id = ? AND lesson_id = ?
-        """, (user_id, lesson_id))
-        progress = cursor.fetchone()
-        if progress and progress[0]:
-            return "Вы уже завершили этот урок."
-
-        # Отмечаем урок завершённым
-        cursor.execute("""
-            INSERT INTO user_progress (user_id, lesson_id, completed, completion_date)
-            VALUES (?, ?, TRUE, CURRENT_TIMESTAMP)
-            ON CONFLICT(user_id, lesson_id) DO UPDATE SET completed = TRUE, completion_date = CURRENT_TIMESTAMP
-        """, (user_id, lesson_id))
-        conn.commit()
-        return "Урок завершён."
+    return await run_write(_complete_lesson, user_id, lesson_id)
 
 
 # Функция для создания таблиц при запуске бота
@@ -11,9 +11,13 @@ from aiogram.fsm.state import StatesGroup, State
 from database import get_product_list, get_user_role, purchase_product, add_product_to_db, get_all_products, \
     get_product_by_code, get_product_by_id
 from aiogram.filters.state import StateFilter
+from payment import charge_for_product, PaymentStatus
+from utils.catalog import product_catalog
+from utils.profiles import UserProfile
+from utils.pagination import FORWARD, decode_cursor
+from utils.keyboards import navigation_buttons, show_page
 from messages import *
-from math import ceil
-from bot import bot  # Импортируйте bot, если он определен в другом файле
+from utils.menu import menu
 
 router = Router()
 
@@ -32,11 +36,12 @@ class AddProductForm(StatesGroup):
 
 
 ITEMS_PER_PAGE = 5  # Количество продуктов на одной странице
+PRODUCTS_PAGER = "pp"  # Префикс callback_data кнопок перехода по страницам продуктов
 
 
-@router.message(lambda message: message.text == "Продукты")
-async def products(message: Message, state: FSMContext):
-    user_role = await get_user_role(message.from_user.id)
+@menu.button("Продукты")
+async def products(message: Message, state: FSMContext, profile: UserProfile):
+    user_role = profile.role
     buttons = [
         [KeyboardButton(text="Купить продукт")],
     ]
@@ -51,61 +56,38 @@ async def products(message: Message, state: FSMContext):
 
 
 # Обработка покупки продуктов (при нажатии на кнопку "Купить продукт")
-@router.message(lambda message: message.text == "Купить продукт" or message.text == "Buy Product")
+@menu.button("Купить продукт", "Buy Product")
 async def buy_product(message: Message):
-    await send_product_page(message.chat.id, 1)  # Начинаем с первой страницы
+    await send_product_page(message)  # Начинаем с первой страницы
 
-async def send_product_page(chat_id, page: int):
-    products = get_all_products()  # Получаем список продуктов
-    # Фильтруем только те продукты, которые не скрыты
-    visible_products = [p for p in products if not p.get("is_hidden", False)]
-
-    total_pages = ceil(len(visible_products) / ITEMS_PER_PAGE)  # Количество страниц
-    start_index = (page - 1) * ITEMS_PER_PAGE
-    end_index = start_index + ITEMS_PER_PAGE
-    products_to_show = visible_products[start_index:end_index]
+async def send_product_page(target: Message | CallbackQuery, direction: str = FORWARD, key: int = 0):
+    # Страница видимых продуктов по курсору: позиция находится двоичным поиском в кэше каталога,
+    # поэтому страницы не сдвигаются, когда партнёр добавляет новый продукт
+    page = await product_catalog.visible_keyset_page(direction, key, ITEMS_PER_PAGE)
 
     text = "📋 Список продуктов:\n\n"
-    for product in products_to_show:
+    for product in page.items:
         name = product["name"] if not product.get("is_personal") else "Продукт доступен по коду"
         text += f"🔹 {name} — {product['price']} VED\n"
 
     keyboard_buttons = []
 
-    for product in products_to_show:
+    for product in page.items:
         button_text = f"ℹ {product['name']} - {product['price']} VED"
         callback_data = f"product_info_{product['id']}"  # Используем ID продукта
-        keyboard_buttons.append(InlineKeyboardButton(text=button_text, callback_data=callback_data))
-
-    navigation_buttons = []
-    if page > 1:
-        navigation_buttons.append(InlineKeyboardButton(text="⬅️ Previous", callback_data=f"page_{page-1}"))
-    if page < total_pages:
-        navigation_buttons.append(InlineKeyboardButton(text="➡️ Next", callback_data=f"page_{page+1}"))
-
-    keyboard_buttons.extend(navigation_buttons)
-    keyboard_buttons.append(InlineKeyboardButton(text="🔍 Поиск по коду", callback_data="search_product_by_code"))
-
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[keyboard_buttons])
-
-    await bot.send_message(chat_id, text, reply_markup=keyboard)
-
-# Пагинация продуктов
-@router.message(lambda message: message.text == "⬅️ Previous" or message.text == "➡️ Next")
-async def paginate_products(message: Message, state: FSMContext):
-    # Получаем текущую страницу и обрабатываем переход
-    user_data = await state.get_data()
-    current_page = user_data.get("current_page", 1)
+        keyboard_buttons.append([InlineKeyboardButton(text=button_text, callback_data=callback_data)])
 
-    if message.text == "⬅️ Previous":
-        current_page -= 1
-    elif message.text == "➡️ Next":
-        current_page += 1
+    navigation = navigation_buttons(PRODUCTS_PAGER, page)
+    if navigation:
+        keyboard_buttons.append(navigation)
+    keyboard_buttons.append([InlineKeyboardButton(text="🔍 Поиск по коду", callback_data="search_product_by_code")])
+    # Каталог в инлайн-режиме листается без новых сообщений в чате
+    keyboard_buttons.append([InlineKeyboardButton(text="🔎 Открыть каталог", switch_inline_query_current_chat="")])
 
-    await state.update_data(current_page=current_page)
+    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
 
-    # Отправляем новую страницу продуктов
-    await send_product_page(message.chat.id, current_page)
+    # Первая страница — новое сообщение, переходы по страницам редактируют его
+    await show_page(target, text, keyboard)
 
 
 @router.callback_query(lambda callback: callback.data == "search_product_by_code")
@@ -120,7 +102,7 @@ async def search_product_by_code_input(message: Message, state: FSMContext):
     product_code = message.text.strip()  # Получаем введенный код
 
     # Получаем продукт по коду из базы данных
-    product = get_product_by_code(product_code)
+    product = await get_product_by_code(product_code)
 
     if product:
         # Отправляем информацию о продукте
@@ -137,16 +119,15 @@ async def search_product_by_code_input(message: Message, state: FSMContext):
     else:
         await message.answer(f"❌ Продукт с кодом {product_code} не найден.")
 
-    await state.finish()  # Завершаем состояние после обработки
+    await state.clear()  # Завершаем состояние после обработки
 
 
 
 
 # Обработчик для команды "Добавить продукт"
-@router.message(lambda message: message.text in ["Добавить продукт", "Add Product"])
-async def add_product(message: Message, state: FSMContext):
-    user_id = message.from_user.id
-    user_role = await get_user_role(user_id)
+@menu.button("Добавить продукт", "Add Product")
+async def add_product(message: Message, state: FSMContext, profile: UserProfile):
+    user_role = profile.role
 
     # Проверяем, что пользователь является партнером
     if user_role != 'partner':
@@ -295,7 +276,7 @@ async def save_product(message: Message, state: FSMContext):
 @router.callback_query(lambda callback: callback.data.startswith("product_info_"))
 async def product_info_handler(callback: CallbackQuery):
     product_id = int(callback.data.split("_")[2])  # Извлекаем ID продукта
-    product = get_product_by_id(product_id)  # Получаем продукт по ID
+    product = await get_product_by_id(product_id)  # Получаем продукт по ID
 
     if product:
         # Обработка скрытого продукта
@@ -309,17 +290,43 @@ async def product_info_handler(callback: CallbackQuery):
             f"{product['description']}\n\n"
             f"💰 Цена: {product['price']} VED"
         )
+        # Кнопка оплаты
+        keyboard = InlineKeyboardMarkup(
+            inline_keyboard=[[InlineKeyboardButton(text="Купить", callback_data=f"buy:{product['id']}")]]
+        )
         if product["image"]:
-            await callback.message.answer_photo(product["image"], caption=text, parse_mode="HTML")
+            await callback.message.answer_photo(product["image"], caption=text, parse_mode="HTML", reply_markup=keyboard)
         else:
-            await callback.message.answer(text, parse_mode="HTML")
+            await callback.message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+    else:
+        await callback.message.answer("❌ Продукт не найден.")
+
+
+@router.callback_query(lambda callback: callback.data.startswith("buy:"))
+async def buy_product_callback(callback: CallbackQuery):
+    product_id = int(callback.data.split(":")[1])
+    # Ключ идемпотентности привязан к покупателю и кнопке в конкретном сообщении: повторное нажатие
+    # той же кнопки не спишет деньги второй раз, а в групповом чате каждый нажавший платит за себя
+    idempotency_key = f"buy:{callback.from_user.id}:{callback.message.chat.id}:{callback.message.message_id}:{product_id}"
+    result = await charge_for_product(callback.from_user.id, product_id, idempotency_key)
+    await callback.answer()
+
+    if result.status is PaymentStatus.SUCCESS:
+        product = await get_product_by_id(product_id)
+        await callback.message.answer(purchase_success_message_ru.format(product_name=product["name"]))
+    elif result.status is PaymentStatus.DUPLICATE:
+        await callback.message.answer("Этот продукт уже оплачен.")
+    elif result.status is PaymentStatus.INSUFFICIENT_FUNDS:
+        await callback.message.answer(purchase_fail_message_ru)
+    elif result.status is PaymentStatus.USER_NOT_FOUND:
+        await callback.message.answer("Сначала зарегистрируйтесь с помощью команды /start.")
     else:
         await callback.message.answer("❌ Продукт не найден.")
 
 
 
 
-@router.callback_query(lambda callback: callback.data.startswith("page_"))
+@router.callback_query(lambda callback: callback.data.startswith(f"{PRODUCTS_PAGER}:"))
 async def pagination_handler(callback: CallbackQuery):
-    page = int(callback.data.split("_")[1])  # Извлекаем номер страницы
-    await send_product_page(callback.message.chat.id, page)  # Отправляем новую страницу продуктов
+    direction, key = decode_cursor(callback.data)  # Курсор соседней страницы
+    await send_product_page(callback, direction, key)
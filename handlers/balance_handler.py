@@ -1,23 +1,19 @@
 from aiogram import Router, types
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.fsm.context import FSMContext
-from database import get_user_balance  # Функция для получения баланса
 from config import CURRENCY
+from utils.profiles import UserProfile
 from messages import balance_message_ru, balance_message_en  # Ваши сообщения
+from utils.menu import menu
 
 router = Router()
 
 # Обработчик кнопки "Баланс"
-@router.message(lambda message: message.text == "Баланс")
-async def balance_button_handler(message: Message, state: FSMContext):
-    user_id = message.from_user.id
-
-    # Получаем язык пользователя из состояния
-    user_data = await state.get_data()
-    user_language = user_data.get('language', 'ru')  # По умолчанию русский
-
-    # Получаем баланс пользователя
-    balance = await get_user_balance(user_id)
+@menu.button("Баланс")
+async def balance_button_handler(message: Message, state: FSMContext, profile: UserProfile):
+    # Язык и баланс берём из профиля: любое изменение баланса сбрасывает профиль, так что снимок актуален
+    user_language = profile.language
+    balance = profile.balance
 
     # Формируем сообщение с балансом
     balance_message = ""
@@ -37,8 +33,10 @@ async def balance_button_handler(message: Message, state: FSMContext):
     await message.answer(balance_message, reply_markup=balance_markup)
 
 # Обработчик для возврата в главное меню
-@router.message(lambda message: message.text == "Вернуться в главное меню")
+@menu.button("Вернуться в главное меню", any_state=True)
 async def back_to_main_menu(message: Message, state: FSMContext):
+    # Выход из любого сценария: незавершённый диалог и его данные сбрасываются
+    await state.clear()
     menu_buttons = [
         [KeyboardButton(text="Продукты")],
         [KeyboardButton(text="Для друзей")],
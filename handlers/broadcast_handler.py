@@ -0,0 +1,119 @@
+from aiogram import Router
+from aiogram.types import Message
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import StatesGroup, State
+from aiogram.filters import Command, CommandObject
+from config import ADMIN_ID
+from utils.db_helpers import db_fetchone
+from utils.profiles import UserProfile
+from utils.broadcast import (
+    SEGMENTS, SEGMENTS_WITH_ARG, create_broadcast, get_broadcast, get_broadcasts_by_creator, cancel_broadcast,
+    format_broadcast,
+)
+
+router = Router()
+
+BROADCAST_USAGE = (
+    "Использование:\n"
+    "/broadcast all — всем пользователям\n"
+    "/broadcast product <ID> — покупателям продукта\n"
+    "/broadcast course <ID> — студентам курса\n"
+    "/broadcast referrals <user_id> — рефералам пользователя\n"
+    "Партнёры могут делать рассылку только студентам своих курсов."
+)
+
+
+class BroadcastStates(StatesGroup):
+    waiting_for_text = State()
+
+
+def is_admin(user_id: int) -> bool:
+    return user_id == int(ADMIN_ID)
+
+
+async def can_broadcast(user_id: int, profile: UserProfile, segment: str, segment_arg: int) -> bool:
+    if is_admin(user_id):
+        return True
+    if segment != "course" or not profile.is_partner:
+        return False
+    course = await db_fetchone("SELECT 1 FROM courses WHERE id = ? AND partner_id = ?", (segment_arg, user_id))
+    return course is not None
+
+
+@router.message(Command("broadcast"))
+async def broadcast_command(message: Message, command: CommandObject, state: FSMContext, profile: UserProfile):
+    args = (command.args or "").split()
+    segment = args[0] if args else None
+    if segment not in SEGMENTS or segment == "user":
+        await message.answer(BROADCAST_USAGE)
+        return
+
+    segment_arg = None
+    if segment in SEGMENTS_WITH_ARG:
+        if len(args) < 2 or not args[1].isdigit():
+            await message.answer(BROADCAST_USAGE)
+            return
+        segment_arg = int(args[1])
+
+    if not await can_broadcast(message.from_user.id, profile, segment, segment_arg):
+        await message.answer("У вас нет прав на эту рассылку.")
+        return
+
+    await state.set_state(BroadcastStates.waiting_for_text)
+    await state.update_data(segment=segment, segment_arg=segment_arg)
+    await message.answer(f"Рассылка: {SEGMENTS[segment][0]}. Отправьте текст сообщения (или /cancel для отмены):")
+
+
+@router.message(BroadcastStates.waiting_for_text, Command("cancel"))
+async def cancel_broadcast_text(message: Message, state: FSMContext):
+    await state.clear()
+    await message.answer("Рассылка отменена.")
+
+
+@router.message(BroadcastStates.waiting_for_text)
+async def process_broadcast_text(message: Message, state: FSMContext):
+    if not message.text:
+        await message.answer("Отправьте текст сообщения.")
+        return
+    data = await state.get_data()
+    await state.clear()
+    job = await create_broadcast(data["segment"], message.text, message.from_user.id, data["segment_arg"])
+    await message.answer(
+        f"Рассылка #{job['id']} поставлена в очередь, получателей: {job['total']}.\n"
+        f"Статус: /broadcast_status {job['id']}, остановить: /broadcast_cancel {job['id']}"
+    )
+
+
+async def get_own_broadcast(message: Message, command: CommandObject):
+    """Рассылка из аргумента команды, если её создал автор сообщения (или он администратор)."""
+    if not command.args or not command.args.strip().isdigit():
+        return None
+    job = await get_broadcast(int(command.args))
+    if job is None or (job["created_by"] != message.from_user.id and not is_admin(message.from_user.id)):
+        return None
+    return job
+
+
+@router.message(Command("broadcast_status"))
+async def broadcast_status(message: Message, command: CommandObject):
+    if command.args:
+        job = await get_own_broadcast(message, command)
+        await message.answer(format_broadcast(job) if job else "Рассылка не найдена.")
+        return
+    jobs = await get_broadcasts_by_creator(message.from_user.id)
+    if not jobs:
+        await message.answer("У вас нет рассылок.")
+        return
+    await message.answer("\n\n".join(format_broadcast(job) for job in jobs))
+
+
+@router.message(Command("broadcast_cancel"))
+async def broadcast_cancel(message: Message, command: CommandObject):
+    job = await get_own_broadcast(message, command)
+    if job is None:
+        await message.answer("Рассылка не найдена.")
+        return
+    if await cancel_broadcast(job["id"]):
+        await message.answer(f"Рассылка #{job['id']} остановлена.")
+    else:
+        await message.answer(f"Рассылка #{job['id']} уже завершена.")
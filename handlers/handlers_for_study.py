@@ -3,15 +3,32 @@ from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMar
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from database import (
-    add_course, add_lesson, add_question, get_course_by_id,
+    add_course, add_lesson, add_question,
     get_lesson_by_id, get_partner_for_course,
-    get_questions_for_partner, get_all_courses,get_courses_by_partner, is_partner, get_lessons_for_course
+    get_questions_for_partner, get_courses_by_partner, is_partner, get_lessons_for_course,
+    get_courses_page, get_partner_courses_page, get_lessons_page, update_course_tags, get_courses_by_tag_page,
+    get_user_course_progress
 )
-from aiogram.filters import Command, CommandStart, StateFilter, BaseFilter
+from aiogram.filters import Command, CommandObject, CommandStart, StateFilter, BaseFilter
+from utils.pagination import FORWARD, decode_cursor
+from utils.keyboards import navigation_buttons, show_page
+from utils.tags import get_tag_cloud, get_tag, get_tag_by_id
+from utils.profiles import UserProfile
+from utils.loaders import CourseLoaders, LessonRecord
 router = Router()
+# Префиксы callback_data кнопок перехода по страницам
+VIEW_COURSES_PAGER = "vc"  # /view_courses
+LESSON_COURSES_PAGER = "lc"  # Выбор курса для нового урока
+QUESTION_COURSES_PAGER = "qc"  # Выбор курса для нового вопроса
+LESSONS_PAGER = "ql"  # Выбор урока для нового вопроса, к префиксу добавляется ID курса
+TAG_COURSES_PAGER = "tc"  # Курсы с тегом, к префиксу добавляется ID тега
 class PartnerFilter(BaseFilter):
-    async def __call__(self, message: types.Message):
-        return await is_partner(message.from_user.id)
+    async def __call__(self, message: types.Message, profile: UserProfile):
+        # Роль из профиля, загруженного middleware для этого обновления
+        return profile.is_partner
+class LessonQuizStates(StatesGroup):
+    # Ждём ответа на вопрос урока; урок, варианты и правильный ответ — в данных состояния
+    answering = State()
 class QuestionStates(StatesGroup):
     waiting_for_course_selection = State()
     waiting_for_lesson_selection = State()
@@ -56,49 +73,58 @@ async def process_course_description(message: types.Message, state: FSMContext):
     await message.answer(f"Курс '{course_title}' добавлен. Теперь вы можете добавлять уроки.")
     await state.clear()
 @router.message(CommandStart())
-async def start_course(message: types.Message, state: FSMContext):
-    course = await get_course_by_id(1)
+async def start_course(message: types.Message, state: FSMContext, loaders: CourseLoaders):
+    # Курс с уроками и вопросами — три запроса при любом числе уроков
+    course = await loaders.course(1)
     if course and course.lessons:
         first_lesson = course.lessons[0]
-        await send_lesson_content(first_lesson, message)
-        await state.update_data(lesson_id=first_lesson.id)
+        await send_lesson_content(first_lesson, message, state)
     else:
         await message.answer("Курс не найден или уроки отсутствуют.")
-async def send_lesson_content(lesson, message: types.Message):
+async def send_lesson_content(lesson: LessonRecord, message: types.Message, state: FSMContext):
     await message.answer(f"Урок: {lesson.title}\nОписание: {lesson.description}")
     if lesson.material_link:
         await message.answer(f"Ссылка на материал: {lesson.material_link}")
-    await send_question(lesson, message)
-async def send_question(lesson, message: types.Message):
+    await send_question(lesson, message, state)
+async def send_question(lesson: LessonRecord, message: types.Message, state: FSMContext):
     for question in lesson.questions:
-        options = question.options.split(",")
-        markup = ReplyKeyboardMarkup(resize_keyboard=True)
-        for option in options:
-            markup.add(KeyboardButton(option))
+        markup = ReplyKeyboardMarkup(
+            keyboard=[[KeyboardButton(text=option)] for option in question.option_list]
+            + [[KeyboardButton(text="Назад в главное меню")]],
+            resize_keyboard=True
+        )
         await message.answer(question.text, reply_markup=markup)
-@router.message(lambda message: message.text in ["Option 1", "Option 2", "Option 3"])
-async def check_answer(message: types.Message, state: FSMContext):
+    if not lesson.questions:
+        await state.clear()
+        return
+    # Ответ проверяется по данным состояния, без запроса к базе на каждое сообщение.
+    # До ответа кнопки меню не срабатывают; выйти можно кнопкой «Назад в главное меню» или /start
+    question = lesson.questions[0]
+    await state.set_state(LessonQuizStates.answering)
+    await state.update_data(lesson_id=lesson.id, options=question.option_list, correct_option=question.correct_option)
+@router.message(StateFilter(LessonQuizStates.answering))
+async def check_answer(message: types.Message, state: FSMContext, loaders: CourseLoaders):
     selected_answer = message.text
     data = await state.get_data()
-    lesson_id = data.get('lesson_id')
-    lesson = await get_lesson_by_id(lesson_id)
-
-    options = lesson.options.split(",")
-    correct_answer = options[lesson.correct_answer]
-
-    if selected_answer == correct_answer:
+    if selected_answer not in data["options"]:
+        await message.answer("Выберите один из вариантов ответа на клавиатуре.")
+        return
+    lesson = await loaders.lesson(data["lesson_id"])
+    if lesson is None:
+        await state.clear()
+        await message.answer("Курс не найден или уроки отсутствуют.")
+        return
+    if selected_answer == data["correct_option"]:
         await message.answer("Ответ верный! Переходим к следующему уроку.")
-        next_lesson = await get_lesson_by_id(lesson_id + 1)
+        next_lesson = await loaders.next_lesson(lesson)
         if next_lesson:
-            await send_lesson_content(next_lesson, message)
-            await state.update_data(lesson_id=next_lesson.id)
+            await send_lesson_content(next_lesson, message, state)
         else:
+            await state.clear()
             await message.answer("Поздравляем, вы завершили курс!")
     else:
         await message.answer("Ответ неверный. Попробуйте снова.")
-        await send_question(lesson, message)
-async def get_next_lesson(current_lesson_id):
-    return await get_lesson_by_id(current_lesson_id + 1)
+        await send_question(lesson, message, state)
 @router.message(Command("ask_question"))
 async def ask_question(message: types.Message):
     course_id = 1
@@ -114,20 +140,52 @@ async def view_questions(message: types.Message):
             await message.answer(f"Вопрос: {question.text}\nОтветы: {question.options}")
     else:
         await message.answer("Вопросов не найдено.")
+async def send_partner_courses_page(
+    target: types.Message | types.CallbackQuery,
+    partner_id: int,
+    pager: str,
+    select_prefix: str,
+    text: str,
+    direction: str = FORWARD,
+    key: int = 0
+) -> bool:
+    """
+    Показывает страницу курсов партнёра с кнопками выбора
+    (новым сообщением в ответ на команду или вместо текущей страницы при переходе по кнопке).
+    :return: False, если у партнёра нет курсов
+    """
+    page = await get_partner_courses_page(partner_id, direction, key)
+    if not page.items:
+        if isinstance(target, types.CallbackQuery):
+            await target.answer()
+        return False
+    buttons = [
+        [InlineKeyboardButton(text=course["title"], callback_data=f"{select_prefix}{course['id']}")]
+        for course in page.items
+    ]
+    navigation = navigation_buttons(pager, page)
+    if navigation:
+        buttons.append(navigation)
+    await show_page(target, text, InlineKeyboardMarkup(inline_keyboard=buttons))
+    return True
 @router.message(Command("add_lesson"))
 async def add_lesson_command(message: types.Message, state: FSMContext):
     partner_id = message.from_user.id
-    courses = await get_courses_by_partner(partner_id)
-    if not courses:
+    has_courses = await send_partner_courses_page(
+        message, partner_id, LESSON_COURSES_PAGER, "select_course_",
+        "Выберите курс, к которому хотите добавить урок:"
+    )
+    if not has_courses:
         await message.answer("У вас пока нет созданных курсов. Сначала создайте курс с помощью команды /add_course.")
         return
-    buttons = [
-        InlineKeyboardButton(text=course["title"], callback_data=f"select_course_{course['id']}")
-        for course in courses
-    ]
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[buttons])
-    await message.answer("Выберите курс, к которому хотите добавить урок:", reply_markup=keyboard)
     await state.set_state("waiting_for_course_selection")
+@router.callback_query(lambda c: c.data.startswith(f"{LESSON_COURSES_PAGER}:"))
+async def paginate_lesson_courses(callback_query: types.CallbackQuery):
+    direction, key = decode_cursor(callback_query.data)
+    await send_partner_courses_page(
+        callback_query, callback_query.from_user.id, LESSON_COURSES_PAGER, "select_course_",
+        "Выберите курс, к которому хотите добавить урок:", direction, key
+    )
 @router.callback_query(StateFilter("waiting_for_course_selection"))
 async def process_course_selection(callback_query: types.CallbackQuery, state: FSMContext):
     data = callback_query.data
@@ -136,12 +194,12 @@ async def process_course_selection(callback_query: types.CallbackQuery, state: F
         return
     course_id = int(data.replace("select_course_", ""))
     await state.update_data(course_id=course_id)
-        await callback_query.message.answer("Введите название нового урока:")
+    await callback_query.message.answer("Введите название нового урока:")
     await state.set_state("waiting_for_lesson_title")
     await callback_query.answer()
 @router.message(StateFilter("waiting_for_course_selection"))
-async def process_course_selection(message: types.Message, state: FSMContext):
-    course = await get_course_by_id(message.text)  # Ensure course title matches exactly
+async def process_course_selection(message: types.Message, state: FSMContext, loaders: CourseLoaders):
+    course = await loaders.courses.load(int(message.text)) if message.text and message.text.isdigit() else None
     if not course:
         await message.answer("Курс не найден. Попробуйте снова.")
         return
@@ -176,22 +234,32 @@ async def process_course_description(message: types.Message, state: FSMContext):
 
     await message.answer(f"Курс '{course_title}' (ID: {course_id}) добавлен! Теперь вы можете добавлять уроки.")
     await state.clear()
+async def send_courses_page(target: types.Message | types.CallbackQuery, direction: str = FORWARD, key: int = 0):
+    page = await get_courses_page(direction, key)
+    if not page.items:
+        await show_page(target, "Курсы не найдены.")
+        return
+    text = "\n\n".join(f"Курс: {course['title']}\nОписание: {course['description']}" for course in page.items)
+    navigation = navigation_buttons(VIEW_COURSES_PAGER, page)
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[navigation]) if navigation else None
+    await show_page(target, text, keyboard)
 @router.message(Command("view_courses"))
 async def view_courses(message: types.Message):
-    courses = await get_all_courses()
-    if courses:
-        for course in courses:
-            await message.answer(f"Курс: {course.title}\nОписание: {course.description}")
-            await asyncio.sleep(0.5)
-    else:
-        await message.answer("Курсы не найдены.")
+    await send_courses_page(message)
+@router.callback_query(lambda c: c.data.startswith(f"{VIEW_COURSES_PAGER}:"))
+async def paginate_courses(callback_query: types.CallbackQuery):
+    direction, key = decode_cursor(callback_query.data)
+    await send_courses_page(callback_query, direction, key)
 @router.message(Command("view_course"))
-async def view_course(message: types.Message):
-    try:
-        course = await get_course_by_id()
-        await message.answer(f"Курс: {course.title}\nОписание: {course.description}")
-    except ValueError as e:
-        await message.answer(str(e))
+async def view_course(message: types.Message, command: CommandObject, loaders: CourseLoaders):
+    if not command.args or not command.args.strip().isdigit():
+        await message.answer("Использование: /view_course <ID курса>")
+        return
+    course = await loaders.courses.load(int(command.args))
+    if course is None:
+        await message.answer(f"Курс с ID {command.args.strip()} не найден.")
+        return
+    await message.answer(f"Курс: {course.title}\nОписание: {course.description}")
 @router.message(Command("add_tags"))
 async def add_tags_command(message: types.Message, state: FSMContext):
     await message.answer("Введите теги через запятую:")
@@ -207,20 +275,53 @@ async def process_tags(message: types.Message, state: FSMContext):
     await update_course_tags(course_id, tags)
     await message.answer("Теги обновлены.")
     await state.clear()
+async def send_tag_courses_page(target: types.Message | types.CallbackQuery, tag: dict, direction: str = FORWARD, key: int = 0):
+    page = await get_courses_by_tag_page(tag["tag"], direction, key)
+    if not page.items:
+        await show_page(target, "Курсы по данному тегу не найдены.")
+        return
+    text = f"Курсы с тегом «{tag['tag']}» ({tag['count']}):\n\n" + "\n\n".join(
+        f"Курс: {course['title']}\nОписание: {course['description']}" for course in page.items
+    )
+    navigation = navigation_buttons(f"{TAG_COURSES_PAGER}{tag['id']}", page)
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[navigation]) if navigation else None
+    await show_page(target, text, keyboard)
 @router.message(Command("search_by_tag"))
-async def search_courses_by_tag(message: types.Message):
-    await message.answer("Введите тег для поиска курсов:")
+async def search_courses_by_tag(message: types.Message, state: FSMContext):
+    # Облако тегов: самые популярные теги с количеством курсов
+    tags = await get_tag_cloud()
+    buttons = [
+        InlineKeyboardButton(text=f"{tag['tag']} ({tag['count']})", callback_data=f"tag_{tag['id']}")
+        for tag in tags
+    ]
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[buttons[i:i+2] for i in range(0, len(buttons), 2)]) if buttons else None
+    await message.answer("Выберите тег или введите его для поиска курсов:", reply_markup=keyboard)
     await state.set_state("waiting_for_tag_search")
 @router.message(StateFilter("waiting_for_tag_search"))
 async def process_tag_search(message: types.Message, state: FSMContext):
-    tag = message.text.strip()
-    courses = await get_courses_by_tag(tag)
-    if courses:
-        for course in courses:
-            await message.answer(f"Курс: {course['title']}\nОписание: {course['description']}")
+    tag = await get_tag(message.text)
+    if tag:
+        await send_tag_courses_page(message, tag)
     else:
         await message.answer("Курсы по данному тегу не найдены.")
     await state.clear()
+@router.callback_query(lambda c: c.data.startswith("tag_"))
+async def process_tag_selection(callback_query: types.CallbackQuery, state: FSMContext):
+    tag = await get_tag_by_id(int(callback_query.data.replace("tag_", "")))
+    await callback_query.answer()
+    await state.clear()
+    if tag:
+        await send_tag_courses_page(callback_query.message, tag)
+    else:
+        await callback_query.message.answer("Курсы по данному тегу не найдены.")
+@router.callback_query(lambda c: c.data.startswith(TAG_COURSES_PAGER) and ":" in c.data)
+async def paginate_tag_courses(callback_query: types.CallbackQuery):
+    tag = await get_tag_by_id(int(callback_query.data.split(":", 1)[0][len(TAG_COURSES_PAGER):]))
+    if not tag:
+        await show_page(callback_query, "Курсы по данному тегу не найдены.")
+        return
+    direction, key = decode_cursor(callback_query.data)
+    await send_tag_courses_page(callback_query, tag, direction, key)
 @router.message(Command("ask_master"))
 async def ask_master_command(message: types.Message, state: FSMContext):
     await message.answer("Введите ваш вопрос:")
@@ -262,25 +363,19 @@ async def process_answer(message: types.Message, state: FSMContext):
 
 @router.message(Command("my_progress"))
 async def view_progress(message: types.Message):
-    user_id = message.from_user.id
-    courses = await get_all_courses()
+    # Сводка по всем курсам пользователя — один запрос, количества уроков и вопросов из кэша
+    courses = await get_user_course_progress(message.from_user.id)
     progress_text = ""
 
     for course in courses:
-        completed_lessons = await get_completed_lessons(user_id, course.id)
-        total_lessons = len(course.lessons)
-        remaining_lessons = total_lessons - completed_lessons
-
-        # Прогресс по вопросам
-        completed_questions = await get_completed_questions(user_id, course.id)
-        total_questions = sum(len(lesson.questions) for lesson in course.lessons)
-        remaining_questions = total_questions - completed_questions
+        remaining_lessons = course.total_lessons - course.completed_lessons
+        remaining_questions = course.total_questions - course.completed_questions
 
         progress_text += (
             f"Курс: {course.title}\n"
-            f"Завершено уроков: {completed_lessons} из {total_lessons}\n"
+            f"Завершено уроков: {course.completed_lessons} из {course.total_lessons}\n"
             f"Осталось уроков: {remaining_lessons}\n"
-            f"Завершено вопросов: {completed_questions} из {total_questions}\n"
+            f"Завершено вопросов: {course.completed_questions} из {course.total_questions}\n"
             f"Осталось вопросов: {remaining_questions}\n\n"
         )
 
@@ -345,29 +440,68 @@ async def process_lesson_deletion(message: types.Message, state: FSMContext):
 @router.message(Command("add_question"))
 async def add_question_command(message: types.Message, state: FSMContext):
     partner_id = message.from_user.id
-    courses = await get_courses_by_partner(partner_id)
+    # Сначала выбирается курс, затем урок в нём: каждый список листается постранично
+    has_courses = await send_partner_courses_page(
+        message, partner_id, QUESTION_COURSES_PAGER, "question_course_",
+        "Выберите курс, к уроку которого хотите добавить вопрос:"
+    )
 
-    if not courses:
+    if not has_courses:
         await message.answer("У вас пока нет созданных курсов. Сначала создайте курс с помощью команды /add_course.")
         return
 
-    lessons = []
-    for course in courses:
-        lessons.extend(await get_lessons_for_course(course["id"]))  # Используем уже готовую функцию
+    await state.set_state(QuestionStates.waiting_for_course_selection)
 
-    if not lessons:
-        await message.answer("У вас пока нет уроков. Сначала создайте уроки.")
-        return
 
+@router.callback_query(lambda c: c.data.startswith(f"{QUESTION_COURSES_PAGER}:"))
+async def paginate_question_courses(callback_query: CallbackQuery):
+    direction, key = decode_cursor(callback_query.data)
+    await send_partner_courses_page(
+        callback_query, callback_query.from_user.id, QUESTION_COURSES_PAGER, "question_course_",
+        "Выберите курс, к уроку которого хотите добавить вопрос:", direction, key
+    )
+
+
+async def send_lessons_page(target: types.Message | CallbackQuery, course_id: int, direction: str = FORWARD, key: int = 0) -> bool:
+    """
+    Показывает страницу уроков курса с кнопками выбора.
+    :return: False, если в курсе нет уроков
+    """
+    page = await get_lessons_page(course_id, direction, key)
+    if not page.items:
+        if isinstance(target, CallbackQuery):
+            await target.answer()
+        return False
     buttons = [
         InlineKeyboardButton(text=lesson["title"], callback_data=f"select_lesson_{lesson['id']}")
-        for lesson in lessons
+        for lesson in page.items
     ]
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[buttons[i:i+2] for i in range(0, len(buttons), 2)])
-    await message.answer("Выберите урок, к которому хотите добавить вопрос:", reply_markup=keyboard)
+    keyboard_rows = [buttons[i:i+2] for i in range(0, len(buttons), 2)]
+    navigation = navigation_buttons(f"{LESSONS_PAGER}{course_id}", page)
+    if navigation:
+        keyboard_rows.append(navigation)
+    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_rows)
+    await show_page(target, "Выберите урок, к которому хотите добавить вопрос:", keyboard)
+    return True
+
+
+# 1. Обработка выбора курса
+@router.callback_query(lambda c: c.data.startswith("question_course_"))
+async def handle_question_course_selection(callback_query: CallbackQuery, state: FSMContext):
+    course_id = int(callback_query.data.replace("question_course_", ""))
+    # Список уроков заменяет список курсов в том же сообщении
+    if not await send_lessons_page(callback_query, course_id):
+        await callback_query.message.answer("В этом курсе пока нет уроков. Сначала создайте уроки.")
+        return
     await state.set_state(QuestionStates.waiting_for_lesson_selection)
 
 
+@router.callback_query(lambda c: c.data.startswith(LESSONS_PAGER) and ":" in c.data)
+async def paginate_lessons(callback_query: CallbackQuery):
+    course_id = int(callback_query.data.split(":", 1)[0][len(LESSONS_PAGER):])
+    direction, key = decode_cursor(callback_query.data)
+    await send_lessons_page(callback_query, course_id, direction, key)
+
 
 # 2. Обработка выбора урока
 @router.callback_query(lambda c: c.data.startswith("select_lesson_"))
@@ -5,6 +5,7 @@ from aiogram.filters.state import StateFilter
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from database import get_visible_partners, add_partner
+from utils.menu import menu
 router = Router()
 
 class PartnerStates(StatesGroup):
@@ -12,7 +13,7 @@ class PartnerStates(StatesGroup):
 
 
 # Главное меню информации
-@router.message(lambda message: message.text == "Инфо")
+@menu.button("Инфо")
 async def info_main_menu(message: Message):
     buttons = [
         [KeyboardButton(text="О нас")],
@@ -25,7 +26,7 @@ async def info_main_menu(message: Message):
     await message.answer("Выберите интересующий раздел:", reply_markup=keyboard)
 
 # Подменю "О нас"
-@router.message(lambda message: message.text == "О нас")
+@menu.button("О нас")
 async def about_us(message: Message):
     about_text = (
         "RaJah.WS — мы группа энтузиастов, открывших инструменты комплексного развития.\n\n"
@@ -38,7 +39,7 @@ async def about_us(message: Message):
     await message.answer(about_text, disable_web_page_preview=True)
 
 # Подменю "Правила"
-@router.message(lambda message: message.text == "Правила")
+@menu.button("Правила")
 async def rules(message: Message):
     rules_text = (
         "Честность, порядочность, дисциплинированность, склонность к развитию и забота об окружающем мире…\n\n"
@@ -48,7 +49,7 @@ async def rules(message: Message):
     await message.answer(rules_text, disable_web_page_preview=True)
 
 # Подменю "Обратная связь"
-@router.message(lambda message: message.text == "Обратная связь")
+@menu.button("Обратная связь")
 async def feedback(message: Message):
     feedback_text = (
         "Если у вас есть вопросы или предложения, напишите нам:\n\n"
@@ -58,7 +59,7 @@ async def feedback(message: Message):
     )
     await message.answer(feedback_text, disable_web_page_preview=True)
 
-@router.message(lambda message: message.text == "Партнеры")
+@menu.button("Партнеры")
 async def partners_menu(message: Message):
     buttons = [
         [KeyboardButton(text="Информация о партнерах")],
@@ -68,9 +69,9 @@ async def partners_menu(message: Message):
     keyboard = ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
     await message.answer("Выберите действие:", reply_markup=keyboard)
 
-@router.message(lambda message: message.text == "Информация о партнёрах")
+@menu.button("Информация о партнёрах")
 async def partner_info(message: Message):
-    partners = get_visible_partners()
+    partners = await get_visible_partners()
 
     if not partners:
         await message.answer("Пока что список партнёров пуст.")
@@ -86,7 +87,7 @@ async def partner_info(message: Message):
 
     await message.answer(response, disable_web_page_preview=False)
 
-@router.message(lambda message: message.text == "Стать партнёром")
+@menu.button("Стать партнёром")
 async def become_partner(message: Message, state: FSMContext):
     await message.answer(
         "Чтобы стать партнёром, отправьте следующие данные в формате:\n\n"
@@ -108,13 +109,15 @@ async def process_partner_info(message: Message, state: FSMContext):
     credo = data[1].strip()
     logo_url = data[2].strip() if len(data) > 2 else None
 
-    add_partner(name, credo, logo_url)
+    await add_partner(name, credo, logo_url)
     await state.clear()
 
     await message.answer("Ваши данные успешно добавлены в список партнёров!")
 
-@router.message(lambda message: message.text == "Назад в главное меню")
-async def back_to_main_menu(message: Message):
+@menu.button("Назад в главное меню", any_state=True)
+async def back_to_main_menu(message: Message, state: FSMContext):
+    # Выход из любого сценария: незавершённый диалог и его данные сбрасываются
+    await state.clear()
     buttons = [
         [KeyboardButton(text="Продукты")],
         [KeyboardButton(text="Для друзей")],
@@ -1,18 +1,22 @@
 from aiogram import Router, types
-from aiogram.dispatcher.filters import Command
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
-from database import get_user_courses, get_course_progress  # Функции для работы с БД
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+from database import get_course_progress  # Функции для работы с БД
+from utils.user_courses import get_user_courses
+from utils.menu import menu
+from utils.user_courses import user_has_course
 
 router = Router()
 
+# Префикс callback-данных кнопки курса: course_progress:<ID курса>
+COURSE_PROGRESS_PREFIX = "course_progress:"
+
 # Обработчик кнопки "Личный кабинет"
-@router.message(lambda message: message.text.lower() == "личный кабинет")
+@menu.button("Личный кабинет")
 async def personal_info_menu(message: types.Message):
     """Меню личного кабинета."""
-    keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
-    keyboard.add(
-        KeyboardButton(text="Мои покупки"),
-        KeyboardButton(text="Настройки")
+    keyboard = ReplyKeyboardMarkup(
+        keyboard=[[KeyboardButton(text="Мои покупки"), KeyboardButton(text="Настройки")]],
+        resize_keyboard=True
     )
     await message.answer(
         MESSAGES["personal_info"]["welcome"],
@@ -21,19 +25,21 @@ async def personal_info_menu(message: types.Message):
 
 
 # Обработчик кнопки "Мои покупки"
-@router.message(lambda message: message.text.lower() == "мои покупки")
+@menu.button("Мои покупки")
 async def show_purchases(message: types.Message):
     """Отображение списка приобретённых курсов."""
     user_id = message.from_user.id
-    courses = get_user_courses(user_id)  # Получаем список курсов из БД
+    courses = await get_user_courses(user_id)  # Индекс купленных курсов (кэшируется)
 
     if not courses:
         await message.answer(MESSAGES["personal_info"]["no_purchases"])
         return
 
-    keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
-    for course in courses:
-        keyboard.add(KeyboardButton(text=course["title"]))
+    # Кнопки несут ID курса, поэтому обычные сообщения в чате не нужно сверять с названиями курсов
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=course["title"], callback_data=f"{COURSE_PROGRESS_PREFIX}{course['id']}")]
+        for course in courses
+    ])
 
     await message.answer(
         MESSAGES["personal_info"]["purchases_list"],
@@ -42,17 +48,20 @@ async def show_purchases(message: types.Message):
 
 
 # Обработчик кнопки курса
-@router.message(lambda message: any(
-    course["title"].lower() in message.text.lower() for course in get_user_courses(message.from_user.id)))
-async def show_course_progress(message: types.Message):
+@router.callback_query(lambda callback: callback.data.startswith(COURSE_PROGRESS_PREFIX))
+async def show_course_progress(callback: types.CallbackQuery):
     """Отображение прогресса по выбранному курсу."""
-    user_id = message.from_user.id
-    course_title = message.text
-    course = next(course for course in get_user_courses(user_id) if course["title"] == course_title)
-    progress = get_course_progress(user_id, course["id"])  # Получаем прогресс из БД
+    await callback.answer()
+    user_id = callback.from_user.id
+    course_id = callback.data[len(COURSE_PROGRESS_PREFIX):]
+    # Доступ проверяем по индексу купленных курсов, прогресс читаем одним запросом
+    if not course_id.isdigit() or not await user_has_course(user_id, int(course_id)):
+        await callback.message.answer(MESSAGES["personal_info"]["no_access"])
+        return
+    progress = await get_course_progress(user_id, int(course_id))
 
     if not progress:
-        await message.answer(MESSAGES["personal_info"]["no_progress"])
+        await callback.message.answer(MESSAGES["personal_info"]["no_progress"])
         return
 
     # Формируем текст с прогрессом
@@ -61,18 +70,17 @@ async def show_course_progress(message: types.Message):
         f"Уроков пройдено: {progress['completed_lessons']}/{progress['total_lessons']}\n"
         f"Вопросов пройдено: {progress['completed_questions']}/{progress['total_questions']}"
     )
-    await message.answer(text)
+    await callback.message.answer(text)
 
 
 # Обработчик кнопки "Настройки"
-@router.message(lambda message: message.text.lower() == "настройки")
+@menu.button("Настройки")
 async def show_settings(message: types.Message):
     """Отображение настроек личного кабинета."""
     # Пример настроек, можно расширить
-    keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
-    keyboard.add(
-        KeyboardButton(text="Изменить язык"),
-        KeyboardButton(text="Сменить пароль")
+    keyboard = ReplyKeyboardMarkup(
+        keyboard=[[KeyboardButton(text="Изменить язык"), KeyboardButton(text="Сменить пароль")]],
+        resize_keyboard=True
     )
     await message.answer(MESSAGES["personal_info"]["settings"], reply_markup=keyboard)
 
@@ -87,6 +95,7 @@ MESSAGES = {
         "no_purchases": "У вас пока нет приобретённых курсов.",
         "purchases_list": "Ваши приобретённые курсы:",
         "no_progress": "Прогресс по этому курсу отсутствует.",
+        "no_access": "Этот курс не найден среди ваших покупок.",
         "settings": "Настройки личного кабинета:"
     }
 }
@@ -1,15 +1,16 @@
 from aiogram import Router
-import asyncio
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
 from database import get_user_referral_link  # Функция для получения реферальной ссылки
-from database import get_referral_count, get_user_earnings  # Функции для подсчёта рефералов и заработка
+from utils.profiles import UserProfile
+from utils.referral_helpers import get_referral_stats  # Сводная статистика рефералов (кэш + одна строка в БД)
 from config import CURRENCY  # Обозначение валюты
 from messages import *  # Импортируем сообщения
+from utils.menu import menu
 
 referral_router = Router()
 
 # Кнопка "Для друзей"
-@referral_router.message(lambda message: message.text == "Для друзей")
+@menu.button("Для друзей")
 async def friends_menu(message: Message):
     buttons = [
         [KeyboardButton(text="Реферальная ссылка")],
@@ -19,13 +20,13 @@ async def friends_menu(message: Message):
     keyboard = ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
     await message.answer("Выберите действие:", reply_markup=keyboard)
 
-@referral_router.message(lambda message: message.text == "Реферальная ссылка")
-async def handle_referral_link_button(message: Message):
+@menu.button("Реферальная ссылка")
+async def handle_referral_link_button(message: Message, profile: UserProfile):
     user_id = message.from_user.id
     user_language = message.from_user.language_code  # Получаем язык пользователя
 
-    # Предполагается, что эта функция возвращает ссылку
-    referral_link = await get_user_referral_link(user_id)
+    # Ссылка уже есть в профиле; создаём её только при первом запросе
+    referral_link = profile.referral_link or await get_user_referral_link(user_id)
 
     if referral_link:
         if user_language == 'en':
@@ -38,16 +39,14 @@ async def handle_referral_link_button(message: Message):
         else:
             await message.answer(referral_link_error_ru)
 
-@referral_router.message(lambda message: message.text == "Инфо о реф. сети")
+@menu.button("Инфо о реф. сети")
 async def referral_network_info(message: Message):
     user_id = message.from_user.id
 
-    # Получаем количество приглашённых пользователей
-    referral_count = await get_referral_count(user_id)
-
-    # Используем run_in_executor для вызова синхронной функции
-    loop = asyncio.get_event_loop()
-    earnings = await loop.run_in_executor(None, get_user_earnings, user_id)
+    # Количество приглашённых и заработок берём из сводной таблицы одним запросом
+    stats = await get_referral_stats(user_id)
+    referral_count = stats["count"]
+    earnings = stats["earnings"]
 
     # Формируем текст сообщения
     info_text = (
@@ -0,0 +1,59 @@
+from aiogram import Router
+from aiogram.types import Message, InlineQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.fsm.context import FSMContext
+from aiogram.filters import Command, CommandObject, StateFilter
+from config import CURRENCY
+from utils.search import search_catalog
+from utils.inline_catalog import inline_catalog
+
+router = Router()
+
+SEARCH_RESULTS_LIMIT = 10  # Результатов в ответе на /search
+INLINE_RESULTS_LIMIT = 50  # Результатов на одну порцию инлайн-режима (максимум Telegram)
+INLINE_CACHE_TIME = 300  # Сколько секунд Telegram может кэшировать ответ на инлайн-запрос
+
+
+def format_result(result: dict) -> str:
+    if result["kind"] == "product":
+        return f"📦 {result['title']} — {result['price']} {CURRENCY}"
+    return f"📚 {result['title']}"
+
+
+async def send_search_results(message: Message, text: str):
+    results = await search_catalog(text, SEARCH_RESULTS_LIMIT)
+    if not results:
+        await message.answer("Ничего не найдено. Попробуйте другой запрос.")
+        return
+
+    # Продукты открываются по кнопке (обработчик product_info_ в add_product_handler)
+    buttons = [
+        [InlineKeyboardButton(text=format_result(result), callback_data=f"product_info_{result['id']}")]
+        for result in results if result["kind"] == "product"
+    ]
+    text = "🔍 Результаты поиска:\n\n" + "\n".join(format_result(result) for result in results)
+    await message.answer(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons) if buttons else None)
+
+
+@router.message(Command("search"))
+async def search_command(message: Message, command: CommandObject, state: FSMContext):
+    if command.args:
+        await send_search_results(message, command.args)
+        return
+    await message.answer("Введите запрос для поиска продуктов и курсов:")
+    await state.set_state("waiting_for_search_query")
+
+
+@router.message(StateFilter("waiting_for_search_query"))
+async def process_search_query(message: Message, state: FSMContext):
+    await state.clear()
+    await send_search_results(message, message.text or "")
+
+
+@router.inline_query()
+async def inline_search(inline_query: InlineQuery):
+    # Ответ собирается из индекса в памяти (готовые результаты, запомненные запросы) — без запросов к базе.
+    # Смещение следующей порции Telegram передаёт обратно в inline_query.offset
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    results, has_more = await inline_catalog.search(inline_query.query, offset, INLINE_RESULTS_LIMIT)
+    next_offset = str(offset + INLINE_RESULTS_LIMIT) if has_more else ""
+    await inline_query.answer(results, cache_time=INLINE_CACHE_TIME, next_offset=next_offset)
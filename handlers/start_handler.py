@@ -2,9 +2,10 @@ from aiogram import Router, types
 from aiogram.types import KeyboardButton, ReplyKeyboardMarkup, Message, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
-from database import connect_db, add_user, get_user_role, set_user_role
+from database import register_user, set_user_role, set_user_language
 from messages import *  # Импортируем все сообщения
-from config import DEFAULT_LANGUAGE
+from utils.profiles import UserProfile
+from utils.menu import menu
 
 router = Router()
 
@@ -23,60 +24,48 @@ async def process_language_selection(callback: CallbackQuery):
     selected_language = callback.data.split("_")[1]
     if selected_language == "ru":
         await callback.message.answer("Вы выбрали русский язык.")
-        # Установите русский язык в настройках пользователя
+        await set_user_language(callback.from_user.id, "ru")
     elif selected_language == "en":
         await callback.message.answer("You selected English.")
-        # Установите английский язык в настройках пользователя
+        await set_user_language(callback.from_user.id, "en")
 
     await callback.answer()  # Закрываем всплывающее уведомление
 
 @router.message(Command("start"))
-async def start(message: Message, state: FSMContext):
+async def start(message: Message, state: FSMContext, profile: UserProfile):
     user = message.from_user
     user_id = user.id
+    language = profile.language
 
     # Получаем аргументы команды /start (реферальный код)
     args = message.text.split()[1:]  # Разделяем текст и берем все после команды
-
-    # Проверяем, зарегистрирован ли уже пользователь
-    with connect_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM users WHERE user_id = ?", (user_id,))
-        user_exists = cursor.fetchone()
-
-        if not user_exists:
-            # Если пользователя нет в базе, добавляем его
-            await add_user(user_id=user.id, username=user.username, first_name=user.first_name)
-
-            # Обрабатываем реферальную ссылку, если она есть
-            if args and args[0].startswith("ref"):
-                try:
-                    referrer_id = int(args[0].replace("ref", ""))  # Извлекаем ID реферера
-                    if referrer_id != user_id:  # Проверяем, чтобы пользователь не реферил сам себя
-                        # Сохраняем информацию о реферале в таблице "referrals"
-                        cursor.execute(""" 
-                            INSERT INTO referrals (referrer_id, referred_id)
-                            VALUES (?, ?)
-                        """, (referrer_id, user_id))
-
-                        # Начисляем бонус пригласившему
-                        cursor.execute("""
-                            UPDATE users
-                            SET balance = balance + 10  -- Например, бонус 10
-                            WHERE user_id = ?
-                        """, (referrer_id,))
-                        conn.commit()
-
-                        await message.answer(referral_registration_message_ru if DEFAULT_LANGUAGE == 'ru' else referral_registration_message_en)
-                    else:
-                        await message.answer(referral_error_message_ru if DEFAULT_LANGUAGE == 'ru' else referral_error_message_en)
-                except ValueError:
-                    await message.answer(invalid_referral_code_message_ru if DEFAULT_LANGUAGE == 'ru' else invalid_referral_code_message_en)
-            else:
-                await message.answer(registration_success_message_ru if DEFAULT_LANGUAGE == 'ru' else registration_success_message_en)
-
+    referrer_id = None
+    referral_reply = None
+    if args and args[0].startswith("ref"):
+        try:
+            referrer_id = int(args[0].replace("ref", ""))  # Извлекаем ID реферера
+        except ValueError:
+            referral_reply = invalid_referral_code_message_ru if language == 'ru' else invalid_referral_code_message_en
         else:
-            await message.answer(already_registered_message_ru if DEFAULT_LANGUAGE == 'ru' else already_registered_message_en)
+            if referrer_id == user_id:  # Проверяем, чтобы пользователь не реферил сам себя
+                referrer_id = None
+                referral_reply = referral_error_message_ru if language == 'ru' else referral_error_message_en
+
+    # Проверяем, зарегистрирован ли уже пользователь (профиль загружен middleware)
+    created = False
+    if not profile.exists:
+        # Пользователь и реферал (с бонусом пригласившему, например 10) записываются одной операцией:
+        # при двух одновременных /start реферал засчитает только тот, что действительно создал пользователя
+        created = await register_user(user.id, user.username, user.first_name, referrer_id, bonus=10)
+
+    if not created:
+        await message.answer(already_registered_message_ru if language == 'ru' else already_registered_message_en)
+    elif referral_reply:
+        await message.answer(referral_reply)
+    elif referrer_id is not None:
+        await message.answer(referral_registration_message_ru if language == 'ru' else referral_registration_message_en)
+    else:
+        await message.answer(registration_success_message_ru if language == 'ru' else registration_success_message_en)
 
     # Обычное меню
     menu_buttons = [
@@ -95,32 +84,35 @@ async def start(message: Message, state: FSMContext):
         reply_markup=menu_markup
     )
 
-    # Сохраняем данные о пользователе
+    # /start работает в любом состоянии и сбрасывает незавершённый сценарий; сохраняем данные о пользователе
+    await state.clear()
     await state.set_state("main_menu")
-    await state.update_data(language=DEFAULT_LANGUAGE)  # Устанавливаем язык по умолчанию
+    await state.update_data(language=language)  # Язык из профиля (или язык по умолчанию)
 
-    # Если пользователь не имеет роли, назначаем роль по умолчанию
-    role = await get_user_role(user.id)
-    if not role:
+    # Если у зарегистрированного ранее пользователя нет роли, назначаем роль по умолчанию
+    # (новый пользователь получает её в add_user)
+    if profile.exists and not profile.role:
         await set_user_role(user.id, "user")  # Назначаем роль "user" по умолчанию
 
 
 
-@router.message(lambda message: message.text == "Русский")
+@menu.button("Русский")
 async def set_russian(message: Message, state: FSMContext):
     # Обновляем язык в состоянии
     await message.answer("Вы выбрали русский язык.")
     await state.update_data(language="ru")
+    await set_user_language(message.from_user.id, "ru")
 
     # Выполняем дальнейшую логику на основе выбранного языка
     await continue_registration(message, state)
 
 
-@router.message(lambda message: message.text == "English")
+@menu.button("English")
 async def set_english(message: Message, state: FSMContext):
     # Обновляем язык в состоянии
     await message.answer("You selected English.")
     await state.update_data(language="en")
+    await set_user_language(message.from_user.id, "en")
 
     # Выполняем дальнейшую логику на основе выбранного языка
     await continue_registration(message, state)
@@ -28,3 +28,5 @@ referral_link_message_en = "Your referral link: {referral_link}"
 referral_link_error_en = "Error while retrieving the referral link."
 welcome_message = "Привет, {0}! Добро пожаловать в нашего бота! Выберите язык:"
 language_selected_message = "Вы выбрали язык: {0}"
+course_completed_message_ru = "🎉 Поздравляем! Вы завершили курс «{title}»."
+course_completed_message_en = "🎉 Congratulations! You have completed the course \"{title}\"."
@@ -0,0 +1,622 @@
+import ast
+import glob
+import os
+import re
+import sys
+import sqlite3
+from typing import Optional
+
+
+def add_column(table: str, column: str, declaration: str):
+    """Шаг миграции: добавляет столбец, если его ещё нет (ALTER TABLE ADD COLUMN не идемпотентен)."""
+    def step(conn):
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        if column not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+    return step
+
+
+# Токенизатор полнотекстового поиска: unicode61 приводит к нижнему регистру кириллицу и латиницу
+# и убирает диакритику, porter дополнительно сводит английские слова к основе
+FTS_TOKENIZE = "porter unicode61 remove_diacritics 2"
+
+
+def fts_normalized(column: str) -> str:
+    """SQL-выражение, заменяющее «ё» на «е» (unicode61 их не отождествляет); то же делает utils.search."""
+    return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def fulltext_index(table: str, fts_table: str, columns: list[str]) -> list[str]:
+    """
+    Шаги миграции для полнотекстового индекса FTS5 над table.
+    Индекс хранит только термы (content=table), текст читается из самой таблицы.
+    Триггеры поддерживают индекс при любом изменении строк, поэтому код записи о нём не знает.
+    """
+    column_list = ", ".join(columns)
+    new_values = ", ".join(fts_normalized(f"new.{column}") for column in columns)
+    old_values = ", ".join(fts_normalized(f"old.{column}") for column in columns)
+    return [
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5(
+            {column_list}, content='{table}', content_rowid='id', tokenize='{FTS_TOKENIZE}', prefix='2 3'
+        )
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {fts_table}_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO {fts_table} (rowid, {column_list}) VALUES (new.id, {new_values});
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {fts_table}_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO {fts_table} ({fts_table}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {fts_table}_au AFTER UPDATE OF {column_list} ON {table} BEGIN
+            INSERT INTO {fts_table} ({fts_table}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+            INSERT INTO {fts_table} (rowid, {column_list}) VALUES (new.id, {new_values});
+        END
+        """,
+        # Индексируем уже существующие строки
+        f"""
+        INSERT INTO {fts_table} (rowid, {column_list})
+        SELECT id, {", ".join(fts_normalized(column) for column in columns)} FROM {table}
+        """,
+    ]
+
+
+
+def _rebuild_course_progress(conn):
+    from utils.course_progress import rebuild_course_progress_sync
+    rebuild_course_progress_sync(conn)
+
+
+def _rebuild_referrals(conn):
+    from utils.referral_helpers import rebuild_referral_tree_sync, rebuild_referral_stats_sync
+    rebuild_referral_tree_sync(conn)
+    rebuild_referral_stats_sync(conn)
+
+
+def _reset_default_language(conn):
+    # NULL означает «язык не выбран», и профиль использует DEFAULT_LANGUAGE из config.py.
+    # 'en' — значение по умолчанию столбца, но его мог выбрать и сам пользователь. Если в столбце есть
+    # что-то кроме 'en' и NULL, язык уже записывался явно, и 'en' нельзя отличить от выбора — не трогаем
+    explicit = conn.execute(
+        "SELECT 1 FROM users WHERE language IS NOT NULL AND language != 'en' LIMIT 1"
+    ).fetchone()
+    if explicit is None:
+        conn.execute("UPDATE users SET language = NULL WHERE language = 'en'")
+
+
+def _backfill_course_tags(conn):
+    # Переносим теги из строки через запятую в course_tags (с той же нормализацией, что и при записи)
+    from utils.tags import set_course_tags_sync
+    courses = conn.execute("SELECT id, tags FROM courses WHERE tags IS NOT NULL AND tags != ''").fetchall()
+    for course_id, tags in courses:
+        set_course_tags_sync(conn, course_id, tags.split(","))
+
+# Таблицы, которые создавал initialize_db до появления миграций. Создаются в базе с user_version = 0
+# перед первой миграцией; в уже существующей базе IF NOT EXISTS ничего не меняет
+BASE_SCHEMA = [
+    # Таблица пользователей
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER UNIQUE,
+        username TEXT,
+        first_name TEXT,
+        language TEXT DEFAULT 'en',
+        balance REAL DEFAULT 0,
+        referral_link TEXT,
+        role TEXT DEFAULT 'user'
+    )
+    """,
+    # Таблица продуктов
+    """
+    CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        description TEXT NOT NULL,
+        price REAL NOT NULL,
+        is_subscription INTEGER NOT NULL,
+        subscription_period TEXT,
+        partner_id INTEGER NOT NULL,
+        image TEXT,
+        type TEXT,  -- Тип продукта (например, "Корпоративный ретрит", "Онлайн-сессия")
+        code TEXT UNIQUE,  -- Уникальный код продукта
+        is_hidden INTEGER DEFAULT 0  -- Признак, скрыт ли продукт (0 - не скрыт, 1 - скрыт)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS purchases (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        purchase_date TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # Таблица для хранения информации о рефералах
+    """
+    CREATE TABLE IF NOT EXISTS referrals (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        referrer_id INTEGER,  -- ID пользователя, который пригласил
+        referred_id INTEGER,  -- ID приглашённого пользователя
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS courses (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        description TEXT,
+        partner_id INTEGER
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS lessons (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        course_id INTEGER,
+        title TEXT,
+        description TEXT,
+        material_link TEXT,
+        FOREIGN KEY(course_id) REFERENCES courses(id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS questions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        lesson_id INTEGER,
+        text TEXT,
+        options TEXT,
+        correct_answer INTEGER,
+        FOREIGN KEY(lesson_id) REFERENCES lessons(id)
+    )
+    """,
+    # Таблица для отслеживания прогресса пользователя
+    """
+    CREATE TABLE IF NOT EXISTS user_progress (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,  -- ID пользователя
+        lesson_id INTEGER,  -- ID урока
+        completed BOOLEAN DEFAULT FALSE,  -- Флаг завершения урока
+        completion_date DATETIME,  -- Дата завершения
+        FOREIGN KEY(user_id) REFERENCES users(user_id),
+        FOREIGN KEY(lesson_id) REFERENCES lessons(id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS partners (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        credo TEXT NOT NULL,
+        logo_url TEXT,
+        show_in_list BOOLEAN DEFAULT TRUE
+    )
+    """,
+]
+
+# Индексы для частых запросов (миграция 1)
+_HOT_INDEXES = [
+    # Дубликаты прогресса мешают создать уникальный индекс — оставляем последнюю запись
+    """
+    DELETE FROM user_progress
+    WHERE id NOT IN (SELECT MAX(id) FROM user_progress GROUP BY user_id, lesson_id)
+    """,
+    # Нужен для ON CONFLICT(user_id, lesson_id) в mark_lesson_as_completed и complete_lesson
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_user_progress_user_lesson ON user_progress (user_id, lesson_id)",
+    "CREATE INDEX IF NOT EXISTS ix_referrals_referrer ON referrals (referrer_id)",
+    "CREATE INDEX IF NOT EXISTS ix_referrals_referred ON referrals (referred_id)",
+    "CREATE INDEX IF NOT EXISTS ix_purchases_user_product ON purchases (user_id, product_id)",
+    "CREATE INDEX IF NOT EXISTS ix_courses_partner ON courses (partner_id)",
+    "CREATE INDEX IF NOT EXISTS ix_lessons_course ON lessons (course_id)",
+    "CREATE INDEX IF NOT EXISTS ix_questions_lesson ON questions (lesson_id)",
+    "CREATE INDEX IF NOT EXISTS ix_products_hidden ON products (is_hidden, id)",
+    "CREATE INDEX IF NOT EXISTS ix_partners_visible ON partners (show_in_list)",
+]
+
+# Версионированные миграции схемы.
+# Номер последней применённой миграции хранится в PRAGMA user_version, поэтому каждая миграция
+# выполняется ровно один раз. Шаг миграции — SQL-строка или функция, принимающая соединение.
+# Новые изменения схемы добавляются только новой миграцией в конец списка.
+MIGRATIONS = [
+    (1, "Индексы для частых запросов", _HOT_INDEXES),
+    (2, "Столбцы и таблицы, которые уже используются в database.py", [
+        add_column("courses", "tags", "TEXT"),
+        add_column("partners", "user_id", "INTEGER"),
+        add_column("partners", "course_id", "INTEGER"),
+        add_column("questions", "user_id", "INTEGER"),
+        # Прогресс по вопросам хранится в user_progress рядом с прогрессом по урокам
+        add_column("user_progress", "course_id", "INTEGER"),
+        add_column("user_progress", "question_id", "INTEGER"),
+        add_column("user_progress", "is_completed", "BOOLEAN DEFAULT FALSE"),
+        """
+        CREATE TABLE IF NOT EXISTS lesson_progress (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            course_id INTEGER NOT NULL,
+            lesson_id INTEGER NOT NULL,
+            is_completed BOOLEAN DEFAULT FALSE,
+            UNIQUE (user_id, course_id, lesson_id)
+        )
+        """,
+        # Строки урока (question_id IS NULL) и строки вопросов уникальны по разным ключам
+        "DROP INDEX IF EXISTS ux_user_progress_user_lesson",
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_user_progress_lesson
+        ON user_progress (user_id, lesson_id) WHERE question_id IS NULL
+        """,
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_user_progress_question
+        ON user_progress (user_id, course_id, lesson_id, question_id) WHERE question_id IS NOT NULL
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_partners_course ON partners (course_id)",
+    ]),
+    (3, "Журнал платежей с ключами идемпотентности", [
+        """
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT UNIQUE,  -- Повторная обработка того же нажатия «Купить» не спишет деньги
+            user_id INTEGER NOT NULL,
+            product_id INTEGER,
+            purchase_id INTEGER,
+            amount_minor INTEGER NOT NULL,  -- Сумма в минимальных единицах, как в ledger
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_payments_user ON payments (user_id)",
+    ]),
+    (4, "Журнал операций по балансу", [
+        # Точный материализованный баланс в минимальных единицах; users.balance вычисляется из него
+        add_column("users", "balance_minor", "INTEGER NOT NULL DEFAULT 0"),
+        """
+        UPDATE users
+        SET balance_minor = CAST(ROUND(COALESCE(balance, 0) * 100) AS INTEGER),
+            balance = ROUND(COALESCE(balance, 0) * 100) / 100.0
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            amount_minor INTEGER NOT NULL,  -- Сумма со знаком в минимальных единицах (1/100 VED)
+            kind TEXT NOT NULL,  -- purchase, referral_bonus, top_up, transfer, opening
+            reference TEXT,  -- Ссылка на источник операции (продукт, реферал, получатель перевода)
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_ledger_user_time ON ledger (user_id, created_at)",
+        # Текущие балансы становятся начальными остатками журнала
+        """
+        INSERT INTO ledger (user_id, amount_minor, kind)
+        SELECT user_id, balance_minor, 'opening' FROM users WHERE balance_minor != 0
+        """,
+    ]),
+    (5, "Сводная статистика рефералов", [
+        """
+        CREATE TABLE IF NOT EXISTS referral_stats (
+            referrer_id INTEGER PRIMARY KEY,
+            referral_count INTEGER NOT NULL DEFAULT 0,
+            earnings_minor INTEGER NOT NULL DEFAULT 0  -- Заработок на рефералах в минимальных единицах
+        )
+        """,
+        # Все бонусы до этой миграции начислялись по 10 VED за приглашённого
+        """
+        INSERT OR REPLACE INTO referral_stats (referrer_id, referral_count, earnings_minor)
+        SELECT referrer_id, COUNT(*), COUNT(*) * 1000 FROM referrals GROUP BY referrer_id
+        """,
+    ]),
+    (6, "Дерево рефералов (таблица замыканий)", [
+        # Каждая пара предок-потомок хранится одной строкой с расстоянием между ними
+        """
+        CREATE TABLE IF NOT EXISTS referral_tree (
+            ancestor_id INTEGER NOT NULL,
+            descendant_id INTEGER NOT NULL,
+            depth INTEGER NOT NULL,  -- 1 — прямой реферал, 2 — реферал реферала и т. д.
+            PRIMARY KEY (ancestor_id, depth, descendant_id)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_referral_tree_descendant ON referral_tree (descendant_id, depth)",
+        # Заполняем по существующим рефералам (глубина ограничена на случай циклов в старых данных)
+        """
+        WITH RECURSIVE tree (ancestor_id, descendant_id, depth) AS (
+            SELECT referrer_id, referred_id, 1 FROM referrals
+            UNION ALL
+            SELECT t.ancestor_id, r.referred_id, t.depth + 1
+            FROM tree t
+            JOIN referrals r ON r.referrer_id = t.descendant_id
+            WHERE t.depth < 10
+        )
+        INSERT OR IGNORE INTO referral_tree (ancestor_id, descendant_id, depth)
+        SELECT ancestor_id, descendant_id, MIN(depth) FROM tree GROUP BY ancestor_id, descendant_id
+        """,
+    ]),
+    (7, "Полнотекстовый поиск по продуктам и курсам", [
+        *fulltext_index("products", "products_fts", ["name", "description", "type"]),
+        *fulltext_index("courses", "courses_fts", ["title", "description", "tags"]),
+    ]),
+    (8, "Теги курсов отдельной таблицей и счётчики тегов", [
+        # Первичный ключ (tag, course_id) — поиск курсов по тегу читает только строки этого тега
+        """
+        CREATE TABLE IF NOT EXISTS course_tags (
+            tag TEXT NOT NULL,
+            course_id INTEGER NOT NULL,
+            PRIMARY KEY (tag, course_id)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_course_tags_course ON course_tags (course_id)",
+        # Количество курсов по каждому тегу для облака тегов; ID — короткая ссылка на тег в callback_data
+        """
+        CREATE TABLE IF NOT EXISTS tag_counts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tag TEXT NOT NULL UNIQUE,
+            course_count INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_tag_counts_count ON tag_counts (course_count DESC, tag)",
+        """
+        CREATE TRIGGER IF NOT EXISTS course_tags_ai AFTER INSERT ON course_tags BEGIN
+            INSERT INTO tag_counts (tag, course_count) VALUES (new.tag, 1)
+            ON CONFLICT(tag) DO UPDATE SET course_count = course_count + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS course_tags_ad AFTER DELETE ON course_tags BEGIN
+            UPDATE tag_counts SET course_count = course_count - 1 WHERE tag = old.tag;
+            DELETE FROM tag_counts WHERE tag = old.tag AND course_count <= 0;
+        END
+        """,
+        # Теги удалённого курса удаляются вместе с ним
+        """
+        CREATE TRIGGER IF NOT EXISTS courses_tags_ad AFTER DELETE ON courses BEGIN
+            DELETE FROM course_tags WHERE course_id = old.id;
+        END
+        """,
+        _backfill_course_tags,
+    ]),
+    (9, "Язык пользователя не выбран, пока не записан явно", [
+        _reset_default_language,
+    ]),
+    (10, "Состояния диалогов (FSM) в базе", [
+        # Ключ — строка DefaultKeyBuilder (бот, чат, пользователь, тред, назначение); data — JSON
+        """
+        CREATE TABLE IF NOT EXISTS fsm_storage (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at REAL NOT NULL
+        ) WITHOUT ROWID
+        """,
+        # Удаление брошенных диалогов по времени последнего изменения
+        "CREATE INDEX IF NOT EXISTS ix_fsm_storage_updated ON fsm_storage (updated_at)",
+    ]),
+    (11, "Рассылки", [
+        # Задание рассылки: сегмент получателей, текст и курсор — ID последнего обработанного получателя
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            segment TEXT NOT NULL,  -- all, product, course, referrals, user (см. utils/broadcast.py)
+            segment_arg INTEGER,  -- ID продукта, курса или пользователя для сегмента
+            text TEXT NOT NULL,
+            created_by INTEGER,
+            status TEXT NOT NULL DEFAULT 'queued',  -- queued, running, done, cancelled
+            cursor INTEGER NOT NULL DEFAULT 0,
+            total INTEGER,
+            sent INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_broadcast_jobs_status ON broadcast_jobs (status, id)",
+        "CREATE INDEX IF NOT EXISTS ix_broadcast_jobs_creator ON broadcast_jobs (created_by, id)",
+        # Результат доставки каждому получателю: sent, blocked (бот заблокирован), failed
+        # или pending (отправку прервала остановка бота, сообщение будет отправлено снова)
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            job_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            error TEXT,
+            delivered_at REAL NOT NULL,
+            PRIMARY KEY (job_id, user_id)
+        ) WITHOUT ROWID
+        """,
+        # Индексы для обхода сегментов по возрастанию ID пользователя
+        "CREATE INDEX IF NOT EXISTS ix_purchases_product_user ON purchases (product_id, user_id)",
+        "CREATE INDEX IF NOT EXISTS ix_lesson_progress_course_user ON lesson_progress (course_id, user_id)",
+        "CREATE INDEX IF NOT EXISTS ix_referral_tree_ancestor ON referral_tree (ancestor_id, descendant_id)",
+    ]),
+    (12, "Сводка прогресса по курсам", [
+        # Пройдено уроков и вопросов курса; меняется вместе с user_progress (см. utils/course_progress.py)
+        """
+        CREATE TABLE IF NOT EXISTS course_progress (
+            user_id INTEGER NOT NULL,
+            course_id INTEGER NOT NULL,
+            completed_lessons INTEGER NOT NULL DEFAULT 0,
+            completed_questions INTEGER NOT NULL DEFAULT 0,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, course_id)
+        ) WITHOUT ROWID
+        """,
+        # Удаление сводки вместе с курсом
+        "CREATE INDEX IF NOT EXISTS ix_course_progress_course ON course_progress (course_id)",
+        _rebuild_course_progress,
+    ]),
+    (13, "Один пригласивший на пользователя", [
+        # Два одновременных /start могли записать реферала дважды — оставляем первую запись
+        """
+        DELETE FROM referrals
+        WHERE id NOT IN (SELECT MIN(id) FROM referrals GROUP BY referred_id)
+        """,
+        "DROP INDEX IF EXISTS ix_referrals_referred",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_referrals_referred ON referrals (referred_id)",
+        # Дерево и статистику пересчитываем без удалённых дублей
+        _rebuild_referrals,
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# Файлы и каталоги, SQL из которых проверяет find_full_scans (пути от корня проекта)
+QUERY_SOURCES = ("database.py", "payment.py", "utils")
+
+# Функции, которые выполняют SQL через эти вызовы; первый аргумент — текст запроса
+SQL_CALLS = {"execute", "executemany", "db_execute", "db_fetchone", "db_fetchall"}
+
+# Запросы, которым полный проход по таблице нужен по смыслу, с причиной.
+# Ключ — имя запроса из collect_queries: «файл:функция»
+ALLOWED_FULL_SCANS = {
+    "payment.py:reconcile_balances_sync": "сверка всех балансов с журналом, раз в сутки в фоне",
+    "utils/catalog.py:_load_products": "каталог продуктов целиком загружается в кэш процесса",
+    "utils/inline_catalog.py:rebuild": "индекс инлайн-каталога строится по всем курсам",
+    "utils/referral_helpers.py:rebuild_referral_stats_sync": "пересчёт сводки рефералов по команде",
+    "utils/referral_helpers.py:rebuild_referral_tree_sync": "пересчёт дерева рефералов по команде",
+    "utils/course_progress.py:rebuild_course_progress_sync": "пересчёт сводки прогресса в миграции",
+}
+
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def _sql_text(node) -> Optional[tuple[str, bool]]:
+    """
+    Текст запроса из узла AST и признак того, что он собран f-строкой.
+    В f-строке каждая подстановка заменяется на «?» — так IN ({placeholders}) остаётся разбираемым запросом.
+    """
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value, False
+    if isinstance(node, ast.JoinedStr):
+        parts = [value.value if isinstance(value, ast.Constant) else "?" for value in node.values]
+        return "".join(parts), True
+    return None
+
+
+def _queries_in_file(path: str) -> list[tuple[str, str, bool]]:
+    """Запросы из одного файла: (имя «файл:функция», SQL, собран ли f-строкой)."""
+    relative = os.path.relpath(path, _ROOT).replace(os.sep, "/")
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+    queries = []
+    for function in ast.walk(tree):
+        if not isinstance(function, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        name = f"{relative}:{function.name}"
+        for node in ast.walk(function):
+            if not isinstance(node, ast.Call) or not node.args:
+                continue
+            called = getattr(node.func, "attr", getattr(node.func, "id", None))
+            if called in SQL_CALLS:
+                sql = _sql_text(node.args[0])
+                if sql:
+                    queries.append((name, *sql))
+            # Страницы по курсору: fetch_keyset_page дописывает к запросу условие по ключу, ORDER BY и LIMIT
+            for position, arg in enumerate(node.args[:-3]):
+                if isinstance(arg, ast.Name) and arg.id == "fetch_keyset_page":
+                    sql, key_column = _sql_text(node.args[position + 1]), _sql_text(node.args[position + 3])
+                    if sql and key_column and not key_column[1]:
+                        keyset = f"{sql[0]} AND {key_column[0]} > ? ORDER BY {key_column[0]} LIMIT ?"
+                        queries.append((name, keyset, sql[1]))
+    return queries
+
+
+def collect_queries(sources=QUERY_SOURCES) -> list[tuple[str, str, bool]]:
+    """
+    Все запросы, которые бот выполняет: SQL-строки, переданные в execute/db_fetchone/db_fetchall/...
+    в файлах sources, и запросы сегментов рассылок.
+    :return: Список (имя, SQL, собран ли f-строкой)
+    """
+    paths = []
+    for source in sources:
+        path = os.path.join(_ROOT, source)
+        if os.path.isdir(path):
+            paths.extend(sorted(glob.glob(os.path.join(path, "*.py"))))
+        else:
+            paths.append(path)
+    queries = [query for path in paths for query in _queries_in_file(path)]
+
+    from utils.broadcast import SEGMENTS
+    queries.extend((f"utils/broadcast.py:SEGMENTS[{segment}]", sql, False) for segment, (_, sql) in SEGMENTS.items())
+    return queries
+
+
+def _query_params(sql: str):
+    named = re.findall(r"(?<!:):(\w+)", sql)
+    return dict.fromkeys(named) if named else (None,) * sql.count("?")
+
+
+def get_schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def apply_migrations(conn) -> int:
+    """
+    Применяет все миграции новее текущей версии схемы в одной транзакции.
+    Если схема актуальна, не выполняется ни одного DDL-запроса.
+    :return: Количество применённых миграций
+    """
+    version = get_schema_version(conn)
+    pending = [migration for migration in MIGRATIONS if migration[0] > version]
+    if not pending:
+        return 0
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if version == 0:
+            for statement in BASE_SCHEMA:
+                conn.execute(statement)
+        for number, description, steps in pending:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version = {number}")
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return len(pending)
+
+
+def find_full_scans(conn, queries=None) -> list[tuple[str, str]]:
+    """
+    Прогоняет запросы через EXPLAIN QUERY PLAN и возвращает те, что читают таблицу целиком,
+    кроме перечисленных в ALLOWED_FULL_SCANS. Запрос, который не удаётся разобрать
+    (опечатка, несуществующий столбец), тоже считается проблемой.
+    :param queries: Список из collect_queries (по умолчанию — все запросы бота)
+    :return: Список пар (имя запроса, строка плана со сканированием или текст ошибки)
+    """
+    if queries is None:
+        queries = collect_queries()
+    problems = []
+    for name, sql, dynamic in queries:
+        if sql.lstrip().split(None, 1)[0].upper() not in ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE"):
+            continue
+        try:
+            plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", _query_params(sql)).fetchall()
+        except sqlite3.Error as e:
+            # Имена таблиц и столбцов в f-строках подставляются во время выполнения — такие запросы не проверить
+            if not dynamic:
+                problems.append((name, f"ошибка: {e}"))
+            continue
+        if name in ALLOWED_FULL_SCANS:
+            continue
+        for row in plan:
+            detail = row[3]
+            # "SCAN <таблица>" без индекса — полный проход по таблице (SCAN CONSTANT ROW — выборка без таблицы)
+            if detail.startswith("SCAN") and "INDEX" not in detail and "CONSTANT ROW" not in detail:
+                problems.append((name, detail))
+    return problems
+
+
+# Проверка планов запросов: python migrations.py --check
+if __name__ == "__main__":
+    from database import connect_db, initialize_db
+
+    initialize_db()
+    if "--check" in sys.argv:
+        with connect_db() as conn:
+            scans = find_full_scans(conn)
+        for name, detail in scans:
+            print(f"{name}: {detail}")
+        sys.exit(1 if scans else 0)
@@ -1,14 +1,252 @@
-from database import connect_db
-
-def update_balance(user_id: int, amount: float):
-    with connect_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (amount, user_id))
-        conn.commit()
-
-def get_balance(user_id: int) -> float:
-    with connect_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,))
-        result = cursor.fetchone()
-        return result[0] if result else 0.0
+import asyncio
+import logging
+import config
+from enum import Enum
+from typing import NamedTuple, Optional
+from utils.db_helpers import run_db, run_write, db_fetchall, db_fetchone
+from utils.profiles import invalidate_user_profile
+from utils.user_courses import invalidate_user_courses
+
+logger = logging.getLogger(__name__)
+
+# Суммы в журнале хранятся целыми числами в минимальных единицах (1/100 VED)
+MINOR_UNITS = 100
+
+# Как часто (в секундах) сверять балансы с журналом
+LEDGER_RECONCILE_INTERVAL = getattr(config, "LEDGER_RECONCILE_INTERVAL", 24 * 60 * 60)
+
+
+class LedgerKind:
+    """Типы записей журнала баланса."""
+    OPENING = "opening"  # Начальный остаток при переходе на журнал
+    PURCHASE = "purchase"
+    REFERRAL_BONUS = "referral_bonus"
+    TOP_UP = "top_up"
+    TRANSFER = "transfer"
+
+
+class PaymentStatus(Enum):
+    SUCCESS = "success"
+    DUPLICATE = "duplicate"  # Платёж с этим ключом уже проведён, повторно не списываем
+    INSUFFICIENT_FUNDS = "insufficient_funds"
+    PRODUCT_NOT_FOUND = "product_not_found"
+    USER_NOT_FOUND = "user_not_found"
+
+
+class PaymentResult(NamedTuple):
+    status: PaymentStatus
+    purchase_id: Optional[int] = None
+    amount: float = 0
+    balance: Optional[float] = None  # Баланс после операции (если известен)
+
+    @property
+    def ok(self) -> bool:
+        """Деньги списаны — сейчас или при первой обработке того же ключа."""
+        return self.status in (PaymentStatus.SUCCESS, PaymentStatus.DUPLICATE)
+
+
+def to_minor(amount: float) -> int:
+    return int(round(amount * MINOR_UNITS))
+
+
+def post_entry(conn, user_id: int, amount_minor: int, kind: str, reference: str = None, min_balance_minor: int = None) -> bool:
+    """
+    Добавляет запись в журнал и в той же транзакции обновляет материализованный баланс.
+    Баланс в users.balance пересчитывается из точного целого users.balance_minor, поэтому не копит ошибку округления.
+    :param min_balance_minor: Если задан, операция проводится только при balance_minor >= этого значения
+    :return: False, если пользователь не найден или не выполнено условие по балансу
+    """
+    query = """
+        UPDATE users
+        SET balance_minor = balance_minor + ?, balance = (balance_minor + ?) / 100.0
+        WHERE user_id = ?
+    """
+    params = (amount_minor, amount_minor, user_id)
+    if min_balance_minor is not None:
+        query += " AND balance_minor >= ?"
+        params += (min_balance_minor,)
+    if not conn.execute(query, params).rowcount:
+        return False
+    conn.execute(
+        "INSERT INTO ledger (user_id, amount_minor, kind, reference) VALUES (?, ?, ?, ?)",
+        (user_id, amount_minor, kind, reference),
+    )
+    return True
+
+
+def _debit(conn, user_id: int, amount: float, kind: str = LedgerKind.PURCHASE, reference: str = None) -> Optional[PaymentStatus]:
+    # Списание одним условным UPDATE: проверка и изменение баланса атомарны,
+    # поэтому параллельные покупки не могут увести баланс в минус или потерять обновление
+    amount_minor = to_minor(amount)
+    if post_entry(conn, user_id, -amount_minor, kind, reference, min_balance_minor=amount_minor):
+        return None
+    if conn.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,)).fetchone() is None:
+        return PaymentStatus.USER_NOT_FOUND
+    return PaymentStatus.INSUFFICIENT_FUNDS
+
+
+def _current_balance(conn, user_id: int) -> Optional[float]:
+    row = conn.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,)).fetchone()
+    return row[0] if row else None
+
+
+def charge_for_product_sync(conn, user_id: int, product_id: int, idempotency_key: str = None) -> PaymentResult:
+    """
+    Списывает стоимость продукта и регистрирует покупку в текущей транзакции conn.
+    :param idempotency_key: Ключ операции (например, кнопка «Купить» в конкретном сообщении);
+        повторный вызов с тем же ключом ничего не списывает и возвращает DUPLICATE
+    """
+    if idempotency_key:
+        previous = conn.execute(
+            "SELECT purchase_id, amount_minor FROM payments WHERE idempotency_key = ?", (idempotency_key,)
+        ).fetchone()
+        if previous:
+            return PaymentResult(
+                PaymentStatus.DUPLICATE, previous[0], previous[1] / MINOR_UNITS, _current_balance(conn, user_id)
+            )
+
+    product = conn.execute("SELECT price FROM products WHERE id = ?", (product_id,)).fetchone()
+    if not product:
+        return PaymentResult(PaymentStatus.PRODUCT_NOT_FOUND)
+    price = product[0]
+
+    failure = _debit(conn, user_id, price, reference=f"product:{product_id}")
+    if failure:
+        return PaymentResult(failure, amount=price, balance=_current_balance(conn, user_id))
+
+    purchase_id = conn.execute(
+        "INSERT INTO purchases (user_id, product_id) VALUES (?, ?)", (user_id, product_id)
+    ).lastrowid
+    conn.execute("""
+        INSERT INTO payments (idempotency_key, user_id, product_id, purchase_id, amount_minor)
+        VALUES (?, ?, ?, ?, ?)
+    """, (idempotency_key, user_id, product_id, purchase_id, to_minor(price)))
+    return PaymentResult(PaymentStatus.SUCCESS, purchase_id, price, _current_balance(conn, user_id))
+
+
+def debit_sync(conn, user_id: int, amount: float) -> PaymentResult:
+    """Списывает произвольную сумму без регистрации покупки."""
+    failure = _debit(conn, user_id, amount)
+    return PaymentResult(failure or PaymentStatus.SUCCESS, amount=amount, balance=_current_balance(conn, user_id))
+
+
+async def charge_for_product(user_id: int, product_id: int, idempotency_key: str = None) -> PaymentResult:
+    """
+    Оплата продукта с баланса пользователя.
+    Выполняется через единственного писателя БД в одной транзакции.
+    """
+    result = await run_write(charge_for_product_sync, user_id, product_id, idempotency_key)
+    invalidate_user_profile(user_id)  # Снимок баланса в профиле устарел
+    if result.status is PaymentStatus.SUCCESS:
+        invalidate_user_courses(user_id)  # Покупка могла открыть доступ к курсу
+    return result
+
+
+async def debit(user_id: int, amount: float) -> PaymentResult:
+    result = await run_write(debit_sync, user_id, amount)
+    invalidate_user_profile(user_id)
+    return result
+
+
+def credit_sync(conn, user_id: int, amount: float, kind: str, reference: str = None) -> bool:
+    """Зачисляет сумму на баланс (пополнение, бонус)."""
+    return post_entry(conn, user_id, to_minor(amount), kind, reference)
+
+
+def transfer_sync(conn, from_user_id: int, to_user_id: int, amount: float) -> PaymentResult:
+    """Перевод между пользователями: две записи журнала в одной транзакции."""
+    if conn.execute("SELECT 1 FROM users WHERE user_id = ?", (to_user_id,)).fetchone() is None:
+        return PaymentResult(PaymentStatus.USER_NOT_FOUND, amount=amount)
+    failure = _debit(conn, from_user_id, amount, LedgerKind.TRANSFER, f"to:{to_user_id}")
+    if failure:
+        return PaymentResult(failure, amount=amount, balance=_current_balance(conn, from_user_id))
+    post_entry(conn, to_user_id, to_minor(amount), LedgerKind.TRANSFER, f"from:{from_user_id}")
+    return PaymentResult(PaymentStatus.SUCCESS, amount=amount, balance=_current_balance(conn, from_user_id))
+
+
+async def transfer(from_user_id: int, to_user_id: int, amount: float) -> PaymentResult:
+    result = await run_write(transfer_sync, from_user_id, to_user_id, amount)
+    invalidate_user_profile(from_user_id)
+    invalidate_user_profile(to_user_id)
+    return result
+
+
+async def update_balance(user_id: int, amount: float, kind: str = LedgerKind.TOP_UP, reference: str = None):
+    await run_write(credit_sync, user_id, amount, kind, reference)
+    invalidate_user_profile(user_id)
+
+async def get_balance(user_id: int) -> float:
+    result = await db_fetchone("SELECT balance FROM users WHERE user_id = ?", (user_id,))
+    return result[0] if result else 0.0
+
+
+async def get_ledger_entries(user_id: int, since: str = None, until: str = None, limit: int = 100) -> list[dict]:
+    """
+    История операций пользователя за период (границы — строки 'YYYY-MM-DD HH:MM:SS', UTC).
+    Использует индекс (user_id, created_at).
+    """
+    rows = await db_fetchall("""
+        SELECT id, amount_minor, kind, reference, created_at
+        FROM ledger
+        WHERE user_id = ? AND created_at >= ? AND created_at < ?
+        ORDER BY created_at DESC, id DESC
+        LIMIT ?
+    """, (user_id, since or "", until or "9999-12-31", limit))
+    return [
+        {
+            "id": row[0],
+            "amount": row[1] / MINOR_UNITS,
+            "kind": row[2],
+            "reference": row[3],
+            "created_at": row[4],
+        }
+        for row in rows
+    ]
+
+
+def reconcile_balances_sync(conn, fix: bool = False) -> list[tuple[int, int, int]]:
+    """
+    Сверяет материализованные балансы с суммой журнала одним агрегирующим запросом.
+    :param fix: Перезаписать расходящиеся балансы суммой журнала
+    :return: Список (user_id, balance_minor, сумма по журналу) для расходящихся пользователей
+    """
+    drift = conn.execute("""
+        SELECT u.user_id, u.balance_minor, COALESCE(l.total, 0)
+        FROM users u
+        LEFT JOIN (SELECT user_id, SUM(amount_minor) AS total FROM ledger GROUP BY user_id) l
+            ON l.user_id = u.user_id
+        WHERE u.balance_minor != COALESCE(l.total, 0)
+           OR u.balance != COALESCE(l.total, 0) / 100.0
+    """).fetchall()
+    if fix:
+        conn.executemany(
+            "UPDATE users SET balance_minor = ?, balance = ? / 100.0 WHERE user_id = ?",
+            [(total, total, user_id) for user_id, _, total in drift],
+        )
+    return [tuple(row) for row in drift]
+
+
+async def reconcile_balances(fix: bool = False) -> list[tuple[int, int, int]]:
+    # Сверка — только чтение и идёт через пул читателей, не занимая писателя.
+    # Писатель нужен лишь для исправления: там расхождения перечитываются в транзакции записи,
+    # чтобы не перезаписать баланс, изменённый между чтением и исправлением
+    drift = await run_db(reconcile_balances_sync)
+    if fix and drift:
+        drift = await run_write(reconcile_balances_sync, True)
+        invalidate_user_profile()
+    for user_id, materialized, total in drift:
+        logger.warning(
+            "Расхождение баланса пользователя %s: в users %s, по журналу %s (минимальных единиц)",
+            user_id, materialized, total,
+        )
+    return drift
+
+
+async def reconciliation_loop(interval: float = LEDGER_RECONCILE_INTERVAL):
+    """Фоновая задача: периодически сверяет балансы с журналом и пишет расхождения в лог."""
+    while True:
+        try:
+            await reconcile_balances()
+        except Exception:
+            logger.exception("Не удалось сверить балансы с журналом")
+        await asyncio.sleep(interval)
@@ -0,0 +1,67 @@
+import asyncio
+import os
+import sys
+import types
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# config.py не хранится в репозитории (в нём токен бота) — для тестов подставляем минимальный.
+# DB_PATH переопределяется для каждого теста фикстурой db
+config = types.ModuleType("config")
+config.TOKEN = "123456:TEST"
+config.DB_PATH = os.path.join(ROOT, "tests", "unused.db")
+config.DEFAULT_LANGUAGE = "ru"
+config.CURRENCY = "VED"
+config.ADMIN_ID = "1"
+sys.modules["config"] = config
+
+
+def _reset_caches():
+    from utils.catalog import product_catalog
+    from utils.profiles import invalidate_user_profile
+    from utils.referral_helpers import invalidate_referral_stats
+    from utils.user_courses import invalidate_user_courses
+    from utils.course_progress import invalidate_course_totals
+    product_catalog.invalidate()
+    invalidate_user_profile()
+    invalidate_referral_stats()
+    invalidate_user_courses()
+    invalidate_course_totals()
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Пустая база со всеми миграциями во временном каталоге; кэши процесса сброшены."""
+    import utils.db_helpers as db_helpers
+    from database import initialize_db
+    path = str(tmp_path / "bot.db")
+    monkeypatch.setattr(db_helpers, "DB_PATH", path)
+    initialize_db()
+    _reset_caches()
+    yield path
+    _reset_caches()
+
+
+@pytest.fixture
+def run(db):
+    """
+    Выполняет корутину в новом цикле событий между open_db и close_db:
+
+        def test_something(run):
+            run(some_coroutine())
+    """
+    from utils.db_helpers import open_db, close_db
+
+    def runner(coro):
+        async def main():
+            await open_db()
+            try:
+                return await coro
+            finally:
+                await close_db()
+        return asyncio.run(main())
+
+    return runner
@@ -0,0 +1,107 @@
+import asyncio
+import copy
+import json
+import os
+from collections import defaultdict
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+TOKEN = "123456:TEST"
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def recorded_updates(count: int = None) -> list[dict]:
+    """
+    Записанные обновления из fixtures/updates.json.
+    :param count: Сколько обновлений вернуть: записи повторяются по кругу с новыми update_id и message_id
+    """
+    with open(os.path.join(FIXTURES, "updates.json"), encoding="utf-8") as f:
+        recorded = json.load(f)
+    count = len(recorded) if count is None else count
+    updates = []
+    for i in range(count):
+        update = copy.deepcopy(recorded[i % len(recorded)])
+        update["update_id"] = i + 1
+        message = update.get("message") or update["callback_query"]["message"]
+        message["message_id"] = i + 1
+        updates.append(update)
+    return updates
+
+
+def stub_bot(url: str, **kwargs) -> Bot:
+    """Бот, обращающийся к заглушке по адресу url (в том числе из другого процесса)."""
+    return Bot(TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(url)), **kwargs)
+
+
+class TelegramStub:
+    """
+    Локальная замена Bot API на aiohttp: отдаёт обновления в getUpdates, отвечает на остальные методы
+    и запоминает вызовы. Ответ 429 на следующие вызовы метода задаётся fail_next.
+    """
+
+    def __init__(self, updates=()):
+        self.pending = list(updates)
+        self.calls = defaultdict(list)  # Метод -> параметры вызовов
+        self.sent = asyncio.Event()  # Устанавливается, когда sendMessage вызван expected_messages раз
+        self.expected_messages = None
+        self._failures = defaultdict(list)
+        self._message_id = 0
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self.server = TestServer(app)
+
+    async def __aenter__(self):
+        await self.server.start_server()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.server.close()
+
+    @property
+    def url(self) -> str:
+        return str(self.server.make_url("")).rstrip("/")
+
+    def bot(self, **kwargs) -> Bot:
+        return stub_bot(self.url, **kwargs)
+
+    def fail_next(self, method: str, retry_after: int = 1, times: int = 1):
+        for _ in range(times):
+            self._failures[method].append(retry_after)
+
+    def expect_messages(self, count: int):
+        self.expected_messages = count
+        self.sent.clear()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        if self._failures[method]:
+            retry_after = self._failures[method].pop(0)
+            return web.json_response({
+                "ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {retry_after}",
+                "parameters": {"retry_after": retry_after},
+            })
+        self.calls[method].append(params)
+        return web.json_response({"ok": True, "result": await self._result(method, params)})
+
+    async def _result(self, method: str, params: dict):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Bot", "username": "test_bot"}
+        if method == "getUpdates":
+            offset = int(params.get("offset") or 0)
+            self.pending = [update for update in self.pending if update["update_id"] >= offset]
+            if not self.pending:
+                await asyncio.sleep(0.01)  # Вместо long polling
+            return self.pending[:int(params.get("limit") or 100)]
+        if method == "sendMessage":
+            self._message_id += 1
+            if self.expected_messages is not None and len(self.calls[method]) >= self.expected_messages:
+                self.sent.set()
+            return {
+                "message_id": self._message_id, "date": 0, "text": params["text"],
+                "chat": {"id": int(params["chat_id"]), "type": "private"},
+            }
+        return True
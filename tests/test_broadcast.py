@@ -0,0 +1,71 @@
+import asyncio
+from database import add_user
+from utils.broadcast import BROADCAST_MAX_ACTIVE_JOBS, broadcast_engine, create_broadcast, get_broadcast, notify_user
+from utils.db_helpers import db_fetchall
+
+
+class FakeBot:
+    """Сообщения пользователю 1 «отправляются», пока тест не откроет шлюз; остальным — сразу."""
+
+    def __init__(self, gate: asyncio.Event = None):
+        self.gate = gate
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id == 1 and self.gate is not None:
+            await self.gate.wait()
+        self.sent.append((chat_id, text))
+
+
+async def _wait_for(condition, timeout: float = 5):
+    async def poll():
+        while not await condition():
+            await asyncio.sleep(0.02)
+    await asyncio.wait_for(poll(), timeout)
+
+
+async def _count_sent(bot, user_id, count):
+    return sum(1 for chat_id, _ in bot.sent if chat_id == user_id) >= count
+
+
+async def _finished(*job_ids):
+    return all([(await get_broadcast(job_id))["status"] == "done" for job_id in job_ids])
+
+
+def test_notice_does_not_wait_for_busy_broadcasts_and_interrupted_sends_are_retried(run):
+    async def main():
+        for user_id in (1, 2):
+            await add_user(user_id, f"user{user_id}", "Test")
+        stuck = FakeBot(asyncio.Event())
+        broadcast_engine.start(stuck)
+        try:
+            # Все места заняты рассылками, которые застряли на пользователе 1
+            jobs = [(await create_broadcast("all", f"news {i}"))["id"] for i in range(BROADCAST_MAX_ACTIVE_JOBS + 1)]
+            await _wait_for(lambda: _count_sent(stuck, 2, BROADCAST_MAX_ACTIVE_JOBS))
+            notice = (await notify_user(2, "personal"))["id"]
+            await _wait_for(lambda: _finished(notice))
+        finally:
+            await broadcast_engine.stop(timeout=0.1)
+        interrupted = await db_fetchall("SELECT job_id, status FROM broadcast_deliveries WHERE user_id = 1 ORDER BY job_id")
+
+        # После перезапуска прерванные отправки повторяются, остальным сообщение второй раз не приходит
+        resumed = FakeBot()
+        broadcast_engine.start(resumed)
+        try:
+            await _wait_for(lambda: _finished(*jobs))
+        finally:
+            await broadcast_engine.stop()
+        deliveries = await db_fetchall("SELECT job_id, user_id, status FROM broadcast_deliveries ORDER BY job_id, user_id")
+        counters = [(job["sent"], job["processed"]) for job in [await get_broadcast(job_id) for job_id in jobs]]
+        return jobs, notice, stuck.sent, interrupted, resumed.sent, deliveries, counters
+
+    jobs, notice, first_sent, interrupted, resumed_sent, deliveries, counters = run(main())
+    assert (2, "personal") in first_sent
+    assert [tuple(row) for row in interrupted] == [(job_id, "pending") for job_id in jobs[:BROADCAST_MAX_ACTIVE_JOBS]]
+    assert sorted(resumed_sent) == sorted(
+        [(1, f"news {i}") for i in range(len(jobs))] + [(2, f"news {len(jobs) - 1}")]
+    )
+    assert [tuple(row) for row in deliveries] == sorted(
+        [(job_id, user_id, "sent") for job_id in jobs for user_id in (1, 2)] + [(notice, 2, "sent")]
+    )
+    assert counters == [(2, 2)] * len(jobs)
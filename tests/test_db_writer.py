@@ -0,0 +1,88 @@
+import asyncio
+import sqlite3
+import time
+from database import add_user
+from utils.db_helpers import run_write, db_fetchone, db_fetchall
+
+
+def test_parallel_writes_are_not_lost(run):
+    async def main():
+        def insert_product(conn, i):
+            conn.execute(
+                "INSERT INTO products (name, description, price, is_subscription, partner_id) VALUES (?, '', 1, 0, 1)",
+                (f"p{i}",)
+            )
+
+        # Регистрации и произвольные записи вперемешку с чтениями — все из одного цикла событий
+        await asyncio.gather(
+            *(add_user(user_id, f"user{user_id}", "Test") for user_id in range(1, 1001)),
+            *(run_write(insert_product, i) for i in range(500)),
+            *(db_fetchone("SELECT COUNT(*) FROM users") for _ in range(200)),
+        )
+        users = await db_fetchall("SELECT user_id FROM users ORDER BY user_id")
+        products = await db_fetchone("SELECT COUNT(*) FROM products")
+        return [row[0] for row in users], products[0]
+
+    users, products = run(main())
+    assert users == list(range(1, 1001))
+    assert products == 500
+
+
+def test_failed_write_does_not_roll_back_neighbours(run):
+    async def main():
+        def broken(conn):
+            conn.execute("INSERT INTO users (user_id) VALUES (?)", (-1,))
+            raise sqlite3.IntegrityError("boom")
+
+        results = await asyncio.gather(
+            add_user(1, "a", "A"), run_write(broken), add_user(2, "b", "B"), return_exceptions=True
+        )
+        rows = await db_fetchall("SELECT user_id FROM users ORDER BY user_id")
+        return results, [row[0] for row in rows]
+
+    results, users = run(main())
+    assert isinstance(results[1], sqlite3.IntegrityError)
+    assert users == [1, 2]
+
+
+def test_reads_and_event_loop_stay_fast_during_a_long_write(run):
+    # Запись держит транзакцию BEGIN IMMEDIATE открытой long_write секунд. Благодаря WAL и отдельному потоку
+    # писателя чтения через пул и тики цикла событий за это время не должны замедляться
+    long_write = 1.0
+
+    async def main():
+        await add_user(1, "user1", "Test")
+        writing = asyncio.Event()
+
+        def slow_write(conn):
+            conn.execute("INSERT INTO users (user_id) VALUES (2)")
+            loop.call_soon_threadsafe(writing.set)
+            time.sleep(long_write)
+
+        loop = asyncio.get_running_loop()
+        write = asyncio.create_task(run_write(slow_write))
+        await writing.wait()
+
+        ticks, reads, counts = [], [], []
+        deadline = time.monotonic() + long_write * 0.8
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            await asyncio.sleep(0.01)
+            ticks.append(time.monotonic() - started - 0.01)
+
+            started = time.monotonic()
+            row = await db_fetchone("SELECT COUNT(*) FROM users")
+            reads.append(time.monotonic() - started)
+            counts.append(row[0])
+        still_writing = not write.done()
+        await write
+        return ticks, reads, counts, still_writing, (await db_fetchone("SELECT COUNT(*) FROM users"))[0]
+
+    ticks, reads, counts, still_writing, after = run(main())
+    assert still_writing
+    assert len(reads) >= 10
+    assert max(ticks) < 0.1
+    assert max(reads) < 0.1
+    # Читатели видят снимок до незавершённой записи, а не ждут её
+    assert set(counts) == {1}
+    assert after == 2
@@ -0,0 +1,117 @@
+import asyncio
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+from utils.db_helpers import db_fetchone
+from utils.fsm_storage import SQLiteStorage, create_redis_storage, fsm_sweep_loop
+
+KEY = StorageKey(bot_id=1, chat_id=10, user_id=10)
+OTHER_KEY = StorageKey(bot_id=1, chat_id=20, user_id=20)
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def new_storage(request, db):
+    """
+    Фабрика хранилищ одного бэкенда: каждый вызов открывает хранилище заново над теми же данными
+    (для Redis — локальная замена fakeredis вместо сервера).
+    """
+    if request.param == "sqlite":
+        return lambda state_ttl=3600: SQLiteStorage(state_ttl=state_ttl)
+
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    return lambda state_ttl=3600: create_redis_storage(fakeredis.aioredis.FakeRedis(server=server), state_ttl)
+
+
+async def _sweep(storage):
+    # Redis удаляет брошенные диалоги сам по TTL ключей; SQLite — фоновой задачей
+    if isinstance(storage, SQLiteStorage):
+        return await storage.sweep()
+
+
+def test_state_and_data(run, new_storage):
+    async def main():
+        storage = new_storage()
+        await storage.set_state(KEY, "waiting_for_title")
+        await storage.set_data(KEY, {"course_id": 5, "title": "Курс"})
+        merged = await storage.update_data(KEY, {"title": "Новый курс"})
+        result = (
+            await storage.get_state(KEY), await storage.get_data(KEY), merged,
+            await storage.get_state(OTHER_KEY), await storage.get_data(OTHER_KEY),
+        )
+        # state.clear(): состояние и данные сброшены
+        await storage.set_state(KEY, None)
+        await storage.set_data(KEY, {})
+        cleared = await storage.get_state(KEY), await storage.get_data(KEY)
+        await storage.close()
+        return result, cleared
+
+    (state, data, merged, other_state, other_data), cleared = run(main())
+    assert state == "waiting_for_title"
+    assert data == merged == {"course_id": 5, "title": "Новый курс"}
+    assert (other_state, other_data) == (None, {})
+    assert cleared == (None, {})
+
+
+def test_cleared_flow_leaves_no_sqlite_row(run):
+    async def main():
+        storage = SQLiteStorage()
+        await storage.set_state(KEY, "waiting_for_title")
+        await storage.update_data(KEY, {"course_id": 5})
+        await storage.set_state(KEY, None)
+        await storage.set_data(KEY, {})
+        return (await db_fetchone("SELECT COUNT(*) FROM fsm_storage"))[0]
+
+    assert run(main()) == 0
+
+
+def test_state_survives_reopening_the_storage(run, new_storage):
+    async def write():
+        storage = new_storage()
+        await storage.set_state(KEY, "waiting_for_lesson_title")
+        await storage.update_data(KEY, {"course_id": 7})
+        await storage.close()
+
+    async def read():
+        storage = new_storage()
+        result = await storage.get_state(KEY), await storage.get_data(KEY)
+        await storage.close()
+        return result
+
+    # Между запусками закрываются соединения с базой (как при перезапуске бота)
+    run(write())
+    assert run(read()) == ("waiting_for_lesson_title", {"course_id": 7})
+
+
+def test_abandoned_flows_expire(run, new_storage):
+    async def main():
+        storage = new_storage(state_ttl=1)
+        await storage.set_state(KEY, "waiting_for_title")
+        await storage.set_data(KEY, {"course_id": 5})
+        await asyncio.sleep(1.2)
+        # Диалог, продолжившийся позже, не удаляется
+        await storage.set_state(OTHER_KEY, "waiting_for_title")
+        removed = await _sweep(storage)
+        result = (
+            removed == (1 if isinstance(storage, SQLiteStorage) else None), await storage.get_state(KEY), await storage.get_data(KEY), await storage.get_state(OTHER_KEY)
+        )
+        await storage.close()
+        return result
+
+    swept, state, data, other_state = run(main())
+    assert swept
+    assert (state, data) == (None, {})
+    assert other_state == "waiting_for_title"
+
+
+def test_sweep_loop_removes_abandoned_flows(run):
+    async def main():
+        storage = SQLiteStorage(state_ttl=0.2)
+        await storage.set_state(KEY, "waiting_for_title")
+        await asyncio.sleep(0.3)
+        loop = asyncio.create_task(fsm_sweep_loop(storage, interval=0.05))
+        await asyncio.sleep(0.2)
+        loop.cancel()
+        await asyncio.gather(loop, return_exceptions=True)
+        return await storage.get_state(KEY)
+
+    assert run(main()) is None
@@ -0,0 +1,89 @@
+from types import SimpleNamespace
+from database import add_product_to_db, add_course
+from handlers.add_product_handler import send_product_page
+from handlers.handlers_for_study import send_courses_page
+from utils.catalog import product_catalog
+from utils.db_helpers import db_execute
+from utils.keyboards import page_hash
+
+
+class FakeMessage:
+    """Сообщение со старым содержимым, как в callback от повторного нажатия; запоминает правки."""
+
+    def __init__(self, message_id, text="", reply_markup=None):
+        self.chat = SimpleNamespace(id=1)
+        self.message_id = message_id
+        self.text = text
+        self.reply_markup = reply_markup
+        self.edits = []
+
+    async def edit_text(self, text, reply_markup=None):
+        self.edits.append((text, reply_markup))
+
+    async def edit_reply_markup(self, reply_markup=None):
+        self.edits.append((self.text, reply_markup))
+
+
+def _callback(message):
+    async def answer(*args, **kwargs):
+        pass
+
+    return SimpleNamespace(message=message, answer=answer)
+
+
+async def _add_product(name, price):
+    await add_product_to_db(name, "", price, False, 1)
+
+
+def test_product_page_is_edited_only_when_it_changes(run):
+    async def main():
+        await _add_product("Первый", 10)
+        await _add_product("Второй", 20)
+
+        message = FakeMessage(1, text="Главное меню")
+        await send_product_page(_callback(message))
+        # Повторное нажатие: та же страница из кэша каталога, сообщение в callback ещё старое
+        await send_product_page(_callback(message))
+        first = list(message.edits)
+
+        # Сообщение, уже показывающее текущую страницу, тоже не редактируется
+        shown = FakeMessage(2, *first[0])
+        await send_product_page(_callback(shown))
+
+        await _add_product("Третий", 30)
+        await send_product_page(_callback(message))
+        # Изменение существующего продукта тоже меняет страницу
+        await db_execute("UPDATE products SET price = 15 WHERE name = 'Первый'")
+        product_catalog.invalidate()
+        await send_product_page(_callback(message))
+        return first, shown.edits, message.edits
+
+    first, shown_edits, edits = run(main())
+    assert len(first) == 1
+    assert "Первый" in first[0][0] and "Второй" in first[0][0]
+    assert shown_edits == []
+    assert len(edits) == 3
+    assert "Третий" in edits[1][0]
+    assert "Первый — 15.0 VED" in edits[2][0]
+    assert len({page_hash(text, markup) for text, markup in edits}) == 3
+
+
+def test_course_page_is_edited_only_when_it_changes(run):
+    async def main():
+        await add_course("Python", "Основы", 1)
+
+        message = FakeMessage(1, text="Главное меню")
+        await send_courses_page(_callback(message))
+        await send_courses_page(_callback(message))
+        unchanged = len(message.edits)
+
+        await add_course("SQL", "Запросы", 1)
+        await send_courses_page(_callback(message))
+        await send_courses_page(_callback(message))
+        return unchanged, message.edits
+
+    unchanged, edits = run(main())
+    assert unchanged == 1
+    assert len(edits) == 2
+    assert "SQL" not in edits[0][0]
+    assert "SQL" in edits[1][0]
@@ -0,0 +1,170 @@
+import asyncio
+import time
+from aiogram import Bot, Dispatcher, Router
+from aiogram.filters import Command, StateFilter
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Update
+from handlers.handlers_for_study import LessonQuizStates, check_answer, send_question
+from telegram_stub import TelegramStub
+from utils.loaders import LessonRecord, QuestionRecord
+from utils.menu import MenuDispatcher
+
+BOT = Bot("123456:TEST")
+
+
+def _message(update_id: int, text: str) -> Update:
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": text,
+            "chat": {"id": 1, "type": "private"}, "from": {"id": 1, "is_bot": False, "first_name": "Test"},
+        },
+    })
+
+
+def _dispatcher(handled: list, **workflow_data) -> Dispatcher:
+    menu = MenuDispatcher()
+
+    @menu.button("Баланс")
+    async def balance(message):
+        handled.append(("menu", message.text))
+
+    @menu.button("Назад в главное меню", any_state=True)
+    async def back(message, state):
+        await state.clear()
+        handled.append(("back", message.text))
+
+    scenario = Router()
+
+    @scenario.message(StateFilter("waiting_for_title"))
+    async def title(message):
+        handled.append(("scenario", message.text))
+
+    dp = Dispatcher(storage=MemoryStorage(), **workflow_data)
+    dp.include_router(menu.router)
+    dp.include_router(scenario)
+    return dp
+
+
+async def _send(dp: Dispatcher, text: str, state: str = None):
+    key = StorageKey(bot_id=BOT.id, chat_id=1, user_id=1)
+    await dp.storage.set_state(key, state)
+    await dp.feed_update(BOT, _message(1, text))
+
+
+async def _state(dp: Dispatcher) -> tuple:
+    key = StorageKey(bot_id=BOT.id, chat_id=1, user_id=1)
+    return await dp.storage.get_state(key), await dp.storage.get_data(key)
+
+
+def test_menu_buttons_work_outside_scenarios():
+    handled = []
+    dp = _dispatcher(handled)
+    asyncio.run(_send(dp, "  баланс "))
+    asyncio.run(_send(dp, "Баланс", state="main_menu"))
+    assert handled == [("menu", "  баланс "), ("menu", "Баланс")]
+
+
+def test_button_label_inside_a_scenario_goes_to_the_scenario():
+    handled = []
+    dp = _dispatcher(handled)
+    asyncio.run(_send(dp, "Баланс", state="waiting_for_title"))
+    assert handled == [("scenario", "Баланс")]
+
+
+def test_back_button_leaves_any_scenario():
+    handled = []
+    dp = _dispatcher(handled)
+
+    async def main():
+        await _send(dp, "Назад в главное меню", state="waiting_for_title")
+        state = await _state(dp)
+        # Состояние сброшено — кнопки меню снова работают
+        await dp.feed_update(BOT, _message(2, "Баланс"))
+        return state
+
+    assert asyncio.run(main()) == (None, {})
+    assert handled == [("back", "Назад в главное меню"), ("menu", "Баланс")]
+
+
+class FakeLoaders:
+    """Урок 7 с вопросом «2 + 2?»; следующего урока нет. Считает обращения к урокам."""
+
+    def __init__(self):
+        self.loaded = 0
+
+    async def lesson(self, lesson_id):
+        self.loaded += 1
+        question = QuestionRecord(1, lesson_id, "2 + 2?", "3, 4, 5", 2)
+        return LessonRecord(lesson_id, 1, "Урок", None, None, (question,))
+
+    async def next_lesson(self, lesson):
+        return None
+
+
+def test_lesson_answers_are_checked_from_the_fsm_state():
+    handled = []
+    loaders = FakeLoaders()
+    dp = _dispatcher(handled, loaders=loaders)
+    quiz = Router()
+    quiz.message.register(check_answer, StateFilter(LessonQuizStates.answering))
+
+    @quiz.message(Command("lesson"))
+    async def lesson(message, state, loaders):
+        await send_question(await loaders.lesson(7), message, state)
+
+    dp.include_router(quiz)
+
+    async def main():
+        async with TelegramStub() as stub:
+            bot = stub.bot()
+            # Обычные сообщения вне урока не обращаются к урокам
+            await dp.feed_update(bot, _message(1, "Баланс"))
+            idle_loads = loaders.loaded
+            await dp.feed_update(bot, _message(2, "/lesson"))
+            asked = await _state(dp)
+            # Посреди урока кнопка меню — не ответ и не кнопка
+            for update_id, text in enumerate(["Баланс", "3", "4"], start=3):
+                await dp.feed_update(bot, _message(update_id, text))
+            finished = await _state(dp)
+            await dp.feed_update(bot, _message(6, "Баланс"))
+            await bot.session.close()
+            return idle_loads, asked, finished, [call["text"] for call in stub.calls["sendMessage"]]
+
+    idle_loads, asked, finished, replies = asyncio.run(main())
+    assert idle_loads == 0
+    assert asked == (LessonQuizStates.answering.state, {"lesson_id": 7, "options": ["3", "4", "5"], "correct_option": "4"})
+    assert replies == [
+        "2 + 2?",
+        "Выберите один из вариантов ответа на клавиатуре.",
+        "Ответ неверный. Попробуйте снова.", "2 + 2?",
+        "Ответ верный! Переходим к следующему уроку.", "Поздравляем, вы завершили курс!",
+    ]
+    # Урок загружался для вопроса и для двух ответов из вариантов, но не для остальных сообщений
+    assert loaders.loaded == 3
+    assert finished == (None, {})
+    assert handled == [("menu", "Баланс"), ("menu", "Баланс")]
+
+
+def _lookup_time(buttons: int, lookups: int = 20000) -> float:
+    menu = MenuDispatcher()
+    for i in range(buttons):
+        menu.button(f"Кнопка {i}")(lambda message: None)
+    hit = _message(1, f"кнопка {buttons - 1}").message
+    miss = _message(2, "Просто текст").message
+    best = float("inf")
+    for _ in range(5):
+        started = time.perf_counter()
+        for _ in range(lookups):
+            menu._match(hit)
+            menu._match(miss)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def test_menu_lookup_does_not_grow_with_the_number_of_buttons():
+    # Поиск кнопки — одно обращение к словарю: в 10 раз больше кнопок не должно заметно замедлять его
+    small, large = _lookup_time(100), _lookup_time(1000)
+    print(f"\n100 кнопок: {small * 1000:.1f} мс, 1000 кнопок: {large * 1000:.1f} мс на 40000 поисков")
+    assert large < small * 3
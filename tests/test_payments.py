@@ -0,0 +1,109 @@
+import asyncio
+from types import SimpleNamespace
+from database import add_user
+from handlers.add_product_handler import buy_product_callback
+import payment
+from payment import charge_for_product, update_balance, reconcile_balances, PaymentStatus
+from utils.db_helpers import run_write, db_fetchone
+
+
+def _create_product(conn, price):
+    return conn.execute(
+        "INSERT INTO products (name, description, price, is_subscription, partner_id) VALUES ('p', '', ?, 0, 1)",
+        (price,)
+    ).lastrowid
+
+
+async def _setup(users, balance, price):
+    for user_id in users:
+        await add_user(user_id, f"user{user_id}", "Test")
+        await update_balance(user_id, balance)
+    return await run_write(_create_product, price)
+
+
+async def _state(user_id):
+    balance = await db_fetchone("SELECT balance_minor FROM users WHERE user_id = ?", (user_id,))
+    purchases = await db_fetchone("SELECT COUNT(*) FROM purchases WHERE user_id = ?", (user_id,))
+    ledger = await db_fetchone("SELECT COALESCE(SUM(amount_minor), 0) FROM ledger WHERE user_id = ?", (user_id,))
+    return balance[0], purchases[0], ledger[0]
+
+
+def _callback(user_id, product_id, chat_id=-100, message_id=7):
+    async def answer(*args, **kwargs):
+        pass
+
+    message = SimpleNamespace(chat=SimpleNamespace(id=chat_id), message_id=message_id, answer=answer)
+    return SimpleNamespace(data=f"buy:{product_id}", from_user=SimpleNamespace(id=user_id), message=message, answer=answer)
+
+
+def test_parallel_purchases_do_not_overdraw(run):
+    async def main():
+        product_id = await _setup([1], balance=30, price=10)
+        # Десять разных покупок одновременно при балансе на три
+        results = await asyncio.gather(*(charge_for_product(1, product_id, f"key:{i}") for i in range(10)))
+        return [result.status for result in results], await _state(1)
+
+    statuses, (balance, purchases, ledger) = run(main())
+    assert statuses.count(PaymentStatus.SUCCESS) == 3
+    assert statuses.count(PaymentStatus.INSUFFICIENT_FUNDS) == 7
+    assert (balance, purchases, ledger) == (0, 3, 0)
+
+
+def test_same_key_is_charged_once(run):
+    async def main():
+        product_id = await _setup([1], balance=100, price=10)
+        results = await asyncio.gather(*(charge_for_product(1, product_id, "key") for _ in range(5)))
+        return [result.status for result in results], await _state(1)
+
+    statuses, (balance, purchases, ledger) = run(main())
+    assert statuses.count(PaymentStatus.SUCCESS) == 1
+    assert statuses.count(PaymentStatus.DUPLICATE) == 4
+    assert (balance, purchases, ledger) == (9000, 1, 9000)
+
+
+def test_payment_amount_is_stored_in_minor_units(run):
+    async def main():
+        product_id = await _setup([1], balance=1, price=0.29)
+        first = await charge_for_product(1, product_id, "key")
+        repeated = await charge_for_product(1, product_id, "key")
+        row = await db_fetchone("SELECT amount_minor, typeof(amount_minor) FROM payments WHERE idempotency_key = 'key'")
+        return first, repeated, tuple(row), await _state(1)
+
+    first, repeated, row, state = run(main())
+    assert row == (29, "integer")
+    assert first.amount == repeated.amount == 0.29
+    assert repeated.status is PaymentStatus.DUPLICATE
+    assert state == (71, 1, 71)
+
+def test_buy_button_charges_each_buyer_once(run):
+    async def main():
+        product_id = await _setup([1, 2], balance=100, price=10)
+        # Двойное нажатие одной кнопки каждым из двух пользователей в одном групповом сообщении
+        await asyncio.gather(*(
+            buy_product_callback(_callback(user_id, product_id)) for user_id in (1, 2, 1, 2)
+        ))
+        return await _state(1), await _state(2)
+
+    first, second = run(main())
+    assert first == (9000, 1, 9000)
+    assert second == (9000, 1, 9000)
+
+
+def test_reconcile_reads_without_the_writer(run, monkeypatch):
+    async def main():
+        await _setup([1, 2], balance=50, price=10)
+        await run_write(lambda conn: conn.execute("UPDATE users SET balance_minor = 1, balance = 0.01 WHERE user_id = 2"))
+
+        async def no_writes(*args):
+            raise AssertionError("сверка без fix не должна занимать писателя")
+
+        with monkeypatch.context() as patch:
+            patch.setattr(payment, "run_write", no_writes)
+            found = await reconcile_balances()
+        fixed = await reconcile_balances(fix=True)
+        return found, fixed, await reconcile_balances(), await _state(2)
+
+    found, fixed, after, state = run(main())
+    assert found == fixed == [(2, 1, 5000)]
+    assert after == []
+    assert state == (5000, 0, 5000)
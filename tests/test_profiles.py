@@ -0,0 +1,63 @@
+import asyncio
+import utils.profiles as profiles
+from database import add_user, set_user_role
+from utils.profiles import get_user_profile, invalidate_user_profile
+
+
+def _pause_reads(monkeypatch):
+    """Чтение профиля ждёт, пока тест не откроет шлюз, — чтобы вклиниться между запросом и кэшированием."""
+    gate = asyncio.Event()
+    read = profiles.db_fetchone
+
+    async def paused(query, params=()):
+        row = await read(query, params)
+        await gate.wait()
+        return row
+
+    monkeypatch.setattr(profiles, "db_fetchone", paused)
+    return gate
+
+
+def test_invalidation_during_read_is_not_lost(run, monkeypatch):
+    async def main():
+        await add_user(1, "user1", "Test")
+        gate = _pause_reads(monkeypatch)
+        loading = asyncio.create_task(get_user_profile(1))
+        await asyncio.sleep(0.1)  # Строка уже прочитана со старой ролью
+
+        await set_user_role(1, "partner")  # Сбрасывает профиль, пока загрузка не завершилась
+        gate.set()
+        stale = await loading
+        monkeypatch.undo()
+        return stale, await get_user_profile(1)
+
+    stale, fresh = run(main())
+    assert stale.role == "user"
+    assert fresh.role == "partner"
+
+
+def test_invalidate_all_during_read(run, monkeypatch):
+    async def main():
+        await add_user(1, "user1", "Test")
+        gate = _pause_reads(monkeypatch)
+        loading = asyncio.create_task(get_user_profile(1))
+        await asyncio.sleep(0.1)
+        invalidate_user_profile()
+        gate.set()
+        await loading
+        return 1 in profiles._profiles, profiles._loads
+
+    cached, loads = run(main())
+    assert not cached
+    assert loads == {}
+
+
+def test_profile_is_cached_without_invalidation(run):
+    async def main():
+        await add_user(1, "user1", "Test")
+        first = await get_user_profile(1)
+        return first, 1 in profiles._profiles, await get_user_profile(1)
+
+    first, cached, second = run(main())
+    assert cached
+    assert first is second
@@ -0,0 +1,21 @@
+import sqlite3
+from migrations import ALLOWED_FULL_SCANS, collect_queries, find_full_scans
+
+
+def test_no_query_scans_a_whole_table(db):
+    conn = sqlite3.connect(db)
+    try:
+        assert find_full_scans(conn) == []
+    finally:
+        conn.close()
+
+
+def test_queries_are_collected_from_code():
+    names = {name for name, _, _ in collect_queries()}
+    # Запросы из разных мест: обычный вызов, страница по курсору, f-строка с IN (...), сегмент рассылки
+    assert "database.py:get_user_balance" in names
+    assert "database.py:get_partner_courses_page" in names
+    assert "utils/loaders.py:_load_lessons" in names
+    assert "utils/broadcast.py:SEGMENTS[course]" in names
+    # Разрешённые сканирования должны ссылаться на существующие функции
+    assert set(ALLOWED_FULL_SCANS) <= names
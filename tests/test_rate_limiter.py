@@ -0,0 +1,158 @@
+import asyncio
+import types
+import pytest
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery, SendMessage
+import utils.rate_limiter as rate_limiter
+from telegram_stub import TOKEN, TelegramStub
+from utils.rate_limiter import PRIORITY_BROADCAST, OutboundRateLimiter, PriorityGate, TokenBucket, send_priority
+
+
+class FakeClock:
+    """Виртуальное время ограничителя: sleep не ждёт, а переводит часы вперёд."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    async def sleep(self, delay: float):
+        self.now += delay
+        await asyncio.sleep(0)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter, "time", types.SimpleNamespace(monotonic=clock.monotonic))
+    monkeypatch.setattr(rate_limiter, "asyncio", types.SimpleNamespace(
+        sleep=clock.sleep, get_running_loop=asyncio.get_running_loop, create_task=asyncio.create_task,
+    ))
+    return clock
+
+
+class Recorder:
+    """Вместо запроса к Bot API запоминает, в какой момент виртуального времени ушло сообщение."""
+
+    def __init__(self, clock: FakeClock):
+        self.clock = clock
+        self.sent = []
+
+    async def __call__(self, bot, method):
+        self.sent.append((method.chat_id, method.text, self.clock.now))
+        return True
+
+
+def test_token_bucket_allows_a_burst_then_paces(clock):
+    bucket = TokenBucket(rate=1, capacity=3)
+    assert [bucket.reserve() for _ in range(5)] == [0, 0, 0, 1, 2]
+    clock.now += 2
+    assert bucket.reserve() == 1  # Долг за две отправки выше погашен, ждём следующий токен
+    clock.now += 10
+    assert bucket.is_idle()
+    bucket.block(5)
+    assert bucket.reserve() == 6  # 5 секунд запрета и секунда до нового токена
+
+
+def test_per_chat_pace(clock):
+    limiter = OutboundRateLimiter(global_rate=30, chat_rate=1, group_rate=20 / 60, chat_burst=1)
+    recorder = Recorder(clock)
+    bot = Bot(TOKEN)
+
+    async def main():
+        start = clock.now
+        for i in range(4):
+            await limiter(recorder, bot, SendMessage(chat_id=1, text=str(i)))
+        # Другой чат не ждёт очереди первого
+        await limiter(recorder, bot, SendMessage(chat_id=2, text="other"))
+        for i in range(3):
+            await limiter(recorder, bot, SendMessage(chat_id=-100, text=str(i)))
+        # Методы, не создающие сообщений, не ограничиваются
+        await limiter(lambda *_: asyncio.sleep(0, True), bot, AnswerCallbackQuery(callback_query_id="1"))
+        await bot.session.close()
+        return [(chat_id, text, at - start) for chat_id, text, at in recorder.sent]
+
+    sent = asyncio.run(main())
+    # Общий лимит бота добавляет не больше 1/30 с на сообщение
+    expected = [
+        (1, "0", 0), (1, "1", 1), (1, "2", 2), (1, "3", 3),
+        (2, "other", 3),
+        (-100, "0", 3), (-100, "1", 6), (-100, "2", 9),
+    ]
+    assert sent == [(chat_id, text, pytest.approx(at, abs=0.1)) for chat_id, text, at in expected]
+    assert limiter.metrics()["sent"] == 8
+
+
+def test_interactive_sends_go_ahead_of_broadcasts(clock):
+    limiter = OutboundRateLimiter(global_rate=10)
+    recorder = Recorder(clock)
+    bot = Bot(TOKEN)
+
+    async def main():
+        with send_priority(PRIORITY_BROADCAST):
+            broadcast = [
+                asyncio.create_task(limiter(recorder, bot, SendMessage(chat_id=user_id, text="news")))
+                for user_id in range(1, 21)
+            ]
+        while len(recorder.sent) < 3:
+            await asyncio.sleep(0)
+        replies = [
+            asyncio.create_task(limiter(recorder, bot, SendMessage(chat_id=user_id, text="reply")))
+            for user_id in range(100, 103)
+        ]
+        await asyncio.sleep(0)  # Ответы встали в очередь
+        already_sent = len(recorder.sent)
+        queued = limiter.metrics()["queued"]
+        await asyncio.gather(*broadcast, *replies)
+        await bot.session.close()
+        return already_sent, queued, [text for _, text, _ in recorder.sent]
+
+    already_sent, queued, order = asyncio.run(main())
+    assert queued["interactive"] == 3 and queued["broadcast"] > 0
+    # Обгонять некого только тем сообщениям рассылки, которые уже получили токен
+    in_flight = 20 - already_sent - queued["broadcast"]
+    assert order[already_sent + in_flight:already_sent + in_flight + 3] == ["reply"] * 3
+    assert order.count("news") == 20
+
+
+def test_priority_gate_skips_cancelled_waiters(clock):
+    gate = PriorityGate(rate=10, capacity=1)
+
+    async def main():
+        await gate.acquire(PRIORITY_BROADCAST)
+        cancelled = asyncio.create_task(gate.acquire(0))
+        waiting = asyncio.create_task(gate.acquire(PRIORITY_BROADCAST))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        started = clock.now
+        await waiting
+        return round(clock.now - started, 3), gate.depth()
+
+    # Токен отменившегося не тратится: следующий ждёт один интервал, а не два
+    assert asyncio.run(main()) == (0.1, {"interactive": 0, "broadcast": 0})
+
+
+def test_retry_after_429(clock):
+    async def main():
+        async with TelegramStub() as stub:
+            bot = stub.bot()
+            limiter = OutboundRateLimiter(max_retries=2)
+            bot.session.middleware(limiter)
+            stub.fail_next("sendMessage", retry_after=5, times=2)
+            started = clock.now
+            message = await bot.send_message(7, "hi")
+            waited = clock.now - started
+
+            # Повторы кончились — ошибка доходит до отправителя
+            stub.fail_next("sendMessage", retry_after=5, times=3)
+            with pytest.raises(TelegramRetryAfter):
+                await bot.send_message(8, "hi")
+            await bot.session.close()
+            return message.text, waited, limiter.metrics(), len(stub.calls["sendMessage"])
+
+    text, waited, metrics, delivered = asyncio.run(main())
+    assert text == "hi"
+    assert waited >= 10  # Чат ждал retry_after после каждого ответа 429
+    assert (metrics["sent"], metrics["retried"], delivered) == (1, 4, 1)
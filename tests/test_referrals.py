@@ -0,0 +1,137 @@
+import asyncio
+import utils.referral_helpers as referral_helpers
+from database import add_user, add_referral, register_user
+from payment import to_minor
+from utils.db_helpers import run_write, db_execute, db_fetchall
+from utils.referral_helpers import (
+    REFERRAL_TREE_MAX_DEPTH, add_to_referral_tree_sync, pay_referral_bonuses_sync, get_referral_stats,
+    rebuild_referral_stats, get_descendants, get_ancestors, get_level_counts, rebuild_referral_tree
+)
+
+
+def _add_referral_with_levels(conn, referrer_id, referred_id, percents):
+    conn.execute("INSERT INTO referrals (referrer_id, referred_id) VALUES (?, ?)", (referrer_id, referred_id))
+    add_to_referral_tree_sync(conn, referrer_id, referred_id)
+    return pay_referral_bonuses_sync(conn, referred_id, to_minor(10), percents)
+
+
+async def _stats_and_ledger():
+    stats = await db_fetchall("SELECT referrer_id, referral_count, earnings_minor FROM referral_stats ORDER BY referrer_id")
+    ledger = await db_fetchall("""
+        SELECT user_id, SUM(amount_minor) FROM ledger
+        WHERE kind = 'referral_bonus' GROUP BY user_id ORDER BY user_id
+    """)
+    return [tuple(row) for row in stats], [tuple(row) for row in ledger]
+
+
+def test_referral_stats_match_the_ledger(run):
+    async def main():
+        for user_id in (1, 2, 3, 4):
+            await add_user(user_id, f"user{user_id}", "Test")
+        await add_referral(1, 2)
+        await run_write(_add_referral_with_levels, 2, 3, (100, 50))
+        # Ссылка с несуществующим пригласившим: ни бонуса, ни статистики
+        await add_referral(999999, 4)
+
+        stats, ledger = await _stats_and_ledger()
+        missing = await get_referral_stats(999999)
+        await rebuild_referral_stats()
+        rebuilt, _ = await _stats_and_ledger()
+        return stats, ledger, missing, rebuilt
+
+    stats, ledger, missing, rebuilt = run(main())
+    assert stats == [(1, 1, 1500), (2, 1, 1000)]
+    assert [(user_id, earnings) for user_id, _, earnings in stats] == ledger
+    assert missing == {"count": 0, "earnings": 0}
+    assert rebuilt == stats
+
+
+def test_concurrent_start_pays_the_referral_once(run):
+    async def main():
+        await add_user(1, "user1", "Test")
+        # Два одновременных /start нового пользователя по одной реферальной ссылке
+        created = await asyncio.gather(*(register_user(2, "user2", "Test", referrer_id=1) for _ in range(2)))
+        repeated = await add_referral(1, 2)
+        referrals = await db_fetchall("SELECT referrer_id, referred_id FROM referrals")
+        stats, ledger = await _stats_and_ledger()
+        return sorted(created), repeated, [tuple(row) for row in referrals], stats, ledger
+
+    created, repeated, referrals, stats, ledger = run(main())
+    assert created == [False, True]
+    assert referrals == [(1, 2)]
+    assert stats == [(1, 1, 1000)]
+    assert ledger == [(1, 1000)]
+
+def test_stats_cache_expires(run, monkeypatch):
+    monkeypatch.setattr(referral_helpers, "REFERRAL_STATS_CACHE_TTL", 0.2)
+
+    async def main():
+        for user_id in (1, 2):
+            await add_user(user_id, f"user{user_id}", "Test")
+        before = await get_referral_stats(1)
+        # Реферал, записанный другим процессом: кэш этого процесса не сброшен
+        await db_execute("INSERT INTO referral_stats (referrer_id, referral_count, earnings_minor) VALUES (1, 1, 1000)")
+        cached = await get_referral_stats(1)
+        await asyncio.sleep(0.3)
+        return before, cached, await get_referral_stats(1)
+
+    before, cached, expired = run(main())
+    assert before == cached == {"count": 0, "earnings": 0}
+    assert expired == {"count": 1, "earnings": 10.0}
+
+def test_multi_level_tree(run):
+    #        1
+    #      /   \
+    #     2     3
+    #    / \
+    #   4   5
+    #   |
+    #   6
+    edges = [(1, 2), (1, 3), (2, 4), (2, 5), (4, 6)]
+
+    async def main():
+        for user_id in range(1, 7):
+            await add_user(user_id, f"user{user_id}", "Test")
+        for referrer_id, referred_id in edges:
+            await add_referral(referrer_id, referred_id)
+
+        result = (
+            await get_descendants(1, max_depth=REFERRAL_TREE_MAX_DEPTH),
+            await get_descendants(1, max_depth=2),
+            await get_descendants(1, max_depth=REFERRAL_TREE_MAX_DEPTH, limit=3),
+            await get_descendants(2, max_depth=REFERRAL_TREE_MAX_DEPTH),
+            await get_level_counts(1),
+            await get_level_counts(1, max_depth=2),
+            await get_ancestors(6),
+        )
+        tree = await db_fetchall("SELECT * FROM referral_tree ORDER BY ancestor_id, descendant_id")
+        await rebuild_referral_tree()
+        rebuilt = await db_fetchall("SELECT * FROM referral_tree ORDER BY ancestor_id, descendant_id")
+        return result, [tuple(row) for row in tree], [tuple(row) for row in rebuilt]
+
+    (descendants, near, limited, subtree, levels, near_levels, ancestors), tree, rebuilt = run(main())
+    assert descendants == [(2, 1), (3, 1), (4, 2), (5, 2), (6, 3)]
+    assert near == [(2, 1), (3, 1), (4, 2), (5, 2)]
+    assert limited == [(2, 1), (3, 1), (4, 2)]
+    assert subtree == [(4, 1), (5, 1), (6, 2)]
+    assert levels == {1: 2, 2: 2, 3: 1}
+    assert near_levels == {1: 2, 2: 2}
+    assert ancestors == [(4, 1), (2, 2), (1, 3)]
+    # Дерево, построенное по одной связи при регистрации, совпадает с пересчитанным заново
+    assert rebuilt == tree
+
+
+def test_tree_depth_is_capped(run):
+    chain_length = REFERRAL_TREE_MAX_DEPTH + 3
+
+    async def main():
+        for user_id in range(1, chain_length + 1):
+            await add_user(user_id, f"user{user_id}", "Test")
+        for user_id in range(1, chain_length):
+            await add_referral(user_id, user_id + 1)
+        return await get_level_counts(1, max_depth=chain_length), await get_ancestors(chain_length)
+
+    levels, ancestors = run(main())
+    assert levels == {depth: 1 for depth in range(1, REFERRAL_TREE_MAX_DEPTH + 1)}
+    assert len(ancestors) == REFERRAL_TREE_MAX_DEPTH
+    assert ancestors[0] == (chain_length - 1, 1)
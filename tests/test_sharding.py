@@ -0,0 +1,178 @@
+import asyncio
+import functools
+import os
+import queue
+import random
+from collections import defaultdict
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Bot, Dispatcher
+from telegram_stub import TOKEN, TelegramStub, recorded_updates, stub_bot
+from utils.sharding import ShardSupervisor, ShardWorker, create_ingress_app, shard_key
+
+SECRET = "secret"
+
+
+def _update(update_id: int, chat_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": text,
+            "chat": {"id": chat_id, "type": "private"}, "from": {"id": chat_id, "is_bot": False, "first_name": "Test"},
+        },
+    }
+
+
+async def _wait_for(condition, timeout: float = 5):
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.05)
+    await asyncio.wait_for(poll(), timeout)
+
+
+def test_shard_key_keeps_a_chat_on_one_worker():
+    updates = recorded_updates()
+    # Нажатие кнопки — чат сообщения с кнопкой; группа — чат, а не автор
+    assert [shard_key(update) for update in updates] == [1001, 1001, 1001, 1002, 1002, -100123]
+    # Без чата — пользователь
+    inline = {"update_id": 7, "inline_query": {"id": "1", "from": {"id": 1003}, "query": "", "offset": ""}}
+    poll_answer = {"update_id": 8, "poll_answer": {"poll_id": "1", "user": {"id": 1004}, "option_ids": [0]}}
+    assert (shard_key(inline), shard_key(poll_answer)) == (1003, 1004)
+
+    # Ключ не зависит от процесса (не hash()): новый супервизор распределяет так же
+    many = recorded_updates(60)
+    first, second = ShardSupervisor(None, workers=4), ShardSupervisor(None, workers=4)
+    shards = defaultdict(set)
+    for update in many:
+        assert first.shard_for(update) == second.shard_for(update)
+        shards[shard_key(update)].add(first.shard_for(update))
+    assert all(len(workers) == 1 for workers in shards.values())
+
+
+def test_worker_keeps_order_within_a_chat_and_runs_chats_concurrently():
+    handled = defaultdict(list)
+    active = []
+    peak = [0]
+    dp = Dispatcher()
+
+    @dp.message()
+    async def handle(message):
+        active.append(message.chat.id)
+        peak[0] = max(peak[0], len(active))
+        await asyncio.sleep(random.random() * 0.005)
+        handled[message.chat.id].append(int(message.text))
+        active.remove(message.chat.id)
+
+    updates = queue.Queue()
+    for seq in range(20):
+        for chat_id in range(1, 6):
+            updates.put(_update(seq * 10 + chat_id, chat_id, str(seq)))
+    updates.put(None)
+    worker = ShardWorker(0, dp, Bot(TOKEN), updates, queue.Queue(), concurrency=10)
+
+    async def main():
+        await worker.run()
+        await worker.bot.session.close()
+
+    asyncio.run(main())
+    assert dict(handled) == {chat_id: list(range(20)) for chat_id in range(1, 6)}
+    assert peak[0] > 1
+    assert (worker.processed, worker.failed) == (100, 0)
+
+
+def test_full_queue_holds_back_dispatch():
+    supervisor = ShardSupervisor(None, workers=1, queue_size=2)
+
+    async def main():
+        await supervisor.dispatch(_update(1, 1, "a"))
+        await supervisor.dispatch(_update(2, 1, "b"))
+        blocked = asyncio.create_task(supervisor.dispatch(_update(3, 1, "c")))
+        await asyncio.sleep(0.1)
+        waiting = not blocked.done()
+        # Обработчик забрал одно обновление — место освободилось
+        supervisor._queues[0].get(timeout=1)
+        await asyncio.wait_for(blocked, 1)
+        return waiting, supervisor.metrics()[0]
+
+    waiting, metrics = asyncio.run(main())
+    assert waiting
+    assert metrics["backpressure_waits"] > 0
+    assert metrics["dispatched"] == 3
+
+
+def _crashing_worker(url: str):
+    # Создаётся в процессе обработчика: на "crash" процесс падает, на остальное бот отвечает
+    dp = Dispatcher()
+
+    @dp.message()
+    async def handle(message):
+        if message.text == "crash":
+            os._exit(1)
+        await message.answer(f"re: {message.text}")
+
+    return dp, stub_bot(url)
+
+
+def test_crashed_worker_is_restarted(tmp_path, monkeypatch):
+    # Процесс обработчика запускается заново (spawn) и импортирует config.py сам
+    (tmp_path / "config.py").write_text('TOKEN = "123456:TEST"\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    async def main():
+        async with TelegramStub() as stub:
+            supervisor = ShardSupervisor(functools.partial(_crashing_worker, stub.url), workers=1)
+            await supervisor.start()
+            try:
+                await supervisor.dispatch(_update(1, 10, "crash"))
+                await _wait_for(lambda: supervisor.metrics()[0]["restarts"] == 1 and supervisor.metrics()[0]["alive"], 30)
+                stub.expect_messages(1)
+                await supervisor.dispatch(_update(2, 10, "hello"))
+                await asyncio.wait_for(stub.sent.wait(), 30)
+            finally:
+                await supervisor.stop(timeout=10)
+            return stub.calls["sendMessage"], supervisor.metrics()[0]
+
+    sent, metrics = asyncio.run(main())
+    assert [(call["chat_id"], call["text"]) for call in sent] == [("10", "re: hello")]
+    assert metrics["restarts"] == 1
+    assert metrics["processed"] == 1
+
+
+class FakeSupervisor:
+    def __init__(self):
+        self.events = []
+        self.updates = []
+
+    async def start(self):
+        self.events.append("start")
+
+    async def stop(self):
+        self.events.append("stop")
+
+    async def dispatch(self, update):
+        self.updates.append(update)
+
+    def metrics(self):
+        return [{"worker": 0, "dispatched": len(self.updates)}]
+
+
+def test_ingress_app_checks_the_secret_and_hands_updates_to_the_supervisor():
+    supervisor = FakeSupervisor()
+
+    async def main():
+        bot = Bot(TOKEN)
+        app = create_ingress_app(Dispatcher(), bot, supervisor, secret_token=SECRET)
+        async with TestClient(TestServer(app)) as client:
+            rejected = await client.post("/webhook", json=_update(1, 1, "a"), headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"})
+            accepted = await client.post("/webhook", json=_update(2, 1, "b"), headers={"X-Telegram-Bot-Api-Secret-Token": SECRET})
+            await _wait_for(lambda: supervisor.updates)
+            metrics = await (await client.get("/metrics")).json()
+            started = list(supervisor.events)
+        await bot.session.close()
+        return rejected.status, accepted.status, metrics, started
+
+    rejected, accepted, metrics, started = asyncio.run(main())
+    assert (rejected, accepted) == (401, 200)
+    assert supervisor.updates == [_update(2, 1, "b")]
+    assert metrics == [{"worker": 0, "dispatched": 1}]
+    assert started == ["start"]
+    assert supervisor.events == ["start", "stop"]
@@ -0,0 +1,212 @@
+import asyncio
+import time
+from collections import Counter
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Bot, Dispatcher
+from aiogram.types import CallbackQuery, Message
+from telegram_stub import TelegramStub, recorded_updates
+from utils.webhook import BoundedRequestHandler
+
+SECRET = "secret"
+PATH = "/webhook"
+
+
+def _update(update_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": "hi",
+            "chat": {"id": 1, "type": "private"}, "from": {"id": 1, "is_bot": False, "first_name": "Test"},
+        },
+    }
+
+
+class Webhook:
+    """Приложение с BoundedRequestHandler; обработчик сообщений ждёт, пока тест не откроет шлюз."""
+
+    def __init__(self, max_concurrency: int = 2, drain_timeout: float = 5):
+        self.gate = asyncio.Event()
+        self.started = []
+        self.finished = []
+        dp = Dispatcher()
+
+        @dp.message()
+        async def handle(message):
+            self.started.append(message.message_id)
+            await self.gate.wait()
+            self.finished.append(message.message_id)
+
+        app = web.Application()
+        self.handler = BoundedRequestHandler(
+            dp, Bot("123456:TEST"), secret_token=SECRET, max_concurrency=max_concurrency, drain_timeout=drain_timeout
+        )
+        self.handler.register(app, path=PATH)
+        self.client = TestClient(TestServer(app))
+
+    async def post(self, update_id: int) -> int:
+        response = await self.client.post(
+            PATH, json=_update(update_id), headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}
+        )
+        return response.status
+
+
+def test_updates_over_the_limit_wait_for_a_slot():
+    async def main():
+        webhook = Webhook(max_concurrency=2)
+        await webhook.client.start_server()
+        try:
+            accepted = await asyncio.gather(webhook.post(1), webhook.post(2))
+            waiting = asyncio.create_task(webhook.post(3))
+            await asyncio.sleep(0.2)
+            # Оба места заняты: третье обновление не принято и не начато
+            blocked = not waiting.done() and sorted(webhook.started) == [1, 2]
+            webhook.gate.set()
+            third = await waiting
+            await asyncio.sleep(0.1)
+            return accepted, blocked, third, sorted(webhook.finished)
+        finally:
+            await webhook.client.close()
+
+    accepted, blocked, third, finished = asyncio.run(main())
+    assert accepted == [200, 200]
+    assert blocked
+    assert third == 200
+    assert finished == [1, 2, 3]
+
+
+def test_closing_rejects_new_updates_and_drains_started_ones():
+    async def main():
+        webhook = Webhook()
+        await webhook.client.start_server()
+        try:
+            assert await webhook.post(1) == 200
+            await asyncio.sleep(0.1)
+            closing = asyncio.create_task(webhook.handler.close())
+            await asyncio.sleep(0.1)
+            rejected = await webhook.post(2)
+            # Начатое обновление дорабатывает, close ждёт его
+            draining = not closing.done()
+            webhook.gate.set()
+            await closing
+            return rejected, draining, webhook.started, webhook.finished
+        finally:
+            await webhook.client.close()
+
+    rejected, draining, started, finished = asyncio.run(main())
+    assert rejected == 503
+    assert draining
+    assert started == finished == [1]
+
+
+def test_drain_timeout_cancels_stuck_updates():
+    async def main():
+        webhook = Webhook(drain_timeout=0.2)
+        await webhook.client.start_server()
+        try:
+            assert await webhook.post(1) == 200
+            await asyncio.sleep(0.1)
+            await asyncio.wait_for(webhook.handler.close(), timeout=2)
+            return set(webhook.handler._background_feed_update_tasks), webhook.finished
+        finally:
+            await webhook.client.close()
+
+    pending, finished = asyncio.run(main())
+    assert pending == set()
+    assert finished == []
+
+
+def _replay_dispatcher() -> Dispatcher:
+    """Каждое обновление — один ответ через Bot API, как у обычных обработчиков бота."""
+    dp = Dispatcher()
+
+    @dp.message()
+    async def on_message(message: Message):
+        await message.answer(f"re: {message.text}")
+
+    @dp.callback_query()
+    async def on_callback(callback: CallbackQuery):
+        await callback.answer()
+        await callback.message.answer(f"re: {callback.data}")
+
+    return dp
+
+
+def _expected_replies(updates: list[dict]) -> Counter:
+    replies = Counter()
+    for update in updates:
+        if "message" in update:
+            replies[(str(update["message"]["chat"]["id"]), f"re: {update['message']['text']}")] += 1
+        else:
+            query = update["callback_query"]
+            replies[(str(query["message"]["chat"]["id"]), f"re: {query['data']}")] += 1
+    return replies
+
+
+def _replies(stub: TelegramStub) -> Counter:
+    return Counter((call["chat_id"], call["text"]) for call in stub.calls["sendMessage"])
+
+
+async def _replay_webhook(updates: list[dict], client_concurrency: int = 20) -> tuple[float, TelegramStub]:
+    """Отправляет записанные обновления в вебхук; ответы бота уходят в заглушку Bot API."""
+    async with TelegramStub() as stub:
+        bot = stub.bot()
+        app = web.Application()
+        handler = BoundedRequestHandler(_replay_dispatcher(), bot, secret_token=SECRET)
+        handler.register(app, path=PATH)
+        stub.expect_messages(len(updates))
+        async with TestClient(TestServer(app)) as client:
+            # Telegram держит ограниченное число одновременных соединений с вебхуком
+            connections = asyncio.Semaphore(client_concurrency)
+
+            async def post(update):
+                async with connections:
+                    response = await client.post(PATH, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": SECRET})
+                    assert response.status == 200
+
+            started = time.perf_counter()
+            await asyncio.gather(*(post(update) for update in updates))
+            await asyncio.wait_for(stub.sent.wait(), 30)
+            elapsed = time.perf_counter() - started
+        await bot.session.close()
+        return len(updates) / elapsed, stub
+
+
+async def _replay_polling(updates: list[dict]) -> tuple[float, TelegramStub]:
+    """Те же обновления через long polling из заглушки Bot API."""
+    async with TelegramStub(updates) as stub:
+        bot = stub.bot()
+        dp = _replay_dispatcher()
+        stub.expect_messages(len(updates))
+        started = time.perf_counter()
+        polling = asyncio.create_task(
+            dp.start_polling(bot, handle_signals=False, close_bot_session=False, polling_timeout=1)
+        )
+        await asyncio.wait_for(stub.sent.wait(), 30)
+        elapsed = time.perf_counter() - started
+        await dp.stop_polling()
+        await polling
+        await bot.session.close()
+        return len(updates) / elapsed, stub
+
+
+def test_recorded_updates_are_answered_through_the_webhook():
+    updates = recorded_updates()
+    _, stub = asyncio.run(_replay_webhook(updates))
+    assert _replies(stub) == _expected_replies(updates)
+    assert len(stub.calls["answerCallbackQuery"]) == sum("callback_query" in update for update in updates)
+
+
+def test_webhook_and_polling_throughput():
+    # Сравнительный замер: обновлений в секунду от приёма до ответа в Bot API
+    updates = recorded_updates(300)
+    webhook_rate, webhook_stub = asyncio.run(_replay_webhook(updates))
+    polling_rate, polling_stub = asyncio.run(_replay_polling(updates))
+    print(f"\nwebhook: {webhook_rate:.0f} обновлений/с, polling: {polling_rate:.0f} обновлений/с")
+
+    expected = _expected_replies(updates)
+    assert _replies(webhook_stub) == expected
+    assert _replies(polling_stub) == expected
+    # Нижняя граница с большим запасом — ловит деградацию на порядки, а не шум измерения
+    assert webhook_rate > 20
+    assert polling_rate > 20
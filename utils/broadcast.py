@@ -0,0 +1,344 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+import config
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError
+from utils.db_helpers import run_db, run_write, db_fetchone, db_fetchall
+from utils.rate_limiter import PRIORITY_BROADCAST, PRIORITY_INTERACTIVE, send_priority
+
+logger = logging.getLogger(__name__)
+
+# Сколько получателей читается из базы за раз (курсор задания сохраняется после каждой порции)
+BROADCAST_BATCH_SIZE = getattr(config, "BROADCAST_BATCH_SIZE", 500)
+# Сколько сообщений одной рассылки может ждать отправки одновременно (темп задаёт ограничитель отправки)
+BROADCAST_CONCURRENCY = getattr(config, "BROADCAST_CONCURRENCY", 50)
+# Сколько рассылок выполняется одновременно (личные уведомления сегмента user в это число не входят)
+BROADCAST_MAX_ACTIVE_JOBS = getattr(config, "BROADCAST_MAX_ACTIVE_JOBS", 4)
+# Сколько секунд при остановке бота ждать сообщения, которые уже отправляются
+BROADCAST_STOP_TIMEOUT = getattr(config, "BROADCAST_STOP_TIMEOUT", 10)
+# Как часто (в секундах) проверять новые задания, созданные в других процессах
+BROADCAST_POLL_INTERVAL = getattr(config, "BROADCAST_POLL_INTERVAL", 5)
+# Платные рассылки Telegram (allow_paid_broadcast): до 1000 сообщений в секунду за Telegram Stars.
+# Вместе с этой настройкой нужно поднять OUTBOUND_GLOBAL_RATE
+BROADCAST_PAID = getattr(config, "BROADCAST_PAID", False)
+
+# Сегменты получателей: название и запрос ID пользователей по возрастанию после курсора :after
+SEGMENTS = {
+    "all": ("все пользователи", """
+        SELECT user_id FROM users WHERE user_id > :after ORDER BY user_id LIMIT :limit
+    """),
+    "product": ("покупатели продукта", """
+        SELECT DISTINCT user_id FROM purchases WHERE product_id = :arg AND user_id > :after
+        ORDER BY user_id LIMIT :limit
+    """),
+    # Доступ к курсу даёт покупка с product_id = ID курса (см. get_next_lesson), плюс все, кто уже проходит курс
+    "course": ("студенты курса", """
+        SELECT user_id FROM purchases WHERE product_id = :arg AND user_id > :after
+        UNION
+        SELECT user_id FROM lesson_progress WHERE course_id = :arg AND user_id > :after
+        ORDER BY 1 LIMIT :limit
+    """),
+    "referrals": ("рефералы пользователя (все уровни)", """
+        SELECT descendant_id FROM referral_tree WHERE ancestor_id = :arg AND descendant_id > :after
+        ORDER BY descendant_id LIMIT :limit
+    """),
+    # Личное уведомление одному пользователю
+    "user": ("пользователь", """
+        SELECT user_id FROM users WHERE user_id = :arg AND user_id > :after LIMIT :limit
+    """),
+}
+
+# Сегменты, которым нужен segment_arg
+SEGMENTS_WITH_ARG = {"product", "course", "referrals", "user"}
+
+JOB_COLUMNS = (
+    "id", "segment", "segment_arg", "text", "created_by", "status", "cursor",
+    "total", "sent", "blocked", "failed", "created_at", "started_at", "finished_at",
+)
+
+
+def _job(row) -> dict:
+    job = dict(zip(JOB_COLUMNS, row))
+    processed = job["sent"] + job["blocked"] + job["failed"]
+    elapsed = (job["finished_at"] or time.time()) - job["started_at"] if job["started_at"] else 0
+    job["processed"] = processed
+    # Пропускная способность: получателей в секунду с начала рассылки
+    job["rate"] = round(processed / elapsed, 1) if elapsed > 0 else 0.0
+    return job
+
+
+def _recipients(conn, segment: str, arg: Optional[int], after: int, limit: int) -> list[int]:
+    query = SEGMENTS[segment][1]
+    return [row[0] for row in conn.execute(query, {"arg": arg, "after": after, "limit": limit})]
+
+
+def _count_recipients(conn, segment: str, arg: Optional[int]) -> int:
+    query = SEGMENTS[segment][1]
+    return conn.execute(f"SELECT COUNT(*) FROM ({query})", {"arg": arg, "after": 0, "limit": -1}).fetchone()[0]
+
+
+async def create_broadcast(segment: str, text: str, created_by: int = None, segment_arg: int = None) -> dict:
+    """
+    Ставит рассылку в очередь. Отправляет её BroadcastEngine.
+    :return: Задание рассылки (с количеством получателей в total)
+    """
+    if segment not in SEGMENTS:
+        raise ValueError(f"Неизвестный сегмент: {segment}")
+    if segment in SEGMENTS_WITH_ARG and segment_arg is None:
+        raise ValueError(f"Для сегмента {segment} нужен ID")
+
+    def insert(conn):
+        total = _count_recipients(conn, segment, segment_arg)
+        cursor = conn.execute("""
+            INSERT INTO broadcast_jobs (segment, segment_arg, text, created_by, total, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (segment, segment_arg, text, created_by, total, time.time()))
+        return cursor.lastrowid
+
+    job_id = await run_write(insert)
+    broadcast_engine.wake_up()
+    return await get_broadcast(job_id)
+
+
+async def get_broadcast(job_id: int) -> Optional[dict]:
+    row = await db_fetchone(f"SELECT {', '.join(JOB_COLUMNS)} FROM broadcast_jobs WHERE id = ?", (job_id,))
+    return _job(row) if row else None
+
+
+async def get_broadcasts_by_creator(created_by: int, limit: int = 5) -> list[dict]:
+    rows = await db_fetchall(f"""
+        SELECT {', '.join(JOB_COLUMNS)} FROM broadcast_jobs
+        WHERE created_by = ? ORDER BY id DESC LIMIT ?
+    """, (created_by, limit))
+    return [_job(row) for row in rows]
+
+
+async def cancel_broadcast(job_id: int) -> bool:
+    """Останавливает рассылку: уже отправленные сообщения остаются, остальным получателям она не придёт."""
+    cursor = await run_write(lambda conn: conn.execute("""
+        UPDATE broadcast_jobs SET status = 'cancelled', finished_at = ?
+        WHERE id = ? AND status IN ('queued', 'running')
+    """, (time.time(), job_id)))
+    return cursor.rowcount > 0
+
+
+def _record_delivery(conn, job_id: int, user_id: int, status: str, error: Optional[str]):
+    if status == "pending":
+        # Отправку прервала остановка бота, и неизвестно, дошло ли сообщение.
+        # Такой получатель не считается обработанным: при продолжении рассылки ему отправят снова
+        conn.execute("""
+            INSERT OR IGNORE INTO broadcast_deliveries (job_id, user_id, status, error, delivered_at)
+            VALUES (?, ?, 'pending', ?, ?)
+        """, (job_id, user_id, error, time.time()))
+        return
+    recorded = conn.execute("""
+        INSERT INTO broadcast_deliveries (job_id, user_id, status, error, delivered_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (job_id, user_id) DO UPDATE
+            SET status = excluded.status, error = excluded.error, delivered_at = excluded.delivered_at
+            WHERE status = 'pending'
+    """, (job_id, user_id, status, error, time.time())).rowcount
+    if recorded:
+        # status — одно из sent, blocked, failed (имена столбцов счётчиков)
+        conn.execute(f"UPDATE broadcast_jobs SET {status} = {status} + 1 WHERE id = ?", (job_id,))
+
+
+def _next_batch(conn, job: dict, limit: int) -> tuple[str, list[int], set[int]]:
+    """Статус задания, следующая порция получателей и те из них, кому сообщение уже доставлялось."""
+    status, cursor = conn.execute("SELECT status, cursor FROM broadcast_jobs WHERE id = ?", (job["id"],)).fetchone()
+    recipients = _recipients(conn, job["segment"], job["segment_arg"], cursor, limit)
+    delivered = set()
+    if recipients:
+        # После перезапуска часть порции могла быть уже отправлена — повторно не шлём
+        # (кроме прерванных отправок в статусе pending)
+        delivered = {row[0] for row in conn.execute(
+            "SELECT user_id FROM broadcast_deliveries "
+            "WHERE job_id = ? AND user_id BETWEEN ? AND ? AND status != 'pending'",
+            (job["id"], recipients[0], recipients[-1]),
+        )}
+    return status, recipients, delivered
+
+
+class BroadcastEngine:
+    """
+    Выполняет рассылки из таблицы broadcast_jobs.
+
+    Получатели читаются порциями по возрастанию ID; после каждой порции в задании сохраняется курсор,
+    а результат каждой отправки записывается в broadcast_deliveries. Поэтому после перезапуска
+    рассылка продолжается с места остановки и никому не приходит дважды.
+    Сообщения рассылок идут с приоритетом PRIORITY_BROADCAST и не задерживают ответы пользователям.
+    Личные уведомления (сегмент user) не занимают места BROADCAST_MAX_ACTIVE_JOBS и не ждут крупных рассылок.
+    Запускается в одном процессе (при нескольких обработчиках — в первом).
+    """
+
+    def __init__(self):
+        self.bot = None
+        self._active = {}  # ID задания -> задача
+        self._bulk = set()  # ID выполняемых заданий, кроме личных уведомлений
+        self._wake = asyncio.Event()
+        self._task = None
+        self._stopping = False
+
+    def wake_up(self):
+        self._wake.set()
+
+    def start(self, bot: Bot):
+        self.bot = bot
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = BROADCAST_STOP_TIMEOUT):
+        """
+        Останавливает рассылки: новые сообщения не отправляются, уже отправляемые дожидаются записи результата.
+        Рассылки продолжатся с сохранённого места при следующем запуске.
+        """
+        self._stopping = True
+        if self._task is not None:
+            self._task.cancel()
+        jobs = list(self._active.values())
+        if jobs:
+            _, pending = await asyncio.wait(jobs, timeout=timeout)
+            for task in pending:
+                task.cancel()
+        await asyncio.gather(*filter(None, [self._task, *jobs]), return_exceptions=True)
+        self._active.clear()
+        self._bulk.clear()
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self._claim_jobs()
+            except Exception:
+                logger.exception("Не удалось получить задания рассылки")
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), BROADCAST_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _claim_jobs(self):
+        free = BROADCAST_MAX_ACTIVE_JOBS - len(self._bulk)
+        rows = await db_fetchall(f"""
+            SELECT {', '.join(JOB_COLUMNS)} FROM broadcast_jobs
+            WHERE status IN ('queued', 'running') ORDER BY id
+        """)
+        for job in map(_job, rows):
+            if job["id"] in self._active:
+                continue
+            # Личные уведомления запускаются сразу: одно сообщение не должно ждать окончания крупных рассылок
+            if job["segment"] != "user":
+                if free <= 0:
+                    continue
+                free -= 1
+                self._bulk.add(job["id"])
+            task = asyncio.create_task(self._run_job(job))
+            self._active[job["id"]] = task
+            task.add_done_callback(lambda _, job_id=job["id"]: self._finish_job(job_id))
+
+    def _finish_job(self, job_id: int):
+        self._active.pop(job_id, None)
+        self._bulk.discard(job_id)
+        # Освободилось место — следующая рассылка из очереди начнётся сразу, а не при следующей проверке
+        self.wake_up()
+
+    async def _deliver(self, job_id: int, user_id: int, text: str, slots: asyncio.Semaphore):
+        try:
+            await self.bot.send_message(user_id, text, allow_paid_broadcast=BROADCAST_PAID or None)
+            status, error = "sent", None
+        except TelegramForbiddenError as e:
+            # Пользователь заблокировал бота или удалил аккаунт
+            status, error = "blocked", e.message
+        except TelegramAPIError as e:
+            status, error = "failed", e.message
+        except asyncio.CancelledError:
+            # Остановка бота прервала отправку — получатель останется ожидающим и получит сообщение позже
+            await asyncio.shield(run_write(_record_delivery, job_id, user_id, "pending", "прервано остановкой"))
+            raise
+        finally:
+            slots.release()
+        # Результат записывается, даже если задачу отменят во время записи: иначе сообщение ушло бы повторно
+        await asyncio.shield(run_write(_record_delivery, job_id, user_id, status, error))
+
+    async def _run_job(self, job: dict):
+        try:
+            await self._process_job(job)
+        except Exception:
+            # Задание останется в статусе running и продолжится с курсора при следующей проверке очереди
+            logger.exception("Рассылка %s прервана ошибкой", job["id"])
+
+    async def _process_job(self, job: dict):
+        await run_write(lambda conn: conn.execute("""
+            UPDATE broadcast_jobs SET status = 'running', started_at = COALESCE(started_at, ?)
+            WHERE id = ? AND status = 'queued'
+        """, (time.time(), job["id"])))
+        # Личные уведомления — ответ на действие пользователя, они идут вместе с обычными ответами
+        priority = PRIORITY_INTERACTIVE if job["segment"] == "user" else PRIORITY_BROADCAST
+        slots = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+        with send_priority(priority):
+            while True:
+                status, recipients, delivered = await run_db(_next_batch, job, BROADCAST_BATCH_SIZE)
+                if status != "running":
+                    # Рассылку отменили
+                    return
+                if not recipients:
+                    break
+                sends = []
+                try:
+                    for user_id in recipients:
+                        if user_id in delivered:
+                            continue
+                        await slots.acquire()
+                        if self._stopping:
+                            slots.release()
+                            break
+                        sends.append(asyncio.create_task(self._deliver(job["id"], user_id, job["text"], slots)))
+                    await asyncio.gather(*sends)
+                except asyncio.CancelledError:
+                    # stop() не дождался порции: прерываем начатые отправки и ждём, пока они запишут статус pending
+                    for send in sends:
+                        send.cancel()
+                    await asyncio.gather(*sends, return_exceptions=True)
+                    raise
+                if self._stopping:
+                    # Курсор не сдвигаем: отправленные из этой порции отмечены в broadcast_deliveries
+                    return
+                await run_write(lambda conn: conn.execute(
+                    "UPDATE broadcast_jobs SET cursor = ? WHERE id = ?", (recipients[-1], job["id"])
+                ))
+
+        await run_write(lambda conn: conn.execute("""
+            UPDATE broadcast_jobs SET status = 'done', finished_at = ? WHERE id = ? AND status = 'running'
+        """, (time.time(), job["id"])))
+        job = await get_broadcast(job["id"])
+        if job["segment"] == "user":
+            return
+        logger.info("Рассылка %s завершена: %s", job["id"], format_broadcast(job))
+        if job["created_by"]:
+            try:
+                await self.bot.send_message(job["created_by"], f"✅ Рассылка завершена.\n{format_broadcast(job)}")
+            except TelegramAPIError:
+                logger.warning("Не удалось сообщить о завершении рассылки %s", job["id"])
+
+
+def format_broadcast(job: dict) -> str:
+    segment = SEGMENTS[job["segment"]][0]
+    if job["segment_arg"] is not None:
+        segment += f" {job['segment_arg']}"
+    return (
+        f"Рассылка #{job['id']} ({segment}): {job['status']}\n"
+        f"Обработано {job['processed']} из {job['total']}: доставлено {job['sent']}, "
+        f"заблокировали бота {job['blocked']}, ошибок {job['failed']}\n"
+        f"Скорость: {job['rate']} сообщ./с"
+    )
+
+
+# Общий исполнитель рассылок; запускается в on_startup бота
+broadcast_engine = BroadcastEngine()
+
+
+async def notify_user(user_id: int, text: str) -> dict:
+    """Личное уведомление через очередь рассылок: доставится и после перезапуска бота."""
+    return await create_broadcast("user", text, segment_arg=user_id)
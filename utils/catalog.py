@@ -0,0 +1,144 @@
+import asyncio
+import time
+from bisect import bisect_left, bisect_right, insort
+import config
+from utils.db_helpers import run_db
+from utils.pagination import Page, FORWARD, BACKWARD
+
+# Через сколько секунд каталог перечитывается из базы, даже если его никто не изменял
+# (страховка на случай изменений в обход add_product_to_db, например из другого процесса)
+CATALOG_TTL = getattr(config, "CATALOG_TTL", 300)
+
+
+def _load_products(conn) -> list[dict]:
+    rows = conn.execute("""
+        SELECT id, name, description, price, image, type, code, is_hidden
+        FROM products
+        ORDER BY id
+    """).fetchall()
+    return [
+        {
+            "id": row[0],
+            "name": row[1],
+            "description": row[2],
+            "price": row[3],
+            "image": row[4],
+            "type": row[5],
+            "code": row[6],
+            "is_hidden": bool(row[7]),
+        }
+        for row in rows
+    ]
+
+
+class ProductCatalog:
+    """
+    Кэш каталога продуктов в памяти процесса.
+
+    Держит индексы по ID и по коду (включая скрытые продукты — их находят по коду)
+    и отсортированный по ID список ID видимых продуктов для постраничного вывода.
+    Возвращаемые словари общие для всех вызывающих — их нельзя изменять.
+    """
+
+    def __init__(self, ttl: float = CATALOG_TTL):
+        self.ttl = ttl
+        self._by_id = {}
+        self._by_code = {}
+        self._visible_ids = []  # ID видимых продуктов по возрастанию
+        self._loaded_at = None
+        self._lock = asyncio.Lock()
+        self._pending = None  # Изменения, пришедшие во время перезагрузки
+        self.version = 0  # Увеличивается при каждом изменении каталога (для производных кэшей)
+
+    def _is_fresh(self) -> bool:
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    async def ensure_loaded(self):
+        if self._is_fresh():
+            return
+        async with self._lock:
+            # Пока ждали блокировку, каталог мог загрузить другой запрос
+            if not self._is_fresh():
+                await self.reload()
+
+    async def reload(self):
+        self._pending = []
+        try:
+            products = await run_db(_load_products)
+            self._by_id = {}
+            self._by_code = {}
+            self._visible_ids = []
+            for product in products:
+                self._index(product)
+            for product in self._pending:
+                self._index(product)
+            self._loaded_at = time.monotonic()
+            self.version += 1
+        finally:
+            self._pending = None
+
+    def _index(self, product: dict):
+        previous = self._by_id.get(product["id"])
+        if previous is not None:
+            if previous.get("code"):
+                self._by_code.pop(previous["code"], None)
+            if not previous["is_hidden"]:
+                position = bisect_left(self._visible_ids, product["id"])
+                if position < len(self._visible_ids) and self._visible_ids[position] == product["id"]:
+                    del self._visible_ids[position]
+
+        self._by_id[product["id"]] = product
+        if product.get("code"):
+            self._by_code[product["code"]] = product
+        if not product["is_hidden"]:
+            insort(self._visible_ids, product["id"])
+        self.version += 1
+
+    def upsert(self, product: dict):
+        """Добавляет или обновляет продукт в кэше без перечитывания всего каталога."""
+        if self._pending is not None:
+            self._pending.append(product)
+        if self._loaded_at is not None:
+            self._index(product)
+
+    def invalidate(self):
+        """Сбрасывает кэш: при следующем обращении каталог будет загружен заново."""
+        self._loaded_at = None
+
+    async def get_by_id(self, product_id: int):
+        await self.ensure_loaded()
+        return self._by_id.get(product_id)
+
+    async def get_by_code(self, code: str):
+        await self.ensure_loaded()
+        return self._by_code.get(code)
+
+    async def all_products(self) -> list[dict]:
+        await self.ensure_loaded()
+        return list(self._by_id.values())
+
+    async def visible_products(self) -> list[dict]:
+        await self.ensure_loaded()
+        return [self._by_id[product_id] for product_id in self._visible_ids]
+
+    async def visible_keyset_page(self, direction: str, key: int, limit: int) -> Page:
+        """
+        Страница видимых продуктов по курсору (см. utils.pagination) без обращения к базе:
+        двоичный поиск позиции ключа в отсортированном списке ID и срез одной страницы.
+        """
+        await self.ensure_loaded()
+        ids = self._visible_ids
+        if direction == BACKWARD:
+            end = bisect_left(ids, key)
+            if end == 0:
+                # Предыдущие продукты удалены или скрыты — показываем первую страницу
+                return await self.visible_keyset_page(FORWARD, 0, limit)
+            start = max(end - limit, 0)
+        else:
+            start = bisect_right(ids, key)
+            end = start + limit
+        return Page([self._by_id[product_id] for product_id in ids[start:end]], start > 0, end < len(ids))
+
+
+# Общий экземпляр каталога для всего бота
+product_catalog = ProductCatalog()
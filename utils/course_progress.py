@@ -0,0 +1,191 @@
+import time
+from typing import NamedTuple, Optional
+import config
+from utils.db_helpers import db_fetchone, db_fetchall
+from utils.user_courses import get_user_courses
+
+# Сколько секунд считать актуальными закэшированные количества уроков и вопросов курса.
+# Добавление уроков и вопросов через database.py сбрасывает кэш сразу, TTL — страховка
+COURSE_TOTALS_CACHE_TTL = getattr(config, "COURSE_TOTALS_CACHE_TTL", 600)
+
+
+class CourseTotals(NamedTuple):
+    lessons: int = 0
+    questions: int = 0
+
+
+class CourseProgress(NamedTuple):
+    course_id: int
+    title: str
+    completed_lessons: int
+    total_lessons: int
+    completed_questions: int
+    total_questions: int
+
+
+# ID курса -> (время загрузки, CourseTotals)
+_totals = {}
+
+
+def record_course_progress_sync(conn, user_id: int, course_id: int, lessons: int = 0, questions: int = 0):
+    """Меняет сводку прогресса пользователя по курсу в той же транзакции, в которой записан прогресс."""
+    conn.execute("""
+        INSERT INTO course_progress (user_id, course_id, completed_lessons, completed_questions, updated_at)
+        VALUES (?, ?, MAX(?, 0), MAX(?, 0), CURRENT_TIMESTAMP)
+        ON CONFLICT(user_id, course_id) DO UPDATE SET
+            completed_lessons = MAX(completed_lessons + ?, 0),
+            completed_questions = MAX(completed_questions + ?, 0),
+            updated_at = CURRENT_TIMESTAMP
+    """, (user_id, course_id, lessons, questions, lessons, questions))
+
+
+def mark_lesson_completed_sync(conn, user_id: int, lesson_id: int) -> bool:
+    """
+    Отмечает урок пройденным и учитывает его в сводке курса, если раньше он пройден не был.
+    :return: True, если урок отмечен впервые
+    """
+    row = conn.execute("""
+        SELECT l.course_id, up.completed
+        FROM lessons l
+        LEFT JOIN user_progress up ON up.user_id = ? AND up.lesson_id = l.id AND up.question_id IS NULL
+        WHERE l.id = ?
+    """, (user_id, lesson_id)).fetchone()
+    conn.execute("""
+        INSERT INTO user_progress (user_id, lesson_id, completed, completion_date)
+        VALUES (?, ?, TRUE, CURRENT_TIMESTAMP)
+        ON CONFLICT(user_id, lesson_id) WHERE question_id IS NULL
+        DO UPDATE SET completed = TRUE, completion_date = CURRENT_TIMESTAMP
+    """, (user_id, lesson_id))
+    if row is None or row[1]:
+        return False
+    record_course_progress_sync(conn, user_id, row[0], lessons=1)
+    return True
+
+
+def set_question_completed_sync(conn, user_id: int, course_id: int, lesson_id: int, question_id: int, is_completed):
+    """Записывает прогресс по вопросу и сдвигает счётчик вопросов в сводке, если состояние изменилось."""
+    row = conn.execute("""
+        SELECT is_completed FROM user_progress
+        WHERE user_id = ? AND course_id = ? AND lesson_id = ? AND question_id = ?
+    """, (user_id, course_id, lesson_id, question_id)).fetchone()
+    conn.execute(
+        "INSERT INTO user_progress (user_id, course_id, lesson_id, question_id, is_completed) "
+        "VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT(user_id, course_id, lesson_id, question_id) WHERE question_id IS NOT NULL "
+        "DO UPDATE SET is_completed = ?",
+        (user_id, course_id, lesson_id, question_id, is_completed, is_completed)
+    )
+    delta = bool(is_completed) - bool(row and row[0])
+    if delta:
+        record_course_progress_sync(conn, user_id, course_id, questions=delta)
+
+
+def rebuild_course_progress_sync(conn) -> int:
+    """
+    Пересчитывает course_progress по user_progress.
+    :return: Количество строк сводки
+    """
+    conn.execute("DELETE FROM course_progress")
+    conn.execute("""
+        INSERT INTO course_progress (user_id, course_id, completed_lessons, completed_questions)
+        SELECT user_id, course_id, SUM(lessons), SUM(questions)
+        FROM (
+            SELECT up.user_id, l.course_id, COUNT(*) AS lessons, 0 AS questions
+            FROM user_progress up
+            JOIN lessons l ON l.id = up.lesson_id
+            WHERE up.question_id IS NULL AND up.completed
+            GROUP BY up.user_id, l.course_id
+            UNION ALL
+            SELECT user_id, course_id, 0, COUNT(*)
+            FROM user_progress
+            WHERE question_id IS NOT NULL AND course_id IS NOT NULL AND is_completed
+            GROUP BY user_id, course_id
+        )
+        GROUP BY user_id, course_id
+    """)
+    return conn.execute("SELECT COUNT(*) FROM course_progress").fetchone()[0]
+
+
+def invalidate_course_totals(course_id: int = None):
+    """Сбрасывает закэшированные количества уроков и вопросов курса (или всех курсов)."""
+    if course_id is None:
+        _totals.clear()
+    else:
+        _totals.pop(course_id, None)
+
+
+async def get_course_totals(course_ids) -> dict[int, CourseTotals]:
+    """Количество уроков и вопросов курсов: из кэша, недостающие — одним запросом на все курсы."""
+    now = time.monotonic()
+    totals = {}
+    missing = []
+    for course_id in course_ids:
+        cached = _totals.get(course_id)
+        if cached is not None and now - cached[0] < COURSE_TOTALS_CACHE_TTL:
+            totals[course_id] = cached[1]
+        else:
+            missing.append(course_id)
+
+    if missing:
+        placeholders = ", ".join("?" * len(missing))
+        rows = await db_fetchall(f"""
+            SELECT l.course_id, COUNT(DISTINCT l.id), COUNT(q.id)
+            FROM lessons l
+            LEFT JOIN questions q ON q.lesson_id = l.id
+            WHERE l.course_id IN ({placeholders})
+            GROUP BY l.course_id
+        """, tuple(missing))
+        loaded = {row[0]: CourseTotals(row[1], row[2]) for row in rows}
+        for course_id in missing:
+            totals[course_id] = loaded.get(course_id, CourseTotals())
+            _totals[course_id] = (now, totals[course_id])
+    return totals
+
+
+async def get_user_course_progress(user_id: int) -> list[CourseProgress]:
+    """
+    Прогресс пользователя по купленным и начатым курсам.
+    Сводка читается одним запросом по первичному ключу course_progress, купленные курсы и
+    количества уроков и вопросов берутся из кэшей.
+    """
+    rows = await db_fetchall("""
+        SELECT cp.course_id, c.title, cp.completed_lessons, cp.completed_questions
+        FROM course_progress cp
+        JOIN courses c ON c.id = cp.course_id
+        WHERE cp.user_id = ?
+    """, (user_id,))
+    courses = {course["id"]: (course["title"], 0, 0) for course in await get_user_courses(user_id)}
+    courses.update((row[0], (row[1], row[2], row[3])) for row in rows)
+
+    totals = await get_course_totals(courses)
+    return [
+        CourseProgress(
+            course_id, title,
+            completed_lessons, totals[course_id].lessons,
+            completed_questions, totals[course_id].questions,
+        )
+        for course_id, (title, completed_lessons, completed_questions) in sorted(courses.items())
+    ]
+
+
+async def get_course_progress(user_id: int, course_id: int) -> Optional[dict]:
+    """
+    Прогресс пользователя по одному курсу: строка сводки (поиск по первичному ключу) и количества из кэша.
+    :return: Словарь с названием курса и числом пройденных/всех уроков и вопросов или None, если курса нет
+    """
+    row = await db_fetchone("""
+        SELECT c.title, cp.completed_lessons, cp.completed_questions
+        FROM courses c
+        LEFT JOIN course_progress cp ON cp.user_id = ? AND cp.course_id = c.id
+        WHERE c.id = ?
+    """, (user_id, course_id))
+    if row is None:
+        return None
+    totals = (await get_course_totals((course_id,)))[course_id]
+    return {
+        "course_title": row[0],
+        "completed_lessons": row[1] or 0,
+        "total_lessons": totals.lessons,
+        "completed_questions": row[2] or 0,
+        "total_questions": totals.questions,
+    }
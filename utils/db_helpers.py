@@ -0,0 +1,321 @@
+import asyncio
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import DB_PATH
+from utils.storage_config import DB_POOL_SIZE, DB_WRITE_BATCH_SIZE, connection_pragmas, apply_journal_mode
+
+# Количество потоков, в которых выполняются запросы на чтение (по одному соединению пула на поток).
+# Event loop бота никогда не ждёт диск: он только ставит задачу в очередь пула.
+DB_WORKERS = DB_POOL_SIZE
+
+# Соединение, простоявшее без дела дольше этого времени (в секундах), проверяется перед выдачей
+DB_HEALTHCHECK_INTERVAL = 30
+
+# PRAGMA, которые выполняются один раз при открытии каждого соединения
+CONNECTION_PRAGMAS = tuple(connection_pragmas())
+
+
+# Функция для подключения к базе данных
+def connect_db():
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row  # Доступ к столбцам и по индексу, и по имени
+    return conn
+
+
+class ConnectionPool:
+    """
+    Ограниченный пул долгоживущих соединений SQLite.
+
+    Соединения создаются лениво (не больше size), настраиваются PRAGMA один раз
+    и переиспользуются между запросами, поэтому схема не разбирается заново на каждый запрос.
+    """
+
+    def __init__(self, db_path: str, size: int = DB_POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self._idle = queue.LifoQueue(maxsize=size)  # LIFO: чаще используем «тёплые» соединения
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _open(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @staticmethod
+    def _is_healthy(conn) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn):
+        with self._lock:
+            self._created -= 1
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def acquire(self, timeout: float = None):
+        """Выдаёт соединение из пула, при необходимости создавая новое или дожидаясь свободного."""
+        if self._closed:
+            raise RuntimeError("Пул соединений с базой данных закрыт.")
+
+        while True:
+            try:
+                conn, released_at = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_create = self._created < self.size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    try:
+                        return self._open()
+                    except sqlite3.Error:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                try:
+                    conn, released_at = self._idle.get(timeout=timeout)
+                except queue.Empty:
+                    raise TimeoutError("Нет свободных соединений с базой данных.")
+
+            # Проверяем только соединения, которые долго простаивали
+            if time.monotonic() - released_at < DB_HEALTHCHECK_INTERVAL or self._is_healthy(conn):
+                return conn
+            self._discard(conn)
+
+    def release(self, conn):
+        """Возвращает соединение в пул (незавершённая транзакция откатывается)."""
+        if self._closed:
+            self._discard(conn)
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        self._idle.put((conn, time.monotonic()))
+
+    def warm_up(self, count: int = 1):
+        """Заранее открывает count соединений, чтобы первый запрос не платил за подключение."""
+        conns = [self.acquire() for _ in range(min(count, self.size))]
+        for conn in conns:
+            self.release(conn)
+
+    def close(self):
+        """Закрывает все простаивающие соединения; занятые закроются при возврате."""
+        self._closed = True
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
+class DBWriter:
+    """
+    Единственный писатель в базу данных.
+
+    Все операции записи попадают в очередь и выполняются по порядку в отдельном потоке
+    на собственном соединении. Операции, накопившиеся в очереди, фиксируются одним commit
+    (не больше DB_WRITE_BATCH_SIZE); каждая выполняется внутри SAVEPOINT, поэтому ошибка
+    одной операции не откатывает соседние.
+    """
+
+    def __init__(self, db_path: str, batch_size: int = DB_WRITE_BATCH_SIZE):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self._queue = asyncio.Queue()
+        self._thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+        self._conn = None
+        self._task = None
+        self.loop = None
+
+    def _open(self):
+        # isolation_level=None: транзакциями управляем сами (BEGIN IMMEDIATE / COMMIT)
+        conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        apply_journal_mode(conn)
+        return conn
+
+    def _execute_batch(self, batch):
+        if self._conn is None:
+            self._conn = self._open()
+        conn = self._conn
+        results = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for func, args, _ in batch:
+                conn.execute("SAVEPOINT write_job")
+                try:
+                    result = func(conn, *args)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write_job")
+                    conn.execute("RELEASE write_job")
+                    results.append((False, e))
+                else:
+                    conn.execute("RELEASE write_job")
+                    results.append((True, result))
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        return results
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self._task = self.loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            job = await self._queue.get()
+            if job is None:
+                break
+            batch = [job]
+            stop = False
+            # Забираем всё, что уже накопилось в очереди, — это и есть пакет для одного commit
+            while len(batch) < self.batch_size and not self._queue.empty():
+                next_job = self._queue.get_nowait()
+                if next_job is None:
+                    stop = True
+                    break
+                batch.append(next_job)
+            try:
+                results = await self.loop.run_in_executor(self._thread, self._execute_batch, batch)
+            except Exception as e:
+                results = [(False, e)] * len(batch)
+            for (_, _, future), (ok, value) in zip(batch, results):
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+            if stop:
+                break
+
+    async def submit(self, func, *args):
+        future = self.loop.create_future()
+        await self._queue.put((func, args, future))
+        return await future
+
+    async def stop(self):
+        """Дописывает всё, что уже стоит в очереди, и закрывает соединение писателя."""
+        if self._task is not None:
+            await self._queue.put(None)
+            await self._task
+            self._task = None
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            await self.loop.run_in_executor(self._thread, conn.close)
+        self._thread.shutdown(wait=True)
+
+
+_pool = None
+_executor = None
+_writer = None
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(DB_PATH, DB_POOL_SIZE)
+    return _pool
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="sqlite")
+    return _executor
+
+
+def get_writer() -> DBWriter:
+    global _writer
+    loop = asyncio.get_running_loop()
+    if _writer is None or _writer.loop is not loop:
+        _writer = DBWriter(DB_PATH)
+        _writer.start()
+    return _writer
+
+
+def _run_in_connection(func, args):
+    pool = get_pool()
+    conn = pool.acquire()
+    try:
+        # Контекстный менеджер соединения делает commit при успехе и rollback при ошибке
+        with conn:
+            return func(conn, *args)
+    finally:
+        pool.release(conn)
+
+
+async def run_db(func, *args):
+    """
+    Выполняет func(conn, *args) в потоке пула БД в рамках одной транзакции.
+    :param func: Синхронная функция, принимающая соединение первым аргументом
+    :return: Результат func
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), _run_in_connection, func, args)
+
+
+async def run_write(func, *args):
+    """
+    Выполняет func(conn, *args) через единственного писателя.
+    Используется для всех операций, изменяющих данные.
+    :param func: Синхронная функция, принимающая соединение первым аргументом
+    :return: Результат func
+    """
+    return await get_writer().submit(func, *args)
+
+
+async def db_execute(query: str, params: tuple = ()):
+    """Выполняет запрос на изменение данных и возвращает курсор (lastrowid, rowcount)."""
+    return await run_write(lambda conn: conn.execute(query, params))
+
+
+async def db_fetchone(query: str, params: tuple = ()):
+    """Возвращает первую строку результата (sqlite3.Row) или None."""
+    return await run_db(lambda conn: conn.execute(query, params).fetchone())
+
+
+async def db_fetchall(query: str, params: tuple = ()):
+    """Возвращает все строки результата (список sqlite3.Row)."""
+    return await run_db(lambda conn: conn.execute(query, params).fetchall())
+
+
+async def open_db():
+    """Хук запуска бота: запускает писателя, создаёт пул и заранее открывает соединения."""
+    get_writer()
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(_get_executor(), get_pool().warm_up, DB_POOL_SIZE)
+
+
+async def close_db():
+    """Хук остановки бота: дописывает очередь записи, дожидается текущих запросов и закрывает все соединения."""
+    global _pool, _executor, _writer
+    if _writer is not None:
+        writer, _writer = _writer, None
+        await writer.stop()
+    if _executor is not None:
+        executor, _executor = _executor, None
+        await asyncio.get_running_loop().run_in_executor(None, executor.shutdown, True)
+    if _pool is not None:
+        _pool.close()
+        _pool = None
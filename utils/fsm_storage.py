@@ -0,0 +1,139 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Mapping, Optional
+import config
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from utils.db_helpers import run_write, db_fetchone
+
+logger = logging.getLogger(__name__)
+
+# Где хранить состояния диалогов: "sqlite" (по умолчанию), "redis" или "memory"
+FSM_STORAGE = getattr(config, "FSM_STORAGE", "sqlite")
+# Адрес Redis для FSM_STORAGE = "redis" (нужен пакет redis)
+FSM_REDIS_URL = getattr(config, "FSM_REDIS_URL", "redis://localhost:6379/0")
+# Через сколько секунд без изменений незаконченный диалог считается брошенным и удаляется
+FSM_STATE_TTL = getattr(config, "FSM_STATE_TTL", 24 * 60 * 60)
+# Как часто (в секундах) удалять брошенные диалоги из SQLite
+FSM_SWEEP_INTERVAL = getattr(config, "FSM_SWEEP_INTERVAL", 60 * 60)
+
+# Ключ строки: бот, чат, пользователь, тред и назначение — как в RedisStorage, чтобы ключи совпадали
+_key_builder = DefaultKeyBuilder(prefix="fsm", with_bot_id=True, with_business_connection_id=True, with_destiny=True)
+
+
+def _state_name(state: StateType) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+
+def _set_state(conn, key: str, state: Optional[str], now: float):
+    conn.execute("""
+        INSERT INTO fsm_storage (key, state, data, updated_at) VALUES (?, ?, '{}', ?)
+        ON CONFLICT(key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+    """, (key, state, now))
+    _delete_if_empty(conn, key)
+
+
+def _set_data(conn, key: str, data: str, now: float):
+    conn.execute("""
+        INSERT INTO fsm_storage (key, state, data, updated_at) VALUES (?, NULL, ?, ?)
+        ON CONFLICT(key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+    """, (key, data, now))
+    _delete_if_empty(conn, key)
+
+
+def _update_data(conn, key: str, update: Mapping[str, Any], now: float) -> dict:
+    # Чтение и запись в одной транзакции писателя: параллельные update_data не теряют изменения друг друга
+    row = conn.execute("SELECT data FROM fsm_storage WHERE key = ?", (key,)).fetchone()
+    data = json.loads(row[0]) if row else {}
+    data.update(update)
+    _set_data(conn, key, json.dumps(data, ensure_ascii=False), now)
+    return data
+
+
+def _delete_if_empty(conn, key: str):
+    # Завершённый диалог (state.clear()) не оставляет строки в таблице
+    conn.execute("DELETE FROM fsm_storage WHERE key = ? AND state IS NULL AND data = '{}'", (key,))
+
+
+def _sweep(conn, older_than: float) -> int:
+    return conn.execute("DELETE FROM fsm_storage WHERE updated_at < ?", (older_than,)).rowcount
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище состояний FSM в таблице fsm_storage основной базы.
+
+    Состояния переживают перезапуск бота и доступны всем процессам, работающим с одним файлом БД.
+    Запись идёт через единственного писателя БД, который объединяет параллельные изменения
+    в одну транзакцию; чтение — одна выборка по первичному ключу из пула соединений.
+    """
+
+    def __init__(self, state_ttl: float = FSM_STATE_TTL):
+        self.state_ttl = state_ttl
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await run_write(_set_state, _key_builder.build(key), _state_name(state), time.time())
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        row = await db_fetchone("SELECT state FROM fsm_storage WHERE key = ?", (_key_builder.build(key),))
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await run_write(_set_data, _key_builder.build(key), json.dumps(dict(data), ensure_ascii=False), time.time())
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        row = await db_fetchone("SELECT data FROM fsm_storage WHERE key = ?", (_key_builder.build(key),))
+        return json.loads(row[0]) if row else {}
+
+    async def update_data(self, key: StorageKey, data: Mapping[str, Any]) -> dict[str, Any]:
+        return await run_write(_update_data, _key_builder.build(key), dict(data), time.time())
+
+    async def sweep(self) -> int:
+        """
+        Удаляет диалоги, которые не менялись дольше state_ttl.
+        :return: Количество удалённых записей
+        """
+        return await run_write(_sweep, time.time() - self.state_ttl)
+
+    async def close(self) -> None:
+        # Соединения принадлежат общему пулу БД и закрываются в close_db
+        pass
+
+
+async def fsm_sweep_loop(storage: SQLiteStorage, interval: float = FSM_SWEEP_INTERVAL):
+    """Фоновая задача: периодически удаляет брошенные диалоги."""
+    while True:
+        try:
+            removed = await storage.sweep()
+            if removed:
+                logger.info("Удалено брошенных диалогов: %s", removed)
+        except Exception:
+            logger.exception("Не удалось удалить брошенные диалоги")
+        await asyncio.sleep(interval)
+
+
+def create_redis_storage(redis=None, state_ttl: float = FSM_STATE_TTL) -> BaseStorage:
+    """
+    Хранилище FSM в Redis с теми же ключами, что и у SQLiteStorage.
+    Брошенные диалоги Redis удаляет сам по TTL ключей.
+    :param redis: Готовый клиент redis.asyncio (например, тестовая замена); по умолчанию — по FSM_REDIS_URL
+    """
+    # Необязательная зависимость: нужна только при FSM_STORAGE = "redis"
+    from aiogram.fsm.storage.redis import RedisStorage
+    if redis is None:
+        return RedisStorage.from_url(FSM_REDIS_URL, key_builder=_key_builder, state_ttl=state_ttl, data_ttl=state_ttl)
+    return RedisStorage(redis, key_builder=_key_builder, state_ttl=state_ttl, data_ttl=state_ttl)
+
+
+def create_fsm_storage(kind: str = FSM_STORAGE) -> BaseStorage:
+    """Хранилище FSM, выбранное в config.FSM_STORAGE."""
+    if kind == "sqlite":
+        return SQLiteStorage()
+    if kind == "redis":
+        return create_redis_storage()
+    if kind == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Неизвестное хранилище FSM: {kind}")
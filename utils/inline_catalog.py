@@ -0,0 +1,154 @@
+import asyncio
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+import config
+from aiogram.types import InlineQueryResultArticle, InputTextMessageContent
+from utils.catalog import product_catalog
+from utils.db_helpers import db_fetchall
+from utils.search import split_terms
+
+# Через сколько секунд индекс перестраивается (курсы не кэшируются отдельно и подхватываются так)
+INLINE_INDEX_TTL = getattr(config, "INLINE_INDEX_TTL", 60)
+# Сколько разных запросов хранить с готовым результатом
+INLINE_MEMO_SIZE = getattr(config, "INLINE_MEMO_SIZE", 1000)
+
+
+def _words(*texts) -> set[str]:
+    return {term for text in texts if text for term in split_terms(text, limit=None)}
+
+
+def _index_terms(entries: list) -> tuple[list[set[str]], list[tuple[str, int]]]:
+    title_terms, terms = [], []
+    for position, (_, _, title, *details) in enumerate(entries):
+        title_terms.append(_words(title))
+        for term in _words(title, *details):
+            terms.append((term, position))
+    terms.sort()
+    return title_terms, terms
+
+
+def _product_result(product: dict) -> InlineQueryResultArticle:
+    title = f"📦 {product['name']} — {product['price']} {config.CURRENCY}"
+    return InlineQueryResultArticle(
+        id=f"product:{product['id']}",
+        title=title,
+        description=(product["description"] or "")[:100],
+        input_message_content=InputTextMessageContent(message_text=f"{title}\n\n{product['description'] or ''}"),
+    )
+
+
+def _course_result(course: dict) -> InlineQueryResultArticle:
+    title = f"📚 {course['title']}"
+    return InlineQueryResultArticle(
+        id=f"course:{course['id']}",
+        title=title,
+        description=(course["description"] or "")[:100],
+        input_message_content=InputTextMessageContent(message_text=f"{title}\n\n{course['description'] or ''}"),
+    )
+
+
+class InlineCatalogIndex:
+    """
+    Индекс видимых продуктов и курсов в памяти для инлайн-режима.
+
+    Слова названий и описаний лежат в отсортированном списке, поэтому поиск по префиксу —
+    двоичный поиск без обращения к базе. InlineQueryResultArticle позиции создаётся при первой выдаче
+    и дальше переиспользуется; результаты запросов запоминаются до следующей перестройки индекса.
+    """
+
+    def __init__(self, ttl: float = INLINE_INDEX_TTL, memo_size: int = INLINE_MEMO_SIZE):
+        self.ttl = ttl
+        self.memo_size = memo_size
+        self._entries = []  # Позиции индекса: сначала продукты, затем курсы
+        self._results = {}  # Позиция -> готовый InlineQueryResultArticle
+        self._title_terms = []  # Слова названия каждой позиции (для ранжирования)
+        self._terms = []  # Отсортированные пары (слово, позиция)
+        self._memo = OrderedDict()  # Слова запроса -> позиции результатов
+        self._built_at = None
+        self._catalog_version = None
+        self._lock = asyncio.Lock()
+
+    def _is_fresh(self) -> bool:
+        return (
+            self._built_at is not None
+            and time.monotonic() - self._built_at < self.ttl
+            and self._catalog_version == product_catalog.version
+        )
+
+    async def ensure_built(self):
+        if self._is_fresh():
+            return
+        async with self._lock:
+            if not self._is_fresh():
+                await self.rebuild()
+
+    async def rebuild(self):
+        products = await product_catalog.visible_products()
+        version = product_catalog.version
+        courses = [dict(row) for row in await db_fetchall("SELECT id, title, description, tags FROM courses ORDER BY id")]
+
+        entries = [(_product_result, product, product["name"], product["description"], product["type"]) for product in products]
+        entries += [(_course_result, course, course["title"], course["description"], course["tags"]) for course in courses]
+        # Разбор текстов на слова — в отдельном потоке, чтобы не задерживать обработку других обновлений
+        title_terms, terms = await asyncio.to_thread(_index_terms, entries)
+
+        self._entries, self._title_terms, self._terms = entries, title_terms, terms
+        self._results = {}
+        self._memo.clear()
+        self._built_at = time.monotonic()
+        self._catalog_version = version
+
+    def _result(self, position: int) -> InlineQueryResultArticle:
+        result = self._results.get(position)
+        if result is None:
+            make_result, item = self._entries[position][:2]
+            result = self._results[position] = make_result(item)
+        return result
+
+    def _prefix_matches(self, prefix: str) -> set[int]:
+        positions = set()
+        index = bisect_left(self._terms, (prefix,))
+        while index < len(self._terms) and self._terms[index][0].startswith(prefix):
+            positions.add(self._terms[index][1])
+            index += 1
+        return positions
+
+    def _match(self, terms: tuple) -> list[int]:
+        matched = None
+        for term in terms:
+            positions = self._prefix_matches(term)
+            matched = positions if matched is None else matched & positions
+            if not matched:
+                return []
+
+        # Сначала позиции, у которых больше слов запроса совпало с названием
+        def rank(position):
+            title = self._title_terms[position]
+            return -sum(any(word.startswith(term) for word in title) for term in terms), position
+        return sorted(matched, key=rank)
+
+    async def search(self, query: str, offset: int, limit: int) -> tuple[list[InlineQueryResultArticle], bool]:
+        """
+        Порция результатов для инлайн-запроса; пустой запрос листает весь каталог.
+        :return: Результаты и признак того, что есть следующая порция
+        """
+        await self.ensure_built()
+        terms = tuple(split_terms(query))
+        if not terms:
+            positions = range(len(self._entries))
+            return [self._result(position) for position in positions[offset:offset + limit]], offset + limit < len(positions)
+
+        positions = self._memo.get(terms)
+        if positions is None:
+            positions = self._match(terms)
+            self._memo[terms] = positions
+            if len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        else:
+            self._memo.move_to_end(terms)
+        return [self._result(position) for position in positions[offset:offset + limit]], offset + limit < len(positions)
+
+
+# Общий индекс для инлайн-режима
+inline_catalog = InlineCatalogIndex()
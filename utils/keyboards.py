@@ -0,0 +1,74 @@
+import hashlib
+from collections import OrderedDict
+from typing import Optional, Union
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message
+from utils.pagination import Page, FORWARD, BACKWARD, encode_cursor
+
+# Для скольких сообщений помнить хэш последней показанной страницы
+SHOWN_PAGES_CACHE_SIZE = 10000
+
+# (chat_id, message_id) -> хэш страницы, которую бот показал в сообщении последней.
+# Нужен для повторных нажатий: callback от второго нажатия несёт ещё старое содержимое сообщения
+_shown_pages = OrderedDict()
+
+
+def navigation_buttons(namespace: str, page: Page, key=lambda item: item["id"]) -> list[InlineKeyboardButton]:
+    """Кнопки «назад/вперёд» с курсорами, указывающими на соседние страницы."""
+    buttons = []
+    if page.items and page.has_prev:
+        buttons.append(InlineKeyboardButton(
+            text="⬅️ Previous", callback_data=encode_cursor(namespace, BACKWARD, key(page.items[0]))
+        ))
+    if page.items and page.has_next:
+        buttons.append(InlineKeyboardButton(
+            text="➡️ Next", callback_data=encode_cursor(namespace, FORWARD, key(page.items[-1]))
+        ))
+    return buttons
+
+
+def page_hash(text: Optional[str], reply_markup: Optional[InlineKeyboardMarkup]) -> str:
+    """
+    Хэш отображаемой страницы: текст (Telegram обрезает пробелы по краям) и кнопки.
+    Одинаков для только что собранной страницы и для той же страницы, полученной из сообщения.
+    """
+    markup = reply_markup.model_dump_json(exclude_none=True) if reply_markup else ""
+    return hashlib.blake2b(f"{(text or '').strip()}\0{markup}".encode(), digest_size=16).hexdigest()
+
+
+async def show_page(target: Union[Message, CallbackQuery], text: str, reply_markup: Optional[InlineKeyboardMarkup] = None):
+    """
+    Показывает страницу списка.
+    В ответ на команду отправляет новое сообщение, а при переходе по кнопке сразу отвечает на callback
+    и редактирует то же сообщение. Если страница не изменилась, запрос к Telegram не отправляется.
+    """
+    if isinstance(target, Message):
+        await target.answer(text, reply_markup=reply_markup)
+        return
+
+    await target.answer()  # Убираем «часики» на кнопке до редактирования
+    message = target.message
+    new_hash = page_hash(text, reply_markup)
+    message_key = (message.chat.id, message.message_id)
+    if new_hash in (_shown_pages.get(message_key), page_hash(message.text, message.reply_markup)):
+        return
+    _remember_page(message_key, new_hash)
+    try:
+        if (message.text or "").strip() == text.strip():
+            await message.edit_reply_markup(reply_markup=reply_markup)
+        else:
+            await message.edit_text(text, reply_markup=reply_markup)
+    except TelegramBadRequest as e:
+        if "message is not modified" in str(e):
+            return
+        # Сообщение нельзя отредактировать (удалено, слишком старое, это фото) — отправляем новое
+        _shown_pages.pop(message_key, None)
+        sent = await message.answer(text, reply_markup=reply_markup)
+        _remember_page((sent.chat.id, sent.message_id), new_hash)
+
+
+def _remember_page(message_key: tuple[int, int], content_hash: str):
+    _shown_pages[message_key] = content_hash
+    _shown_pages.move_to_end(message_key)
+    if len(_shown_pages) > SHOWN_PAGES_CACHE_SIZE:
+        _shown_pages.popitem(last=False)
@@ -0,0 +1,190 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable, Iterable, NamedTuple, Optional
+from utils.db_helpers import db_fetchall
+
+
+class QuestionRecord(NamedTuple):
+    id: int
+    lesson_id: int
+    text: str
+    options: str  # Варианты ответа через запятую
+    correct_answer: int  # Номер правильного варианта, начиная с 1
+
+    @property
+    def option_list(self) -> list[str]:
+        return [option.strip() for option in (self.options or "").split(",") if option.strip()]
+
+    @property
+    def correct_option(self) -> Optional[str]:
+        """Текст правильного варианта или None, если номер не указан или вне списка."""
+        options = self.option_list
+        if not self.correct_answer or not 0 < self.correct_answer <= len(options):
+            return None
+        return options[self.correct_answer - 1]
+
+
+class LessonRecord(NamedTuple):
+    id: int
+    course_id: int
+    title: str
+    description: Optional[str]
+    material_link: Optional[str]
+    questions: tuple[QuestionRecord, ...] = ()  # Заполняется в CourseLoaders.lesson и CourseLoaders.course
+
+
+class CourseRecord(NamedTuple):
+    id: int
+    title: str
+    description: Optional[str]
+    partner_id: Optional[int]
+    lessons: tuple[LessonRecord, ...] = ()  # Заполняется в CourseLoaders.course
+
+
+def _placeholders(keys: list) -> str:
+    return ", ".join("?" * len(keys))
+
+
+class BatchLoader:
+    """
+    Загрузчик по ключам в духе DataLoader.
+
+    Вызовы load(), сделанные в одной итерации цикла событий (например, внутри asyncio.gather
+    или load_many), объединяются в один вызов batch_fn со списком ключей — то есть в один запрос
+    WHERE id IN (...). Результат по каждому ключу запоминается, повторный load() того же ключа
+    к базе не обращается. Загрузчик живёт одно обновление (см. CourseLoadersMiddleware),
+    поэтому кэш не нужно сбрасывать после изменений.
+    """
+
+    def __init__(self, batch_fn: Callable[[list], Awaitable[dict]], default: Any = None):
+        """
+        :param batch_fn: Асинхронная функция: список ключей -> словарь {ключ: значение}
+        :param default: Значение для ключей, которых нет в ответе batch_fn
+        """
+        self._batch_fn = batch_fn
+        self._default = default
+        self._futures: dict[Hashable, asyncio.Future] = {}
+        self._pending: list = []
+        self._tasks = set()
+        self.batches = 0  # Сколько раз вызывалась batch_fn
+
+    def load(self, key: Hashable) -> Awaitable:
+        future = self._futures.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._futures[key] = loop.create_future()
+            self._pending.append(key)
+            if len(self._pending) == 1:
+                # Остальные ключи этой итерации цикла попадут в ту же пачку
+                loop.call_soon(self._dispatch)
+        return future
+
+    async def load_many(self, keys: Iterable[Hashable]) -> list:
+        return list(await asyncio.gather(*(self.load(key) for key in keys)))
+
+    def prime(self, key: Hashable, value: Any):
+        """Запоминает значение, полученное другим запросом (например, уроки вместе со списком курса)."""
+        if key not in self._futures:
+            future = self._futures[key] = asyncio.get_running_loop().create_future()
+            future.set_result(value)
+
+    def _dispatch(self):
+        keys, self._pending = self._pending, []
+        task = asyncio.create_task(self._run_batch(keys))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, keys: list):
+        self.batches += 1
+        try:
+            values = await self._batch_fn(keys)
+        except Exception as e:
+            for key in keys:
+                # Ошибку получат все ожидающие; следующий load() этих ключей попробует снова
+                future = self._futures.pop(key)
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key in keys:
+            future = self._futures[key]
+            if not future.done():
+                future.set_result(values.get(key, self._default))
+
+
+class CourseLoaders:
+    """
+    Загрузчики курсов, уроков и вопросов на одно обновление; передаются обработчикам в аргументе loaders.
+
+        lesson = await loaders.lesson(lesson_id)  # урок с вопросами — два запроса
+        course = await loaders.course(course_id)  # курс с уроками и вопросами — три запроса при любом числе уроков
+    """
+
+    def __init__(self):
+        self.courses = BatchLoader(self._load_courses)
+        self.lessons = BatchLoader(self._load_lessons)
+        self.lessons_by_course = BatchLoader(self._load_lessons_by_course, default=())
+        self.questions_by_lesson = BatchLoader(self._load_questions_by_lesson, default=())
+
+    @staticmethod
+    async def _load_courses(ids: list) -> dict[int, CourseRecord]:
+        rows = await db_fetchall(
+            f"SELECT id, title, description, partner_id FROM courses WHERE id IN ({_placeholders(ids)})", tuple(ids)
+        )
+        return {row[0]: CourseRecord(*row) for row in rows}
+
+    @staticmethod
+    async def _load_lessons(ids: list) -> dict[int, LessonRecord]:
+        rows = await db_fetchall(
+            f"SELECT id, course_id, title, description, material_link FROM lessons WHERE id IN ({_placeholders(ids)})",
+            tuple(ids)
+        )
+        return {row[0]: LessonRecord(*row) for row in rows}
+
+    async def _load_lessons_by_course(self, course_ids: list) -> dict[int, tuple[LessonRecord, ...]]:
+        rows = await db_fetchall(f"""
+            SELECT id, course_id, title, description, material_link FROM lessons
+            WHERE course_id IN ({_placeholders(course_ids)})
+            ORDER BY course_id, id
+        """, tuple(course_ids))
+        lessons = {}
+        for row in rows:
+            lesson = LessonRecord(*row)
+            lessons.setdefault(lesson.course_id, []).append(lesson)
+            self.lessons.prime(lesson.id, lesson)
+        return {course_id: tuple(items) for course_id, items in lessons.items()}
+
+    @staticmethod
+    async def _load_questions_by_lesson(lesson_ids: list) -> dict[int, tuple[QuestionRecord, ...]]:
+        rows = await db_fetchall(f"""
+            SELECT id, lesson_id, text, options, correct_answer FROM questions
+            WHERE lesson_id IN ({_placeholders(lesson_ids)})
+            ORDER BY lesson_id, id
+        """, tuple(lesson_ids))
+        questions = {}
+        for row in rows:
+            questions.setdefault(row[1], []).append(QuestionRecord(*row))
+        return {lesson_id: tuple(items) for lesson_id, items in questions.items()}
+
+    async def lesson(self, lesson_id: int) -> Optional[LessonRecord]:
+        """Урок с вопросами или None."""
+        lesson, questions = await asyncio.gather(
+            self.lessons.load(lesson_id), self.questions_by_lesson.load(lesson_id)
+        )
+        return lesson._replace(questions=questions) if lesson else None
+
+    async def course(self, course_id: int) -> Optional[CourseRecord]:
+        """Курс с уроками по порядку и вопросами каждого урока или None."""
+        course, lessons = await asyncio.gather(
+            self.courses.load(course_id), self.lessons_by_course.load(course_id)
+        )
+        if course is None:
+            return None
+        questions = await self.questions_by_lesson.load_many(lesson.id for lesson in lessons)
+        return course._replace(lessons=tuple(
+            lesson._replace(questions=lesson_questions) for lesson, lesson_questions in zip(lessons, questions)
+        ))
+
+    async def next_lesson(self, lesson: LessonRecord) -> Optional[LessonRecord]:
+        """Следующий урок того же курса (с вопросами) или None, если урок последний."""
+        lessons = await self.lessons_by_course.load(lesson.course_id)
+        following = next((item for item in lessons if item.id > lesson.id), None)
+        return await self.lesson(following.id) if following else None
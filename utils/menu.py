@@ -0,0 +1,75 @@
+import re
+from typing import Any, Callable, Iterable, Optional
+from aiogram import Router
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.types import Message
+
+_SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_button(text: str) -> str:
+    """Ключ кнопки: без лишних пробелов, без учёта регистра, «ё» = «е»."""
+    return _SPACES_RE.sub(" ", text.strip()).casefold().replace("ё", "е")
+
+
+class MenuDispatcher:
+    """
+    Таблица кнопок reply-клавиатуры: нормализованный текст кнопки -> обработчик.
+
+    Вместо отдельного фильтра на каждую кнопку в каждом маршрутизаторе — один фильтр
+    в маршрутизаторе меню, который подключается первым: поиск обработчика — одно обращение к словарю,
+    а сообщения, не совпавшие ни с одной кнопкой, идут дальше по остальным маршрутизаторам.
+    Кнопки срабатывают только вне сценариев (состояние FSM не задано или одно из idle_states):
+    посреди сценария текст с названием кнопки — это ответ на вопрос сценария, и он уходит его обработчику.
+    Исключение — кнопки выхода (any_state=True, например «Назад в главное меню»): они работают в любом
+    состоянии, и их обработчик сбрасывает состояние, иначе брошенный сценарий держал бы пользователя вне меню.
+    Обработчики получают те же аргументы, что и обычные (state, profile и т. д.).
+    """
+
+    def __init__(self, name: str = "menu", idle_states: Iterable[Optional[str]] = (None, "main_menu")):
+        """
+        :param idle_states: Состояния FSM, в которых работают кнопки меню
+            ("main_menu" — состояние, которое задаёт /start, см. handlers/start_handler.py)
+        """
+        self.router = Router(name=name)
+        self.idle_states = frozenset(idle_states)
+        self._handlers: dict[str, CallableObject] = {}
+        self._any_state: set[str] = set()  # Кнопки выхода из сценария
+        self.router.message.register(self._dispatch, self._match)
+
+    def button(self, *texts: str, any_state: bool = False) -> Callable:
+        """
+        Регистрирует обработчик для кнопок с указанными текстами (на всех языках):
+
+            @menu.button("Баланс", "Balance")
+            async def balance(message: Message, profile: UserProfile): ...
+
+        :param any_state: Кнопка работает и посреди сценария; обработчик должен вызвать state.clear()
+        """
+        def decorator(callback: Callable) -> Callable:
+            handler = CallableObject(callback)
+            for text in texts:
+                key = normalize_button(text)
+                if key in self._handlers:
+                    raise ValueError(f"Кнопка «{text}» уже зарегистрирована")
+                self._handlers[key] = handler
+                if any_state:
+                    self._any_state.add(key)
+            return callback
+        return decorator
+
+    def _match(self, message: Message, raw_state: Optional[str] = None) -> Any:
+        if message.text is None:
+            return False
+        key = normalize_button(message.text)
+        handler = self._handlers.get(key)
+        if handler is None or (raw_state not in self.idle_states and key not in self._any_state):
+            return False
+        return {"menu_handler": handler}
+
+    async def _dispatch(self, message: Message, menu_handler: CallableObject, **data: Any) -> Any:
+        return await menu_handler.call(message, **data)
+
+
+# Общая таблица кнопок; маршрутизатор menu.router подключается в bot.py раньше остальных
+menu = MenuDispatcher()
@@ -0,0 +1,40 @@
+from typing import Any, Awaitable, Callable
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from utils.loaders import CourseLoaders
+from utils.profiles import get_user_profile
+
+
+class UserProfileMiddleware(BaseMiddleware):
+    """
+    Загружает профиль автора обновления (роль, язык, баланс) один раз на обновление
+    и передаёт его фильтрам и обработчикам в аргументе profile.
+    Регистрируется как outer-middleware обновлений, после встроенного UserContextMiddleware.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is not None:
+            data["profile"] = await get_user_profile(user.id)
+        return await handler(event, data)
+
+
+class CourseLoadersMiddleware(BaseMiddleware):
+    """
+    Создаёт загрузчики курсов, уроков и вопросов (utils/loaders.py) на время одного обновления
+    и передаёт их обработчикам в аргументе loaders. Запросы к базе выполняются только при обращении.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        data["loaders"] = CourseLoaders()
+        return await handler(event, data)
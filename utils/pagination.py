@@ -0,0 +1,71 @@
+from typing import NamedTuple
+
+# Telegram принимает callback_data не длиннее 64 байт
+CALLBACK_DATA_LIMIT = 64
+
+# Направление перехода: страница после ключа (вперёд) или перед ключом (назад)
+FORWARD = ">"
+BACKWARD = "<"
+
+
+class Page(NamedTuple):
+    items: list
+    has_prev: bool
+    has_next: bool
+
+
+def encode_cursor(namespace: str, direction: str, key: int) -> str:
+    """
+    Курсор страницы для callback_data: "<пространство>:<направление><ключ в base36>",
+    например "pp:>1z" — продукты после ID 71. Длина не зависит от номера страницы.
+    """
+    data = f"{namespace}:{direction}{_to_base36(key)}"
+    if len(data.encode()) > CALLBACK_DATA_LIMIT:
+        raise ValueError(f"callback_data длиннее {CALLBACK_DATA_LIMIT} байт: {data}")
+    return data
+
+
+def decode_cursor(data: str) -> tuple[str, int]:
+    """:return: Направление и ключ из callback_data, созданной encode_cursor"""
+    cursor = data.split(":", 1)[1]
+    if not cursor or cursor[0] not in (FORWARD, BACKWARD):
+        raise ValueError(f"Некорректный курсор: {data}")
+    return cursor[0], int(cursor[1:], 36)
+
+
+def _to_base36(number: int) -> str:
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    if number == 0:
+        return "0"
+    result = ""
+    while number:
+        number, remainder = divmod(number, 36)
+        result = digits[remainder] + result
+    return result
+
+
+def fetch_keyset_page(conn, query: str, params: tuple, key_column: str, direction: str, key: int, limit: int) -> Page:
+    """
+    Одна страница по ключу: диапазонное чтение по индексу, без OFFSET.
+    Читается limit + 1 строка — лишняя строка только показывает, есть ли страница дальше.
+    :param query: SELECT ... WHERE <условие> — к нему добавляются условие по ключу, ORDER BY и LIMIT
+    :param key_column: Столбец ключа (последний столбец индекса, которым отфильтрован query)
+    :param key: Ключ последнего элемента предыдущей страницы (вперёд) или первого элемента следующей (назад);
+        0 при переходе вперёд — первая страница
+    """
+    if direction == BACKWARD:
+        sql = f"{query} AND {key_column} < ? ORDER BY {key_column} DESC LIMIT ?"
+    else:
+        sql = f"{query} AND {key_column} > ? ORDER BY {key_column} LIMIT ?"
+    rows = conn.execute(sql, params + (key, limit + 1)).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if direction == BACKWARD:
+        if not rows:
+            # Предыдущие элементы удалены — показываем первую страницу
+            return fetch_keyset_page(conn, query, params, key_column, FORWARD, 0, limit)
+        rows.reverse()
+        return Page(rows, has_more, True)
+    return Page(rows, key > 0, has_more)
+
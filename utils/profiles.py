@@ -0,0 +1,88 @@
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+import config
+from utils.db_helpers import db_fetchone
+
+# Сколько профилей держать в памяти и сколько секунд профиль считается актуальным.
+# Изменения через функции database.py и payment.py сбрасывают профиль сразу, TTL — страховка
+PROFILE_CACHE_SIZE = getattr(config, "PROFILE_CACHE_SIZE", 10000)
+PROFILE_CACHE_TTL = getattr(config, "PROFILE_CACHE_TTL", 60)
+
+
+class UserProfile(NamedTuple):
+    user_id: int
+    exists: bool  # Зарегистрирован ли пользователь (есть ли строка в users)
+    role: Optional[str] = None
+    language: str = config.DEFAULT_LANGUAGE
+    balance: float = 0.0  # Баланс на момент загрузки профиля
+    referral_link: Optional[str] = None
+
+    @property
+    def is_partner(self) -> bool:
+        return self.role == "partner"
+
+
+# user_id -> (время загрузки, профиль); самые давно запрошенные вытесняются первыми
+_profiles = OrderedDict()
+
+# user_id -> [число незавершённых загрузок, поколение]; поколение растёт при каждом сбросе профиля.
+# Хранится, только пока профиль пользователя читается из базы
+_loads = {}
+# Растёт при сбросе всех профилей
+_generation = 0
+
+
+def invalidate_user_profile(user_id: int = None):
+    """Сбрасывает профиль пользователя (или все профили) — следующее обращение перечитает его из базы."""
+    global _generation
+    if user_id is None:
+        _profiles.clear()
+        _generation += 1
+    else:
+        _profiles.pop(user_id, None)
+        load = _loads.get(user_id)
+        if load is not None:
+            load[1] += 1
+
+
+async def get_user_profile(user_id: int) -> UserProfile:
+    """Профиль из кэша или одним запросом строки пользователя."""
+    cached = _profiles.get(user_id)
+    if cached is not None and time.monotonic() - cached[0] < PROFILE_CACHE_TTL:
+        _profiles.move_to_end(user_id)
+        return cached[1]
+
+    load = _loads.setdefault(user_id, [0, 0])
+    load[0] += 1
+    started = (_generation, load[1])
+    try:
+        row = await db_fetchone(
+            "SELECT role, language, balance, referral_link FROM users WHERE user_id = ?", (user_id,)
+        )
+    finally:
+        load[0] -= 1
+        if not load[0]:
+            del _loads[user_id]
+    if row is None:
+        profile = UserProfile(user_id, exists=False)
+    else:
+        profile = UserProfile(
+            user_id,
+            exists=True,
+            role=row[0],
+            # Язык не выбран — используем язык бота по умолчанию
+            language=row[1] or config.DEFAULT_LANGUAGE,
+            balance=row[2] or 0.0,
+            referral_link=row[3],
+        )
+
+    if (_generation, load[1]) != started:
+        # Профиль сбросили, пока шёл запрос: строка могла быть прочитана до изменения — не кэшируем её
+        return profile
+
+    _profiles[user_id] = (time.monotonic(), profile)
+    _profiles.move_to_end(user_id)
+    if len(_profiles) > PROFILE_CACHE_SIZE:
+        _profiles.popitem(last=False)
+    return profile
@@ -0,0 +1,249 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Union
+import config
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: около 30 сообщений в секунду на бота, 1 в секунду в личный чат, 20 в минуту в группу
+OUTBOUND_GLOBAL_RATE = getattr(config, "OUTBOUND_GLOBAL_RATE", 30)
+OUTBOUND_CHAT_RATE = getattr(config, "OUTBOUND_CHAT_RATE", 1)
+OUTBOUND_GROUP_RATE = getattr(config, "OUTBOUND_GROUP_RATE", 20 / 60)
+# Сколько сообщений в один чат можно отправить подряд без ожидания (например, ответ из нескольких сообщений)
+OUTBOUND_CHAT_BURST = getattr(config, "OUTBOUND_CHAT_BURST", 3)
+# Сколько раз повторять запрос после ответа 429 (RetryAfter)
+OUTBOUND_MAX_RETRIES = getattr(config, "OUTBOUND_MAX_RETRIES", 3)
+# Для скольких чатов помнить ограничение (давно неактивные вытесняются)
+OUTBOUND_CHATS_CACHE_SIZE = getattr(config, "OUTBOUND_CHATS_CACHE_SIZE", 10000)
+# Как часто (в секундах) записывать в лог метрики очереди отправки, если в ней кто-то ждёт
+OUTBOUND_METRICS_INTERVAL = getattr(config, "OUTBOUND_METRICS_INTERVAL", 10)
+
+# Классы приоритета: меньше — раньше. Ответы пользователям всегда идут впереди рассылок
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BROADCAST = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BROADCAST: "broadcast"}
+
+# Приоритет отправок текущей задачи; меняется через send_priority()
+_send_priority = ContextVar("send_priority", default=PRIORITY_INTERACTIVE)
+
+# Методы, которые создают или меняют сообщения в чате и попадают под лимиты Telegram
+_LIMITED_PREFIXES = ("send", "copy", "forward", "editMessage")
+
+
+@contextmanager
+def send_priority(priority: int):
+    """
+    Отправки внутри блока идут с указанным приоритетом, например рассылка:
+
+        with send_priority(PRIORITY_BROADCAST):
+            await bot.send_message(user_id, text)
+    """
+    token = _send_priority.set(priority)
+    try:
+        yield
+    finally:
+        _send_priority.reset(token)
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity про запас."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated_at")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        if now > self.updated_at:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+
+    def reserve(self) -> float:
+        """
+        Забирает токен (возможно, в долг).
+        :return: Сколько секунд подождать, прежде чем отправлять
+        """
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate) + max(0.0, self.updated_at - now)
+
+    def block(self, seconds: float):
+        """Запрещает отправку на seconds секунд (после ответа 429)."""
+        self.tokens = min(self.tokens, 0.0)
+        self.updated_at = max(self.updated_at, time.monotonic() + seconds)
+
+    def is_idle(self) -> bool:
+        now = time.monotonic()
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class PriorityGate:
+    """
+    Общий лимит бота с очередью по приоритетам.
+
+    Пока токены есть и никто не ждёт, запрос проходит сразу. Иначе он встаёт в очередь,
+    и токены по мере появления выдаются сначала запросам с меньшим номером приоритета,
+    внутри приоритета — по порядку.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.bucket = TokenBucket(rate, capacity)
+        self._waiters = []  # (приоритет, номер, future)
+        self._counter = itertools.count()
+        self._pump = None
+
+    def depth(self) -> dict[str, int]:
+        depth = dict.fromkeys(PRIORITY_NAMES.values(), 0)
+        for priority, _, future in self._waiters:
+            if not future.done():
+                depth[PRIORITY_NAMES.get(priority, str(priority))] += 1
+        return depth
+
+    async def acquire(self, priority: int):
+        if not self._waiters:
+            self.bucket._refill(time.monotonic())
+            if self.bucket.tokens >= 1 and self.bucket.updated_at <= time.monotonic():
+                self.bucket.tokens -= 1
+                return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._release())
+        await future
+
+    async def _release(self):
+        while self._waiters:
+            priority, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                # Отправитель отменил ожидание — токен не тратим
+                continue
+            delay = self.bucket.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+            if not future.done():
+                future.set_result(None)
+
+
+class OutboundRateLimiter(BaseRequestMiddleware):
+    """
+    Планировщик исходящих запросов к Bot API, подключается как middleware сессии бота:
+
+        bot.session.middleware(OutboundRateLimiter())
+
+    Каждое сообщение сначала ждёт лимита своего чата, затем общего лимита бота (с приоритетом
+    отправки — ответы раньше рассылок). Ответ 429 задерживает чат на retry_after секунд,
+    после чего запрос повторяется. Остальные методы (answerCallbackQuery, getMe и т. п.) не ограничиваются.
+    """
+
+    def __init__(self, global_rate: float = OUTBOUND_GLOBAL_RATE, chat_rate: float = OUTBOUND_CHAT_RATE,
+                 group_rate: float = OUTBOUND_GROUP_RATE, chat_burst: int = OUTBOUND_CHAT_BURST,
+                 max_retries: int = OUTBOUND_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        # Общий лимит без запаса: иначе запас и поток за ту же секунду вместе превысят лимит Telegram
+        self.gate = PriorityGate(global_rate, 1)
+        self._chats = OrderedDict()  # ID чата -> TokenBucket
+        self._waiting_for_chat = 0
+        self.sent = 0
+        self.retried = 0
+        self.wait_time = 0.0
+
+    def _chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Отрицательные ID — группы и каналы, у них лимит строже
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            rate = self.group_rate if is_group else self.chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, self.chat_burst)
+            if len(self._chats) > OUTBOUND_CHATS_CACHE_SIZE:
+                self._evict_idle()
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    def _evict_idle(self):
+        # Вытесняем только чаты с полным запасом токенов — у остальных ограничение ещё действует
+        for chat_id in list(itertools.islice(self._chats, len(self._chats) - OUTBOUND_CHATS_CACHE_SIZE + 100)):
+            if self._chats[chat_id].is_idle():
+                del self._chats[chat_id]
+
+    async def _wait_turn(self, chat_id: Any, priority: int):
+        started = time.monotonic()
+        if chat_id is not None:
+            delay = self._chat_bucket(chat_id).reserve()
+            if delay:
+                self._waiting_for_chat += 1
+                try:
+                    await asyncio.sleep(delay)
+                finally:
+                    self._waiting_for_chat -= 1
+        await self.gate.acquire(priority)
+        self.wait_time += time.monotonic() - started
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod,
+    ) -> Response:
+        if not method.__api_method__.startswith(_LIMITED_PREFIXES):
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, "chat_id", None)
+        priority = _send_priority.get()
+        attempt = 0
+        while True:
+            await self._wait_turn(chat_id, priority)
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                self.retried += 1
+                logger.warning("Telegram просит подождать %s с (чат %s), повтор %s", e.retry_after, chat_id, attempt)
+                if chat_id is not None:
+                    self._chat_bucket(chat_id).block(e.retry_after)
+                else:
+                    self.gate.bucket.block(e.retry_after)
+                continue
+            self.sent += 1
+            return response
+
+    def metrics(self) -> dict:
+        """Глубина очередей и счётчики отправок."""
+        return {
+            "queued": self.gate.depth(),
+            "waiting_for_chat": self._waiting_for_chat,
+            "sent": self.sent,
+            "retried": self.retried,
+            "avg_wait_ms": round(self.wait_time / self.sent * 1000, 2) if self.sent else 0.0,
+        }
+
+
+async def outbound_metrics_loop(limiter: OutboundRateLimiter, interval: float = OUTBOUND_METRICS_INTERVAL):
+    """Фоновая задача: пишет метрики отправки в лог, когда сообщения ждут очереди или были ответы 429."""
+    retried = 0
+    while True:
+        await asyncio.sleep(interval)
+        metrics = limiter.metrics()
+        if any(metrics["queued"].values()) or metrics["waiting_for_chat"] or metrics["retried"] != retried:
+            logger.info("Очередь отправки: %s", metrics)
+        retried = metrics["retried"]
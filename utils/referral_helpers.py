@@ -0,0 +1,208 @@
+import time
+import config
+from collections import OrderedDict
+from payment import MINOR_UNITS, LedgerKind, post_entry
+from utils.db_helpers import run_write, db_fetchone, db_fetchall
+
+# Доля бонуса за приглашённого (в процентах), которую получает предок на каждом уровне:
+# первый элемент — прямой пригласивший, второй — пригласивший его и т. д.
+# Например, (100, 50, 20) платит 100% бонуса на 1-м уровне, 50% на 2-м и 20% на 3-м.
+REFERRAL_LEVEL_PERCENTS = tuple(getattr(config, "REFERRAL_LEVEL_PERCENTS", (100,)))
+
+# Глубина, до которой хранится дерево рефералов (ограничивает размер таблицы замыканий)
+REFERRAL_TREE_MAX_DEPTH = max(getattr(config, "REFERRAL_TREE_MAX_DEPTH", 10), len(REFERRAL_LEVEL_PERCENTS))
+
+# Сколько пользователей держать в кэше статистики рефералов и сколько секунд статистика считается актуальной.
+# Новый реферал сбрасывает статистику в процессе, который его записал; другие процессы
+# (BOT_WORKERS > 1) увидят его по истечении TTL
+REFERRAL_STATS_CACHE_SIZE = getattr(config, "REFERRAL_STATS_CACHE_SIZE", 10000)
+REFERRAL_STATS_CACHE_TTL = getattr(config, "REFERRAL_STATS_CACHE_TTL", 60)
+
+# Бонус за реферала до появления журнала баланса (10 VED) — для рефералов без записи в журнале
+LEGACY_REFERRAL_BONUS_MINOR = 10 * MINOR_UNITS
+
+# user_id -> (время загрузки, {"count": ..., "earnings": ...}); самые давно запрошенные вытесняются первыми
+_stats_cache = OrderedDict()
+
+
+def record_referral_stats_sync(conn, referrer_id: int, bonus_minor: int, new_referrals: int = 1):
+    """Увеличивает счётчики пригласившего в той же транзакции, в которой записан реферал."""
+    conn.execute("""
+        INSERT INTO referral_stats (referrer_id, referral_count, earnings_minor)
+        VALUES (?, ?, ?)
+        ON CONFLICT(referrer_id) DO UPDATE SET
+            referral_count = referral_count + excluded.referral_count,
+            earnings_minor = earnings_minor + excluded.earnings_minor
+    """, (referrer_id, new_referrals, bonus_minor))
+
+
+def add_to_referral_tree_sync(conn, referrer_id: int, referred_id: int):
+    """
+    Добавляет нового пользователя в таблицу замыканий дерева рефералов:
+    он становится потомком пригласившего (глубина 1) и всех его предков (глубина + 1).
+    """
+    conn.execute("""
+        INSERT OR IGNORE INTO referral_tree (ancestor_id, descendant_id, depth)
+        SELECT ?, ?, 1
+        UNION ALL
+        SELECT ancestor_id, ?, depth + 1
+        FROM referral_tree
+        WHERE descendant_id = ? AND depth < ?
+    """, (referrer_id, referred_id, referred_id, referrer_id, REFERRAL_TREE_MAX_DEPTH))
+
+
+def pay_referral_bonuses_sync(conn, referred_id: int, bonus_minor: int, percents=REFERRAL_LEVEL_PERCENTS) -> list[int]:
+    """
+    Начисляет бонус за приглашённого всем предкам по уровням согласно percents
+    и обновляет их статистику. Вызывается после add_to_referral_tree_sync в той же транзакции.
+    :return: ID пользователей, чья статистика изменилась
+    """
+    # Предков, которых нет в users (например, ссылка с несуществующим ID), пропускаем:
+    # им нечего начислять, и статистика не должна расходиться с журналом
+    ancestors = conn.execute("""
+        SELECT rt.ancestor_id, rt.depth FROM referral_tree rt
+        JOIN users u ON u.user_id = rt.ancestor_id
+        WHERE rt.descendant_id = ? AND rt.depth <= ?
+        ORDER BY rt.depth
+    """, (referred_id, len(percents))).fetchall()
+
+    updated = []
+    for ancestor_id, depth in ancestors:
+        amount_minor = bonus_minor * percents[depth - 1] // 100
+        paid_minor = 0
+        if amount_minor:
+            reference = f"referral:{referred_id}" if depth == 1 else f"referral:{referred_id}:level{depth}"
+            if post_entry(conn, ancestor_id, amount_minor, LedgerKind.REFERRAL_BONUS, reference):
+                paid_minor = amount_minor
+        if paid_minor or depth == 1:
+            # Количество рефералов считаем только для прямого пригласившего;
+            # в заработок идёт только то, что действительно записано в журнал
+            record_referral_stats_sync(conn, ancestor_id, paid_minor, 1 if depth == 1 else 0)
+            updated.append(ancestor_id)
+    return updated
+
+
+def invalidate_referral_stats(referrer_id: int = None):
+    """Сбрасывает кэш статистики одного пользователя (или весь кэш)."""
+    if referrer_id is None:
+        _stats_cache.clear()
+    else:
+        _stats_cache.pop(referrer_id, None)
+
+
+async def get_referral_stats(user_id: int) -> dict:
+    """
+    Количество приглашённых и заработок на рефералах.
+    Из кэша или одним поиском по первичному ключу referral_stats.
+    """
+    cached = _stats_cache.get(user_id)
+    if cached is not None and time.monotonic() - cached[0] < REFERRAL_STATS_CACHE_TTL:
+        _stats_cache.move_to_end(user_id)
+        return cached[1]
+
+    row = await db_fetchone(
+        "SELECT referral_count, earnings_minor FROM referral_stats WHERE referrer_id = ?", (user_id,)
+    )
+    stats = {
+        "count": row[0] if row else 0,
+        "earnings": row[1] / MINOR_UNITS if row else 0,
+    }
+    _stats_cache[user_id] = (time.monotonic(), stats)
+    _stats_cache.move_to_end(user_id)
+    if len(_stats_cache) > REFERRAL_STATS_CACHE_SIZE:
+        _stats_cache.popitem(last=False)
+    return stats
+
+
+def rebuild_referral_stats_sync(conn) -> int:
+    """
+    Пересчитывает referral_stats по таблице рефералов и журналу бонусов.
+    :return: Количество пользователей с рефералами
+    """
+    conn.execute("DELETE FROM referral_stats")
+    conn.execute("""
+        INSERT INTO referral_stats (referrer_id, referral_count, earnings_minor)
+        SELECT user_id, SUM(referral_count), SUM(earnings_minor)
+        FROM (
+            -- Прямые рефералы; за тех, кому бонус начислен до журнала, считаем прежние 10 VED
+            SELECT r.referrer_id AS user_id, COUNT(*) AS referral_count,
+                   SUM(CASE WHEN l.id IS NULL THEN ? ELSE 0 END) AS earnings_minor
+            FROM referrals r
+            JOIN users u ON u.user_id = r.referrer_id
+            LEFT JOIN ledger l
+                ON l.user_id = r.referrer_id AND l.kind = 'referral_bonus' AND l.reference = 'referral:' || r.referred_id
+            GROUP BY r.referrer_id
+            UNION ALL
+            -- Все реферальные бонусы из журнала, включая бонусы с дальних уровней
+            SELECT user_id, 0, SUM(amount_minor)
+            FROM ledger WHERE kind = 'referral_bonus'
+            GROUP BY user_id
+        )
+        GROUP BY user_id
+    """, (LEGACY_REFERRAL_BONUS_MINOR,))
+    return conn.execute("SELECT COUNT(*) FROM referral_stats").fetchone()[0]
+
+
+async def rebuild_referral_stats() -> int:
+    count = await run_write(rebuild_referral_stats_sync)
+    invalidate_referral_stats()
+    return count
+
+
+async def get_descendants(user_id: int, max_depth: int = 1, limit: int = 1000) -> list[tuple[int, int]]:
+    """
+    Потомки пользователя в дереве рефералов до глубины max_depth.
+    :return: Список пар (ID потомка, уровень), ближние уровни первыми
+    """
+    rows = await db_fetchall("""
+        SELECT descendant_id, depth FROM referral_tree
+        WHERE ancestor_id = ? AND depth <= ?
+        ORDER BY depth, descendant_id
+        LIMIT ?
+    """, (user_id, max_depth, limit))
+    return [tuple(row) for row in rows]
+
+
+async def get_ancestors(user_id: int, max_depth: int = REFERRAL_TREE_MAX_DEPTH) -> list[tuple[int, int]]:
+    """Цепочка пригласивших: список пар (ID предка, уровень) от прямого пригласившего вверх."""
+    rows = await db_fetchall("""
+        SELECT ancestor_id, depth FROM referral_tree
+        WHERE descendant_id = ? AND depth <= ?
+        ORDER BY depth
+    """, (user_id, max_depth))
+    return [tuple(row) for row in rows]
+
+
+async def get_level_counts(user_id: int, max_depth: int = REFERRAL_TREE_MAX_DEPTH) -> dict[int, int]:
+    """Размер реферальной сети по уровням: {уровень: количество пользователей}."""
+    rows = await db_fetchall("""
+        SELECT depth, COUNT(*) FROM referral_tree
+        WHERE ancestor_id = ? AND depth <= ?
+        GROUP BY depth
+    """, (user_id, max_depth))
+    return {depth: count for depth, count in rows}
+
+
+def rebuild_referral_tree_sync(conn) -> int:
+    """
+    Строит таблицу замыканий заново по таблице рефералов.
+    :return: Количество связей предок-потомок
+    """
+    conn.execute("DELETE FROM referral_tree")
+    conn.execute("""
+        WITH RECURSIVE tree (ancestor_id, descendant_id, depth) AS (
+            SELECT referrer_id, referred_id, 1 FROM referrals
+            UNION ALL
+            SELECT t.ancestor_id, r.referred_id, t.depth + 1
+            FROM tree t
+            JOIN referrals r ON r.referrer_id = t.descendant_id
+            WHERE t.depth < ?
+        )
+        INSERT OR IGNORE INTO referral_tree (ancestor_id, descendant_id, depth)
+        SELECT ancestor_id, descendant_id, MIN(depth) FROM tree GROUP BY ancestor_id, descendant_id
+    """, (REFERRAL_TREE_MAX_DEPTH,))
+    return conn.execute("SELECT COUNT(*) FROM referral_tree").fetchone()[0]
+
+
+async def rebuild_referral_tree() -> int:
+    return await run_write(rebuild_referral_tree_sync)
@@ -0,0 +1,67 @@
+import re
+from typing import Optional
+from utils.db_helpers import db_fetchall
+
+# Сколько слов запроса учитывать (остальные отбрасываются, чтобы запрос оставался быстрым)
+SEARCH_MAX_TERMS = 8
+
+# Веса столбцов для bm25: совпадение в названии важнее совпадения в описании
+PRODUCT_WEIGHTS = (10.0, 1.0, 3.0)  # name, description, type
+COURSE_WEIGHTS = (10.0, 1.0, 5.0)  # title, description, tags
+
+_TERM_RE = re.compile(r"\w+")
+
+
+def normalize_text(text: str) -> str:
+    """Та же нормализация, что и при индексации (migrations.fts_normalized)."""
+    return text.replace("ё", "е").replace("Ё", "Е")
+
+
+def split_terms(text: str, limit: Optional[int] = SEARCH_MAX_TERMS) -> list[str]:
+    """Слова текста в нижнем регистре (не больше limit; None — все слова)."""
+    return _TERM_RE.findall(normalize_text(text).lower())[:limit]
+
+
+def build_match_query(text: str) -> Optional[str]:
+    """
+    Преобразует пользовательский ввод в выражение MATCH для FTS5: каждое слово ищется по префиксу,
+    все слова должны встретиться. Слова берутся в кавычки, поэтому операторы FTS5 во вводе не работают.
+    :return: None, если во вводе нет ни одного слова
+    """
+    terms = split_terms(text)
+    if not terms:
+        return None
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+async def search_catalog(text: str, limit: int = 10, offset: int = 0) -> list[dict]:
+    """
+    Полнотекстовый поиск по видимым продуктам и курсам, лучшие совпадения первыми (bm25).
+    :return: Список словарей с ключами kind ("product" или "course"), id, title, description, price
+    """
+    match = build_match_query(text)
+    if match is None:
+        return []
+    rows = await db_fetchall(f"""
+        SELECT 'product', p.id, p.name, p.description, p.price, bm25(products_fts, {", ".join(map(str, PRODUCT_WEIGHTS))}) AS score
+        FROM products_fts
+        JOIN products p ON p.id = products_fts.rowid
+        WHERE products_fts MATCH ? AND p.is_hidden = 0
+        UNION ALL
+        SELECT 'course', c.id, c.title, c.description, NULL, bm25(courses_fts, {", ".join(map(str, COURSE_WEIGHTS))}) AS score
+        FROM courses_fts
+        JOIN courses c ON c.id = courses_fts.rowid
+        WHERE courses_fts MATCH ?
+        ORDER BY score
+        LIMIT ? OFFSET ?
+    """, (match, match, limit, offset))
+    return [
+        {
+            "kind": row[0],
+            "id": row[1],
+            "title": row[2],
+            "description": row[3],
+            "price": row[4],
+        }
+        for row in rows
+    ]
@@ -0,0 +1,348 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import time
+from typing import Any, Callable, Optional
+import config
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from utils.webhook import BoundedRequestHandler, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_MAX_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+# Количество процессов-обработчиков; 1 — всё в одном процессе, как раньше
+BOT_WORKERS = getattr(config, "BOT_WORKERS", 1)
+# Сколько обновлений может ждать в очереди одного обработчика; при заполнении приём новых обновлений притормаживает
+SHARD_QUEUE_SIZE = getattr(config, "SHARD_QUEUE_SIZE", 1000)
+# Сколько обновлений один обработчик обрабатывает одновременно (разных чатов)
+SHARD_WORKER_CONCURRENCY = getattr(config, "SHARD_WORKER_CONCURRENCY", 100)
+# Как часто (в секундах) обработчики присылают метрики
+SHARD_METRICS_INTERVAL = getattr(config, "SHARD_METRICS_INTERVAL", 10)
+# Сколько секунд при остановке ждать, пока обработчики доделают начатое
+SHARD_STOP_TIMEOUT = getattr(config, "SHARD_STOP_TIMEOUT", 30)
+
+# Пауза перед повторной попыткой положить обновление в заполненную очередь
+_BACKPRESSURE_DELAY = 0.01
+# Пауза обработчика при пустой очереди: растёт от минимальной до максимальной, пока обновлений нет
+_IDLE_DELAY_MIN = 0.001
+_IDLE_DELAY_MAX = 0.02
+
+# Объекты обновления, в которых есть чат или пользователь (порядок не важен: в обновлении ровно один из них)
+_UPDATE_PAYLOADS = (
+    "message", "edited_message", "channel_post", "edited_channel_post", "business_message",
+    "edited_business_message", "callback_query", "inline_query", "chosen_inline_result",
+    "shipping_query", "pre_checkout_query", "poll_answer", "my_chat_member", "chat_member",
+    "chat_join_request", "message_reaction", "message_reaction_count", "chat_boost", "removed_chat_boost",
+)
+
+
+def shard_key(update: dict) -> int:
+    """
+    Ключ распределения обновления: ID чата, а если чата нет (инлайн-запросы, опросы) — ID пользователя.
+    Все обновления одного чата попадают в один процесс и обрабатываются по порядку.
+    """
+    for name in _UPDATE_PAYLOADS:
+        payload = update.get(name)
+        if payload is None:
+            continue
+        chat = payload.get("chat") or (payload.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        user = payload.get("from") or payload.get("user") or {}
+        if "id" in user:
+            return user["id"]
+    return update.get("update_id", 0)
+
+
+class ShardWorker:
+    """
+    Обработчик обновлений в отдельном процессе.
+
+    Забирает обновления из своей очереди и передаёт их диспетчеру. Обновления разных чатов
+    обрабатываются параллельно (не больше SHARD_WORKER_CONCURRENCY), одного чата — строго по очереди.
+    """
+
+    def __init__(self, index: int, dp: Dispatcher, bot: Bot, updates, metrics,
+                 concurrency: int = SHARD_WORKER_CONCURRENCY):
+        self.index = index
+        self.dp = dp
+        self.bot = bot
+        self.updates = updates
+        self.metrics = metrics
+        self._slots = asyncio.Semaphore(concurrency)
+        self._chat_tails = {}  # ID чата -> последняя задача этого чата
+        self._tasks = set()
+        self.processed = 0
+        self.failed = 0
+        self._busy_time = 0.0
+
+    async def _process(self, chat_id: int, update: dict, previous: Optional[asyncio.Task]):
+        try:
+            if previous is not None:
+                # Предыдущее обновление этого чата должно закончиться первым (ошибку уже учла его задача)
+                await asyncio.wait([previous])
+            started = time.perf_counter()
+            try:
+                await self.dp.feed_raw_update(self.bot, update)
+                self.processed += 1
+            except Exception:
+                # Подробности уже записал в лог диспетчер
+                self.failed += 1
+            self._busy_time += time.perf_counter() - started
+        finally:
+            self._slots.release()
+            if self._chat_tails.get(chat_id) is asyncio.current_task():
+                del self._chat_tails[chat_id]
+
+    def _start(self, update: dict):
+        chat_id = shard_key(update)
+        task = asyncio.create_task(self._process(chat_id, update, self._chat_tails.get(chat_id)))
+        self._chat_tails[chat_id] = task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def snapshot(self) -> dict:
+        handled = self.processed + self.failed
+        return {
+            "worker": self.index,
+            "pid": os.getpid(),
+            "processed": self.processed,
+            "failed": self.failed,
+            "in_flight": len(self._tasks),
+            "chats": len(self._chat_tails),
+            "avg_ms": round(self._busy_time / handled * 1000, 2) if handled else 0.0,
+        }
+
+    def _publish_metrics(self):
+        try:
+            self.metrics.put_nowait(self.snapshot())
+        except queue.Full:
+            pass
+
+    async def _report_metrics(self):
+        while True:
+            await asyncio.sleep(SHARD_METRICS_INTERVAL)
+            self._publish_metrics()
+
+    async def _next_update(self):
+        # Блокирующий get() ждёт, удерживая общую блокировку чтения очереди: если процесс упадёт в это
+        # время, перезапущенный обработчик не сможет читать из той же очереди. get_nowait() держит её
+        # только на время чтения готового обновления, в том же потоке, что и обработчики
+        delay = _IDLE_DELAY_MIN
+        while True:
+            try:
+                return self.updates.get_nowait()
+            except queue.Empty:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, _IDLE_DELAY_MAX)
+
+    async def run(self):
+        reporter = asyncio.create_task(self._report_metrics())
+        try:
+            while True:
+                # Новое обновление берём из очереди только при свободном месте — иначе очередь копится
+                # у супервизора и он притормаживает приём
+                await self._slots.acquire()
+                update = await self._next_update()
+                if update is None:
+                    self._slots.release()
+                    break
+                self._start(update)
+            if self._tasks:
+                await asyncio.wait(set(self._tasks))
+        finally:
+            reporter.cancel()
+            self._publish_metrics()
+
+
+async def _serve_shard(index: int, factory: Callable[[], tuple[Dispatcher, Bot]], updates, metrics):
+    dp, bot = factory()
+    await dp.emit_startup(bot=bot, dispatcher=dp, shard=index, **dp.workflow_data)
+    try:
+        await ShardWorker(index, dp, bot, updates, metrics).run()
+    finally:
+        await dp.emit_shutdown(bot=bot, dispatcher=dp, shard=index, **dp.workflow_data)
+        await bot.session.close()
+
+
+def _worker_main(index: int, factory: Callable[[], tuple[Dispatcher, Bot]], updates, metrics):
+    # Ctrl+C получает вся группа процессов; останавливает обработчики только супервизор
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_serve_shard(index, factory, updates, metrics))
+
+
+class ShardSupervisor:
+    """
+    Распределяет обновления по процессам-обработчикам по ID чата.
+
+    У каждого обработчика своя ограниченная очередь (multiprocessing.Queue): когда она заполнена,
+    dispatch ждёт, и вместе с ним ждёт приём обновлений (ответ вебхуку или следующий getUpdates).
+    Упавший обработчик перезапускается с той же очередью — ждущие в ней обновления не теряются.
+    factory создаёт (dp, bot) в процессе обработчика и должна быть функцией уровня модуля.
+    """
+
+    def __init__(self, factory: Callable[[], tuple[Dispatcher, Bot]], workers: int = BOT_WORKERS,
+                 queue_size: int = SHARD_QUEUE_SIZE):
+        self.factory = factory
+        self.workers = workers
+        self._context = multiprocessing.get_context("spawn")
+        self._queues = [self._context.Queue(queue_size) for _ in range(workers)]
+        self._metrics_queue = self._context.Queue()
+        self._processes = [None] * workers
+        self._restarts = [0] * workers
+        self._dispatched = [0] * workers
+        self._waits = [0] * workers  # Сколько раз пришлось ждать места в очереди
+        self._worker_metrics = [{} for _ in range(workers)]
+        self._tasks = []
+        self._stopping = False
+
+    def shard_for(self, update: dict) -> int:
+        return shard_key(update) % self.workers
+
+    def _spawn(self, index: int):
+        process = self._context.Process(
+            target=_worker_main,
+            args=(index, self.factory, self._queues[index], self._metrics_queue),
+            name=f"bot-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        self._processes[index] = process
+        logger.info("Обработчик %s запущен (pid %s)", index, process.pid)
+
+    async def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+        self._tasks = [asyncio.create_task(self._watch()), asyncio.create_task(self._collect_metrics())]
+
+    async def dispatch(self, update: dict):
+        """Ставит сырое обновление (dict из JSON Bot API) в очередь его обработчика."""
+        index = self.shard_for(update)
+        target = self._queues[index]
+        while True:
+            try:
+                target.put_nowait(update)
+                break
+            except queue.Full:
+                self._waits[index] += 1
+                await asyncio.sleep(_BACKPRESSURE_DELAY)
+        self._dispatched[index] += 1
+
+    async def _watch(self):
+        while not self._stopping:
+            for index, process in enumerate(self._processes):
+                if process is not None and not process.is_alive() and not self._stopping:
+                    self._restarts[index] += 1
+                    logger.error("Обработчик %s завершился с кодом %s, перезапускаем", index, process.exitcode)
+                    self._spawn(index)
+            await asyncio.sleep(1)
+
+    async def _collect_metrics(self):
+        loop = asyncio.get_running_loop()
+        last_report = time.monotonic()
+        while True:
+            try:
+                snapshot = await loop.run_in_executor(None, self._metrics_queue.get, True, 1)
+                self._worker_metrics[snapshot["worker"]] = snapshot
+            except queue.Empty:
+                pass
+            if time.monotonic() - last_report >= SHARD_METRICS_INTERVAL:
+                last_report = time.monotonic()
+                for worker in self.metrics():
+                    logger.info("Метрики обработчика: %s", worker)
+
+    def metrics(self) -> list[dict]:
+        """Последние метрики каждого обработчика и состояние его очереди."""
+        result = []
+        for index in range(self.workers):
+            process = self._processes[index]
+            result.append({
+                **self._worker_metrics[index],
+                "worker": index,
+                "alive": process is not None and process.is_alive(),
+                "queued": self._queues[index].qsize(),
+                "dispatched": self._dispatched[index],
+                "backpressure_waits": self._waits[index],
+                "restarts": self._restarts[index],
+            })
+        return result
+
+    async def stop(self, timeout: float = SHARD_STOP_TIMEOUT):
+        """Обработчики доделывают всё, что уже в очередях, и завершаются; зависшие — принудительно."""
+        self._stopping = True
+        loop = asyncio.get_running_loop()
+        for updates in self._queues:
+            await loop.run_in_executor(None, updates.put, None)
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            await loop.run_in_executor(None, process.join, max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                logger.warning("Обработчик %s не остановился вовремя", process.name)
+                process.terminate()
+        # Последние метрики, которые обработчики прислали при остановке
+        while True:
+            try:
+                snapshot = self._metrics_queue.get_nowait()
+            except queue.Empty:
+                break
+            self._worker_metrics[snapshot["worker"]] = snapshot
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+class ShardedRequestHandler(BoundedRequestHandler):
+    """Вебхук супервизора: проверяет секрет и передаёт обновление обработчику его чата."""
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, supervisor: ShardSupervisor, **kwargs: Any):
+        super().__init__(dispatcher, bot, **kwargs)
+        self.supervisor = supervisor
+
+    async def _background_feed_update(self, bot: Bot, update: dict[str, Any]) -> None:
+        await self.supervisor.dispatch(update)
+
+
+def create_ingress_app(dp: Dispatcher, bot: Bot, supervisor: ShardSupervisor, secret_token: str = WEBHOOK_SECRET,
+                       max_concurrency: int = WEBHOOK_MAX_CONCURRENCY) -> web.Application:
+    """
+    Приложение aiohttp супервизора: вебхук на WEBHOOK_PATH и метрики обработчиков на /metrics.
+    Диспетчер здесь нужен только для проверки секрета и списка типов обновлений — обновления он не обрабатывает.
+    """
+    app = web.Application()
+    ShardedRequestHandler(dp, bot, supervisor, secret_token=secret_token, max_concurrency=max_concurrency).register(
+        app, path=WEBHOOK_PATH
+    )
+
+    async def metrics(_):
+        return web.json_response(supervisor.metrics())
+
+    async def start_workers(_):
+        await supervisor.start()
+
+    async def stop_workers(_):
+        await supervisor.stop()
+
+    app.router.add_get("/metrics", metrics)
+    app.on_startup.append(start_workers)
+    # Регистрируется после обработчика вебхука: сначала принятые обновления попадают в очереди, затем остановка
+    app.on_shutdown.append(stop_workers)
+    return app
+
+
+async def poll_updates(dp: Dispatcher, bot: Bot, supervisor: ShardSupervisor, timeout: int = 30):
+    """Long polling в супервизоре: обновления по порядку раздаются обработчикам."""
+    allowed_updates = dp.resolve_used_update_types()
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=timeout, allowed_updates=allowed_updates)
+        except Exception:
+            logger.exception("Не удалось получить обновления")
+            await asyncio.sleep(5)
+            continue
+        for update in updates:
+            await supervisor.dispatch(update.model_dump(mode="json", exclude_none=True))
+            offset = update.update_id + 1
@@ -0,0 +1,36 @@
+import config
+
+# Настройки хранилища SQLite. Любой параметр можно переопределить в config.py,
+# иначе используются значения по умолчанию, подобранные для бота с большим числом коротких запросов.
+
+# Режим журнала: WAL позволяет читателям работать параллельно с записью
+SQLITE_JOURNAL_MODE = getattr(config, "SQLITE_JOURNAL_MODE", "WAL")
+# NORMAL в режиме WAL безопасен при сбое процесса и не делает fsync на каждый commit
+SQLITE_SYNCHRONOUS = getattr(config, "SQLITE_SYNCHRONOUS", "NORMAL")
+# Размер кэша страниц: отрицательное значение — в килобайтах (здесь 16 МБ на соединение)
+SQLITE_CACHE_SIZE = getattr(config, "SQLITE_CACHE_SIZE", -16000)
+# Объём файла БД, читаемый через mmap (в байтах)
+SQLITE_MMAP_SIZE = getattr(config, "SQLITE_MMAP_SIZE", 64 * 1024 * 1024)
+# Сколько миллисекунд ждать освобождения блокировки, прежде чем вернуть "database is locked"
+SQLITE_BUSY_TIMEOUT = getattr(config, "SQLITE_BUSY_TIMEOUT", 5000)
+
+# Количество соединений для чтения (и потоков, в которых они используются)
+DB_POOL_SIZE = getattr(config, "DB_POOL_SIZE", 4)
+# Максимальное количество операций записи, фиксируемых одним commit
+DB_WRITE_BATCH_SIZE = getattr(config, "DB_WRITE_BATCH_SIZE", 64)
+
+
+def connection_pragmas() -> list[str]:
+    """PRAGMA, которые выполняются при открытии каждого соединения."""
+    return [
+        f"PRAGMA busy_timeout = {int(SQLITE_BUSY_TIMEOUT)}",
+        f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}",
+        f"PRAGMA cache_size = {int(SQLITE_CACHE_SIZE)}",
+        f"PRAGMA mmap_size = {int(SQLITE_MMAP_SIZE)}",
+        "PRAGMA temp_store = MEMORY",
+    ]
+
+
+def apply_journal_mode(conn):
+    """Включает режим журнала; для WAL он сохраняется в файле БД и действует для всех соединений."""
+    return conn.execute(f"PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}").fetchone()[0]
@@ -0,0 +1,70 @@
+import re
+from typing import Optional
+from utils.db_helpers import run_write, db_fetchone, db_fetchall
+
+# Максимальная длина тега в символах (кнопки облака тегов ссылаются на тег по ID, а не по тексту)
+TAG_MAX_LENGTH = 32
+
+# Сколько самых популярных тегов показывать в облаке
+TAG_CLOUD_SIZE = 20
+
+_SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_tag(tag: str) -> str:
+    """Приводит тег к единому виду: без «#» и лишних пробелов, в нижнем регистре, «ё» → «е»."""
+    tag = _SPACES_RE.sub(" ", tag.strip().lstrip("#").strip()).lower().replace("ё", "е")
+    return tag[:TAG_MAX_LENGTH]
+
+
+def normalize_tags(tags) -> list[str]:
+    """Нормализует теги, отбрасывая пустые и повторяющиеся (порядок сохраняется)."""
+    result = []
+    for tag in map(normalize_tag, tags):
+        if tag and tag not in result:
+            result.append(tag)
+    return result
+
+
+def set_course_tags_sync(conn, course_id: int, tags: list[str]) -> list[str]:
+    """
+    Заменяет теги курса в course_tags. Счётчики tag_counts обновляют триггеры.
+    В courses.tags сохраняется та же строка через запятую — её индексирует полнотекстовый поиск.
+    :return: Нормализованные теги
+    """
+    tags = normalize_tags(tags)
+    current = {row[0] for row in conn.execute("SELECT tag FROM course_tags WHERE course_id = ?", (course_id,))}
+    conn.executemany(
+        "DELETE FROM course_tags WHERE tag = ? AND course_id = ?",
+        [(tag, course_id) for tag in current.difference(tags)],
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO course_tags (tag, course_id) VALUES (?, ?)",
+        [(tag, course_id) for tag in tags if tag not in current],
+    )
+    conn.execute("UPDATE courses SET tags = ? WHERE id = ?", (",".join(tags), course_id))
+    return tags
+
+
+async def set_course_tags(course_id: int, tags: list[str]) -> list[str]:
+    return await run_write(set_course_tags_sync, course_id, tags)
+
+
+async def get_tag_cloud(limit: int = TAG_CLOUD_SIZE) -> list[dict]:
+    """Самые популярные теги с количеством курсов (по индексу счётчиков, без подсчёта курсов)."""
+    rows = await db_fetchall("""
+        SELECT id, tag, course_count FROM tag_counts
+        ORDER BY course_count DESC, tag
+        LIMIT ?
+    """, (limit,))
+    return [{"id": row[0], "tag": row[1], "count": row[2]} for row in rows]
+
+
+async def get_tag(tag: str) -> Optional[dict]:
+    row = await db_fetchone("SELECT id, tag, course_count FROM tag_counts WHERE tag = ?", (normalize_tag(tag),))
+    return {"id": row[0], "tag": row[1], "count": row[2]} if row else None
+
+
+async def get_tag_by_id(tag_id: int) -> Optional[dict]:
+    row = await db_fetchone("SELECT id, tag, course_count FROM tag_counts WHERE id = ?", (tag_id,))
+    return {"id": row[0], "tag": row[1], "count": row[2]} if row else None
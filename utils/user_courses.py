@@ -0,0 +1,53 @@
+import time
+from collections import OrderedDict
+import config
+from utils.db_helpers import db_fetchall
+
+# Сколько пользователей держать в индексе купленных курсов и сколько секунд индекс считается актуальным.
+# Покупки через payment.py и database.py сбрасывают индекс пользователя сразу, TTL — страховка
+USER_COURSES_CACHE_SIZE = getattr(config, "USER_COURSES_CACHE_SIZE", 10000)
+USER_COURSES_CACHE_TTL = getattr(config, "USER_COURSES_CACHE_TTL", 300)
+
+# user_id -> (время загрузки, {ID курса: название}); самые давно запрошенные вытесняются первыми
+_user_courses = OrderedDict()
+
+
+def invalidate_user_courses(user_id: int = None):
+    """Сбрасывает индекс курсов пользователя (или всех пользователей, например после удаления курса)."""
+    if user_id is None:
+        _user_courses.clear()
+    else:
+        _user_courses.pop(user_id, None)
+
+
+async def _get_course_index(user_id: int) -> dict[int, str]:
+    cached = _user_courses.get(user_id)
+    if cached is not None and time.monotonic() - cached[0] < USER_COURSES_CACHE_TTL:
+        _user_courses.move_to_end(user_id)
+        return cached[1]
+
+    # Курс покупается как продукт с тем же ID (см. purchase_course и get_next_lesson)
+    rows = await db_fetchall("""
+        SELECT DISTINCT c.id, c.title
+        FROM purchases p
+        JOIN courses c ON c.id = p.product_id
+        WHERE p.user_id = ?
+        ORDER BY c.id
+    """, (user_id,))
+    index = {row[0]: row[1] for row in rows}
+
+    _user_courses[user_id] = (time.monotonic(), index)
+    _user_courses.move_to_end(user_id)
+    if len(_user_courses) > USER_COURSES_CACHE_SIZE:
+        _user_courses.popitem(last=False)
+    return index
+
+
+async def get_user_courses(user_id: int) -> list[dict]:
+    """Купленные пользователем курсы: [{"id": ..., "title": ...}] в порядке ID."""
+    return [{"id": course_id, "title": title} for course_id, title in (await _get_course_index(user_id)).items()]
+
+
+async def user_has_course(user_id: int, course_id: int) -> bool:
+    """Куплен ли курс пользователем."""
+    return course_id in await _get_course_index(user_id)
@@ -0,0 +1,113 @@
+import asyncio
+import hashlib
+import logging
+from typing import Any
+import config
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+logger = logging.getLogger(__name__)
+
+# Способ получения обновлений: "polling" (по умолчанию) или "webhook"
+BOT_MODE = getattr(config, "BOT_MODE", "polling")
+# Публичный адрес, на который Telegram отправляет обновления, например "https://bot.example.com"
+WEBHOOK_BASE_URL = getattr(config, "WEBHOOK_BASE_URL", "")
+WEBHOOK_PATH = getattr(config, "WEBHOOK_PATH", "/webhook")
+# Секрет из заголовка X-Telegram-Bot-Api-Secret-Token; по умолчанию выводится из токена бота
+WEBHOOK_SECRET = getattr(config, "WEBHOOK_SECRET", None) or hashlib.sha256(config.TOKEN.encode()).hexdigest()
+# Адрес, на котором слушает aiohttp (обычно за обратным прокси с TLS)
+WEBAPP_HOST = getattr(config, "WEBAPP_HOST", "127.0.0.1")
+WEBAPP_PORT = getattr(config, "WEBAPP_PORT", 8080)
+# Сколько обновлений обрабатывается одновременно; остальные ждут, не получив ответа
+WEBHOOK_MAX_CONCURRENCY = getattr(config, "WEBHOOK_MAX_CONCURRENCY", 100)
+# Сколько секунд при остановке ждать завершения начатых обработчиков
+WEBHOOK_DRAIN_TIMEOUT = getattr(config, "WEBHOOK_DRAIN_TIMEOUT", 30)
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """
+    Обработчик вебхука с ограничением числа одновременно обрабатываемых обновлений.
+
+    Telegram получает ответ 200 сразу после того, как обновление принято в работу. Когда все места заняты,
+    ответ задерживается — Telegram не присылает новые обновления сверх max_connections и повторит
+    непринятые сам, поэтому очередь не растёт в памяти бота.
+    При остановке новые обновления не принимаются, а начатые дорабатывают до WEBHOOK_DRAIN_TIMEOUT.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: str,
+                 max_concurrency: int = WEBHOOK_MAX_CONCURRENCY, drain_timeout: float = WEBHOOK_DRAIN_TIMEOUT,
+                 **data: Any):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token, **data)
+        self.drain_timeout = drain_timeout
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._closing = False
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        if self._closing:
+            # Telegram повторит обновление, когда бот снова запустится
+            return web.Response(status=503)
+        update = await request.json(loads=bot.session.json_loads)
+        await self._slots.acquire()
+        task = asyncio.create_task(self._background_feed_update(bot=bot, update=update))
+        self._background_feed_update_tasks.add(task)
+        task.add_done_callback(self._background_feed_update_tasks.discard)
+        task.add_done_callback(lambda _: self._slots.release())
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def close(self) -> None:
+        self._closing = True
+        pending = set(self._background_feed_update_tasks)
+        if pending:
+            logger.info("Ждём завершения обработки обновлений: %s", len(pending))
+            _, pending = await asyncio.wait(pending, timeout=self.drain_timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.warning("Не дождались обработки обновлений: %s", len(pending))
+        await super().close()
+
+
+def create_webhook_app(dp: Dispatcher, bot: Bot, secret_token: str = WEBHOOK_SECRET,
+                       max_concurrency: int = WEBHOOK_MAX_CONCURRENCY, **data: Any) -> web.Application:
+    """
+    Приложение aiohttp, принимающее обновления на WEBHOOK_PATH.
+    Хуки запуска и остановки диспетчера вызываются при запуске и остановке приложения.
+    """
+    app = web.Application()
+    # Порядок важен: при остановке сначала дорабатывают начатые обновления, затем срабатывает dp.shutdown
+    BoundedRequestHandler(dp, bot, secret_token=secret_token, max_concurrency=max_concurrency, **data).register(
+        app, path=WEBHOOK_PATH
+    )
+    setup_application(app, dp, bot=bot, **data)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, app: web.Application = None):
+    """
+    Регистрирует вебхук в Telegram и обслуживает его до остановки процесса.
+    :param app: Готовое приложение (например, вебхук супервизора); по умолчанию — create_webhook_app
+    """
+    if app is None:
+        app = create_webhook_app(dp, bot)
+
+    async def set_webhook(_):
+        await bot.set_webhook(
+            f"{WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            # Telegram допускает от 1 до 100 одновременных соединений
+            max_connections=min(WEBHOOK_MAX_CONCURRENCY, 100),
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logger.info("Вебхук зарегистрирован: %s%s", WEBHOOK_BASE_URL, WEBHOOK_PATH)
+
+    # Вебхук не удаляется при остановке: обновления, пришедшие во время перезапуска, Telegram доставит позже
+    app.on_startup.append(set_webhook)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT).start()
+        logger.info("Принимаем обновления на %s:%s%s", WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_PATH)
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()